@@ -0,0 +1,123 @@
+"""
+Compare threaded and asyncio fan-out of per-computer Jamf Pro requests.
+
+The stand-in Jamf Pro server runs in a separate process with a fixed
+latency per request, as a remote server would, so only the client side is
+measured. For each concurrency a GET (name lookup) and an unmanage PUT is
+sent for every computer, either from a thread pool sharing one
+JamfProClient or from one thread with asyncjamf. The threaded client gets
+a connection pool as large as its pool, and neither client an adaptive
+write limit, so both paths keep the same number of requests in flight. CPU is the client
+process's CPU time.
+
+Usage: python asyncfanout.py [--computers N] [--concurrency N [N ...]] [--latency SECONDS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import standins
+
+
+UNMANAGE_XML = '<computer><general><remote_management><managed>false</managed></remote_management></general></computer>'
+
+
+def serve(fleet_size, latency):
+    """
+    Runs inside the server process. Prints the server URL, then serves until stdin closes.
+    """
+    jamf = standins.JamfProStandIn(fleet_size=fleet_size, latency=latency).start()
+    print(jamf.url, flush=True)
+    sys.stdin.read()
+    jamf.stop()
+
+
+def threaded(url, method, paths, concurrency):
+    """
+    :return: Integer The number of successful requests.
+    """
+    import jamfpro
+
+    client = jamfpro.JamfProClient(url, 'standin', 'standin', pool_maxsize=concurrency, write_concurrency=0)
+    client.token()
+    if method == 'GET':
+        call = client.get_json
+    else:
+        def call(path):
+            return client.put_xml(path, UNMANAGE_XML)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sum(1 for result in executor.map(call, paths) if result is not None)
+
+
+def asynchronous(url, method, paths, concurrency):
+    """
+    :return: Integer The number of successful requests.
+    """
+    import asyncjamf
+    import jamfpro
+
+    client = jamfpro.JamfProClient(url, 'standin', 'standin', write_concurrency=0)
+    client.token()
+    if method == 'GET':
+        return sum(1 for result in asyncjamf.get_json_many(client, paths, concurrency) if result is not None)
+    return sum(asyncjamf.put_xml_many(client, [(path, UNMANAGE_XML) for path in paths], concurrency))
+
+
+def measure(run, url, method, paths, concurrency):
+    """
+    :return: Tuple containing the wall time and client CPU time in seconds.
+    """
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    succeeded = run(url, method, paths, concurrency)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    assert succeeded == len(paths), (succeeded, len(paths))
+    return elapsed, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--computers', type=int, default=2000,
+                        help='Requests of each kind per run, one per computer (default 2000)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100, 200],
+                        help='Requests in flight: threads, or the asyncio limit (default 10 50 100 200)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds the server takes to answer each request (default 0.05)')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.latency)
+
+    sys.path.insert(0, standins.COMMON_DIR)
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve', str(args.computers), '--latency', str(args.latency)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    try:
+        url = server.stdout.readline().strip()
+        requests_by_method = {
+            'GET': [f'/JSSResource/computers/id/{i}/subset/General' for i in range(1, args.computers + 1)],
+            'PUT': [f'/JSSResource/computers/id/{i}' for i in range(1, args.computers + 1)],
+        }
+
+        print(f'{"Method":<7} {"In flight":>9} {"Client":<9} {"Time":>9} {"Requests/s":>11} {"CPU/request":>12}')
+        for method, paths in requests_by_method.items():
+            for concurrency in args.concurrency:
+                for label, run in (('threads', threaded), ('asyncio', asynchronous)):
+                    elapsed, cpu = measure(run, url, method, paths, concurrency)
+                    print(f'{method:<7} {concurrency:>9} {label:<9} {elapsed * 1000:>7.0f}ms '
+                          f'{len(paths) / elapsed:>11.0f} {cpu / len(paths) * 1e6:>10.0f}us')
+    finally:
+        server.stdin.close()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Check that runs split by the time budget finish and match a single run.
+
+Discovery (both sources, with delta discovery) and the site-scoped
+EncryptionReport run twice against the stand-ins: once in one invocation
+with plenty of time, and once with a short timeout, following each
+continuation the handler starts until the run finishes. For every split run
+the number of parts, the longest part, and whether the outcome matches the
+single run (computers enqueued and the saved snapshot, or the reported
+counts) are printed.
+
+Usage: python checkpoints.py [--fleet-size N] [--sites N] [--timeout SECONDS] [--reserve SECONDS]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import standins
+
+
+DISCOVERY_QUEUE = 'standin://discovery'
+
+
+def run_parts(handler, timeout, lambda_client, quiet):
+    """
+    Invoke a handler, then every continuation it starts, until none is left.
+
+    :return: Tuple containing the number of parts, the longest part and the total time in seconds.
+    """
+    events = [{}]
+    parts = 0
+    longest = 0
+    start = time.perf_counter()
+    while events:
+        event = events.pop(0)
+        part_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            handler(event, standins.LambdaContext(timeout))
+        longest = max(longest, time.perf_counter() - part_start)
+        parts += 1
+        events.extend(lambda_client.take())
+    return parts, longest, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--fleet-size', type=int, default=20000, help='Computers in the stand-in fleet (default 20000)')
+    parser.add_argument('--sites', type=int, default=100, help='Sites in the stand-in fleet (default 100)')
+    parser.add_argument('--jamf-latency', type=float, default=0.01,
+                        help='Seconds each Jamf Pro request takes (default 0.01)')
+    parser.add_argument('--aws-latency', type=float, default=0.002,
+                        help='Seconds each stand-in AWS call takes (default 0.002)')
+    parser.add_argument('--timeout', type=float, default=4.0,
+                        help='Function timeout of the split runs in seconds (default 4)')
+    parser.add_argument('--reserve', type=float, default=2.0,
+                        help='CHECKPOINT_RESERVE_SECONDS of the split runs. Keep it above the 1 second '
+                             'Jamf Pro deadline margin (default 2)')
+    parser.add_argument('--verbose', action='store_true', help='Show handler logs and output')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    quiet = not args.verbose
+
+    jamf = standins.JamfProStandIn(fleet_size=args.fleet_size, site_count=args.sites, latency=args.jamf_latency).start()
+    # Every computer is stale and found by the search, so discovery has the whole fleet to enqueue
+    for computer in jamf.computers.values():
+        computer['encrypted'] = True
+        computer['managed'] = True
+        computer['last_contact'] = '2020-01-01T00:00:00Z'
+    ssm = standins.SSMStandIn(standins.workflow_parameters(jamf.url))
+    sqs = standins.SQSStandIn(latency=args.aws_latency)
+    sns = standins.SNSStandIn()
+    lambda_client = standins.LambdaStandIn()
+    standins.install_aws(ssm, sqs, sns, lambda_client=lambda_client)
+    workdir = tempfile.mkdtemp()
+
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'GROUP_NAME': 'Stand-In Search',
+        'SQS_QUEUE_URL': DISCOVERY_QUEUE,
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:standin',
+        'CHECKPOINT_RESERVE_SECONDS': str(args.reserve),
+        'CHECKPOINT_MAX_PARTS': '1000',
+        'REPORT_MODE': 'site_scoped',
+        'HTTP_CACHE_DIR': '',
+        'DEBUG': 'False',
+    })
+
+    print(f'Fleet {args.fleet_size}, {args.sites} sites, Jamf Pro latency {args.jamf_latency * 1000:.0f}ms, '
+          f'split runs time out after {args.timeout:.1f}s with {args.reserve:.1f}s reserved')
+    print(f'{"Scenario":<40} {"Run":<7} {"Parts":>6} {"Longest":>9} {"Total":>9}  Outcome')
+
+    for source in ('advanced_search', 'inventory'):
+        outcomes = {}
+        for label, timeout in (('single', 900), ('split', args.timeout)):
+            snapshot_path = os.path.join(workdir, f'{source}-{label}.json')
+            os.environ.update({'DISCOVERY_SOURCE': source, 'SNAPSHOT_STORE': f'file://{snapshot_path}'})
+            discovery = standins.load_workflow('JP-UnmanageStaleComputers', 'index')
+            parts, longest, total = run_parts(discovery.lambda_handler, timeout, lambda_client, quiet)
+            ids = [json.loads(record['body'])['id'] for record in sqs.drain(DISCOVERY_QUEUE)]
+            with open(snapshot_path) as f:
+                saved = json.load(f)['ids']
+            outcomes[label] = (sorted(set(ids)), saved)
+            outcome = f'{len(ids)} enqueued, {len(set(ids))} distinct, {len(saved)} in snapshot'
+            if label == 'split':
+                outcome += ', matches single' if outcomes['split'] == outcomes['single'] else ', DIFFERS from single'
+            print(f'{"UnmanageDiscovery " + source:<40} {label:<7} {parts:>6} {longest:>8.2f}s {total:>8.2f}s  {outcome}')
+
+    for workers in (1, 4):
+        reports = {}
+        os.environ['MAX_WORKERS'] = str(workers)
+        for label, timeout in (('single', 900), ('split', args.timeout)):
+            report = standins.load_workflow('JP-EncryptionReport', 'index')
+            parts, longest, total = run_parts(report.lambda_handler, timeout, lambda_client, quiet)
+            reports[label] = json.loads(sns.published[-1]['Message'])['email']
+            outcome = f'{len(sns.published)} reports sent'
+            if label == 'split':
+                outcome += ', matches single' if reports['split'] == reports['single'] else ', DIFFERS from single'
+            sns.published.clear()
+            print(f'{f"EncryptionReport site_scoped x{workers}":<40} {label:<7} {parts:>6} {longest:>8.2f}s '
+                  f'{total:>8.2f}s  {outcome}')
+
+    jamf.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Measure cold-start cost for every Jamf Pro workflow handler.
+
+Each module is imported in a fresh interpreter against the local stand-ins,
+then invoked twice. Import time, first (cold) invocation and second (warm)
+invocation are reported in milliseconds, along with the AWS calls made
+before the handler ran.
+
+Usage: python coldstart.py [--aws-latency SECONDS] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+MODULES = [
+    ('JP-EncryptionReport', 'index'),
+    ('JP-UnmanageStaleComputers', 'index'),
+    ('JP-UnmanageStaleComputers', 'unmanage'),
+    ('JP-RemanageStaleComputers', 'index'),
+    ('JP-RemanageStaleComputers', 'remanage'),
+    ('SendToTeams', 'index'),
+]
+
+
+def child(workflow, module_name, aws_latency):
+    """
+    Runs inside the fresh interpreter and prints one JSON result line.
+    """
+    import standins
+
+    jamf = standins.JamfProStandIn(fleet_size=50, site_count=5).start()
+    ssm = standins.SSMStandIn(standins.workflow_parameters(jamf.url), latency=aws_latency)
+    sqs = standins.SQSStandIn(latency=aws_latency)
+    sns = standins.SNSStandIn(latency=aws_latency)
+    standins.install_aws(ssm, sqs, sns, construct_real_clients=True)
+
+    os.environ.update({
+        'GROUP_NAME': 'Stand-In Search',
+        'SQS_QUEUE_URL': 'standin://discovery',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:standin',
+        'SendToTeams_URL': 'standin://teams',
+        'SendToMicrosoftTeams_URL': 'standin://teams',
+        'DEBUG': 'False',
+    })
+
+    start = time.perf_counter()
+    module = standins.load_workflow(workflow, module_name)
+    import_ms = (time.perf_counter() - start) * 1000
+    import_calls = sum(ssm.calls.values())
+
+    if module_name in ('unmanage', 'remanage'):
+        event = {'Records': [{'messageId': '1', 'body': '2'}]}
+    elif workflow == 'SendToTeams':
+        event = {'Records': []}
+    else:
+        event = {}
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        module.lambda_handler(event, None)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    jamf.stop()
+    print(json.dumps({
+        'import_ms': import_ms,
+        'first_ms': timings[0],
+        'warm_ms': timings[1],
+        'aws_calls_at_import': import_calls,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--aws-latency', type=float, default=0.02,
+                        help='Seconds each stand-in AWS call takes (default 0.02)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Fresh interpreters per module; the median is reported (default 3)')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(*args.child, args.aws_latency)
+
+    env = dict(os.environ, AWS_ACCESS_KEY_ID='standin', AWS_SECRET_ACCESS_KEY='standin',
+               AWS_DEFAULT_REGION='us-east-1')
+    print(f'{"Module":<42} {"Import":>9} {"First":>9} {"Warm":>9} {"AWS@import":>11}')
+    for workflow, module_name in MODULES:
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run(
+                [sys.executable, __file__, '--aws-latency', str(args.aws_latency),
+                 '--child', workflow, module_name],
+                capture_output=True, text=True, env=env, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+        def median(key):
+            return statistics.median(run[key] for run in runs)
+
+        print(f'{workflow + "/" + module_name + ".py":<42} {median("import_ms"):>7.1f}ms '
+              f'{median("first_ms"):>7.1f}ms {median("warm_ms"):>7.1f}ms {int(median("aws_calls_at_import")):>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+End-to-end latency and throughput of every Jamf Pro workflow handler.
+
+The handlers run in-process against the local stand-ins: a Jamf Pro server
+with configurable fleet size, latency and error rate, a Teams webhook, and
+SSM, SQS and SNS clients. Discovery feeds the consumers and the consumers
+feed SendToTeams, as in production. For each scenario the p50 and p99
+invocation latency and the records handled per second are reported.
+
+Usage: python endtoend.py [--fleet-size N] [--jamf-latency SECONDS] [--error-rate FRACTION]
+                          [--aws-latency SECONDS] [--invocations N] [--webhook-rate N] [--verbose]
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import time
+
+import standins
+
+
+DISCOVERY_QUEUE = 'standin://discovery'
+TEAMS_QUEUE = 'standin://teams'
+BATCH_SIZE = 10
+
+
+def percentile(values, fraction):
+    """
+    :return: The nearest-rank percentile of values, e.g. fraction 0.99 for p99.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def measure(name, invoke, events, quiet):
+    """
+    Invoke a handler once per event.
+
+    :param invoke: Callable taking an event and returning the records handled
+        and the records that failed.
+    :return: Dictionary with the scenario's name, latencies and totals.
+    """
+    durations = []
+    records = 0
+    failed = 0
+    start = time.perf_counter()
+    for event in events:
+        invocation_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            handled, invocation_failed = invoke(event)
+        durations.append(time.perf_counter() - invocation_start)
+        records += handled
+        failed += invocation_failed
+    elapsed = time.perf_counter() - start
+    return {
+        'name': name,
+        'invocations': len(durations),
+        'p50': percentile(durations, 0.5) if durations else 0,
+        'p99': percentile(durations, 0.99) if durations else 0,
+        'records': records,
+        'failed': failed,
+        'rate': records / elapsed if elapsed else 0,
+    }
+
+
+def sqs_batches(records, invocations):
+    """
+    :return: [Dictionary] Lambda SQS events of up to BATCH_SIZE records, at most invocations of them.
+    """
+    return [
+        {'Records': records[start:start + BATCH_SIZE]}
+        for start in range(0, min(len(records), invocations * BATCH_SIZE), BATCH_SIZE)
+    ]
+
+
+def consumer(module, timeout):
+    def invoke(event):
+        response = module.lambda_handler(event, standins.LambdaContext(timeout))
+        return len(event['Records']), len(response['batchItemFailures'])
+    return invoke
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--fleet-size', type=int, default=2000, help='Computers in the stand-in fleet (default 2000)')
+    parser.add_argument('--sites', type=int, default=10, help='Sites in the stand-in fleet (default 10)')
+    parser.add_argument('--jamf-latency', type=float, default=0.005,
+                        help='Seconds each Jamf Pro request takes (default 0.005)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of Jamf Pro requests answered with 503 (default 0)')
+    parser.add_argument('--aws-latency', type=float, default=0.002,
+                        help='Seconds each stand-in AWS call takes (default 0.002)')
+    parser.add_argument('--webhook-latency', type=float, default=0.005,
+                        help='Seconds each Teams webhook post takes (default 0.005)')
+    parser.add_argument('--webhook-rate', type=float, default=1000,
+                        help='Posts per second SendToTeams allows per webhook (production default is 4)')
+    parser.add_argument('--invocations', type=int, default=10, help='Invocations per scenario (default 10)')
+    parser.add_argument('--verbose', action='store_true', help='Show handler logs and output')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    quiet = not args.verbose
+
+    jamf = standins.JamfProStandIn(fleet_size=args.fleet_size, site_count=args.sites,
+                                   latency=args.jamf_latency, error_rate=args.error_rate).start()
+    webhook = standins.WebhookStandIn(latency=args.webhook_latency).start()
+    ssm = standins.SSMStandIn(standins.workflow_parameters(jamf.url, webhook_url=webhook.url), latency=args.aws_latency)
+    sqs = standins.SQSStandIn(latency=args.aws_latency)
+    sns = standins.SNSStandIn(latency=args.aws_latency)
+    standins.install_aws(ssm, sqs, sns)
+
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'GROUP_NAME': 'Stand-In Search',
+        'SQS_QUEUE_URL': DISCOVERY_QUEUE,
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:standin',
+        'SendToTeams_URL': TEAMS_QUEUE,
+        'SendToMicrosoftTeams_URL': TEAMS_QUEUE,
+        'WEBHOOK_RATE': str(args.webhook_rate),
+        'WEBHOOK_BURST': str(max(1, int(args.webhook_rate))),
+        'DEBUG': 'False',
+    })
+
+    results = []
+    for mode, workers in (('site_scoped', 1), ('site_scoped', 4), ('aggregate', 1)):
+        os.environ.update({'REPORT_MODE': mode, 'MAX_WORKERS': str(workers)})
+        report = standins.load_workflow('JP-EncryptionReport', 'index')
+
+        def invoke_report(event):
+            report.lambda_handler(event, standins.LambdaContext(60))
+            return args.sites, 0
+        results.append(measure(f'EncryptionReport {mode} x{workers}', invoke_report, [{}] * args.invocations, quiet))
+    os.environ.pop('MAX_WORKERS')
+
+    queued = {}
+    for workflow, consumer_name in (('JP-UnmanageStaleComputers', 'unmanage'), ('JP-RemanageStaleComputers', 'remanage')):
+        for source in ('advanced_search', 'inventory'):
+            os.environ['DISCOVERY_SOURCE'] = source
+            discovery = standins.load_workflow(workflow, 'index')
+
+            def invoke_discovery(event):
+                response = discovery.lambda_handler(event, standins.LambdaContext(30))
+                records = sqs.drain(DISCOVERY_QUEUE)
+                if records:
+                    queued[workflow] = records
+                return response['enqueued'], response['failed']
+            results.append(measure(f'{workflow} index ({source})', invoke_discovery, [{}] * args.invocations, quiet))
+
+        module = standins.load_workflow(workflow, consumer_name)
+        events = sqs_batches(queued.get(workflow, []), args.invocations)
+        results.append(measure(f'{workflow} {consumer_name}', consumer(module, 10), events, quiet))
+
+    teams = standins.load_workflow('SendToTeams', 'index')
+    events = sqs_batches(sqs.drain(TEAMS_QUEUE), args.invocations)
+    results.append(measure('SendToTeams index', consumer(teams, 30), events, quiet))
+
+    jamf.stop()
+    webhook.stop()
+
+    print(f'Fleet {args.fleet_size}, Jamf Pro latency {args.jamf_latency * 1000:.0f}ms, '
+          f'error rate {args.error_rate:.0%}, AWS latency {args.aws_latency * 1000:.0f}ms')
+    print(f'{"Scenario":<52} {"Calls":>5} {"p50":>9} {"p99":>9} {"Records/s":>10} {"Failed":>7}')
+    for row in results:
+        print(f'{row["name"]:<52} {row["invocations"]:>5} {row["p50"] * 1000:>7.1f}ms {row["p99"] * 1000:>7.1f}ms '
+              f'{row["rate"]:>10.0f} {row["failed"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare report rendering time as per-computer detail reports grow.
+
+The previous EncryptionReport table_print is kept below as the baseline.
+It looks up every row with list.index(), so its time grows with the square
+of the row count. report.render measures the columns in one pass and
+writes each row once, so its time per row stays flat in every format.
+
+Usage: python reports.py [--rows N [N ...]] [--legacy-max N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import standins
+
+
+COLUMNS = [
+    ('id', 'ID'),
+    ('name', 'Computer Name'),
+    ('serial', 'Serial Number'),
+    ('site', 'Jamf Pro Site Name'),
+    ('encrypted', 'FileVault 2'),
+    ('last_contact', 'Last Check-in'),
+]
+
+
+def table_print(data, title_row):
+    """
+    The EncryptionReport renderer replaced by report.render, unchanged.
+    """
+    max_widths = {}
+    data_copy = [dict(title_row)] + list(data)
+    for col in data_copy[0].keys():
+        max_widths[col] = max([len(str(row[col])) for row in data_copy])
+    cols_order = [tup[0] for tup in title_row]
+    underline = '-+-'.join(['-' * max_widths[col] for col in cols_order])
+
+    def custom_just(col, value):
+        if type(value) == int:
+            return str(value).rjust(max_widths[col])
+        else:
+            return value.ljust(max_widths[col])
+
+    output = f'+-{underline}-+{os.linesep}'
+    for row in data_copy:
+        row_str = ' | '.join([custom_just(col, row[col]) for col in cols_order])
+        output += f'| {row_str} |{os.linesep}'
+        if data_copy.index(row) == 0:
+            output += f'+-{underline}-+{os.linesep}'
+    output += f'+-{underline}-+{os.linesep}'
+
+    return output
+
+
+def detail_rows(count):
+    jamf = standins.JamfProStandIn(fleet_size=count)
+    return [
+        {
+            'id': computer['id'],
+            'name': computer['name'],
+            'serial': f'C02{computer["id"]:09d}',
+            'site': jamf.sites[computer['site_id']],
+            'encrypted': 'Encrypted' if computer['encrypted'] else 'Not Encrypted',
+            'last_contact': computer['last_contact'],
+        }
+        for computer in jamf.computers.values()
+    ]
+
+
+def timed(render):
+    start = time.perf_counter()
+    output = render()
+    return time.perf_counter() - start, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 5000, 20000, 50000],
+                        help='Numbers of computers in the report (default 1000 5000 20000 50000)')
+    parser.add_argument('--legacy-max', type=int, default=20000,
+                        help='Largest report rendered with table_print, which is quadratic (default 20000)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, standins.COMMON_DIR)
+    import report
+
+    print(f'{"Rows":>8} {"Renderer":<20} {"Time":>10} {"us/row":>8} {"Size":>10}')
+    for count in args.rows:
+        rows = detail_rows(count)
+        renderers = [(f'report {fmt}', lambda fmt=fmt: report.render(rows, COLUMNS, fmt)) for fmt in report.FORMATS]
+        if count <= args.legacy_max:
+            elapsed, legacy = timed(lambda: table_print(rows, COLUMNS))
+            assert legacy == report.render(rows, COLUMNS), 'report ascii output differs from table_print'
+            renderers.insert(0, ('table_print', lambda: legacy))
+            print(f'{count:>8} {"table_print":<20} {elapsed * 1000:>8.1f}ms {elapsed / count * 1e6:>8.2f} '
+                  f'{len(legacy) / 2 ** 20:>8.1f}MB')
+        for label, render in renderers[1 if count <= args.legacy_max else 0:]:
+            elapsed, output = timed(render)
+            print(f'{count:>8} {label:<20} {elapsed * 1000:>8.1f}ms {elapsed / count * 1e6:>8.2f} '
+                  f'{len(output) / 2 ** 20:>8.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
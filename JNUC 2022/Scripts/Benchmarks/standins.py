@@ -0,0 +1,613 @@
+"""
+Local stand-ins for the services the Jamf Pro workflows talk to.
+
+JamfProStandIn is a small threaded HTTP server answering the Jamf Pro
+endpoints the workflows use, with configurable fleet size, latency and
+error rate. GET responses carry an ETag and honour If-None-Match.
+WebhookStandIn does the same for a Teams webhook. The AWS stand-ins
+replace the SSM, SQS, SNS, S3 and Lambda clients in-process. None of them need
+network access or credentials.
+"""
+
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMON_DIR = os.path.join(SCRIPTS_DIR, 'JamfProCommon', 'src')
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a listen backlog deep enough for hundreds of
+    clients connecting at once, so none of them wait on a SYN retry.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class JamfProStandIn:
+    """
+    In-memory Jamf Pro fleet served over HTTP on localhost.
+    """
+
+    def __init__(self, fleet_size=1000, site_count=10, search_name='Stand-In Search', latency=0.0,
+                 write_capacity=None, error_rate=0.0):
+        """
+        :param fleet_size: Integer The number of computers in the fleet.
+        :param site_count: Integer The number of sites computers are spread across.
+        :param search_name: String The name of the Advanced Search the workflows read.
+        :param latency: Float Seconds every request takes before it is answered.
+        :param write_capacity: Integer The number of concurrent writes the server handles.
+            Writes beyond it are answered with 503. None for no limit.
+        :param error_rate: Float The fraction of API requests answered with a 503 at random.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.write_capacity = write_capacity
+        self.writes_in_flight = 0
+        self.peak_writes_in_flight = 0
+        self.sites = {i: f'Site {i:03d}' for i in range(1, site_count + 1)}
+        self.computers = {
+            i: {
+                'id': i,
+                'name': f'Mac-{i:06d}',
+                'site_id': i % site_count + 1,
+                'managed': i % 2 == 0,
+                'encrypted': i % 3 != 0,
+                'last_contact': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - (i % 90) * 86400)),
+            }
+            for i in range(1, fleet_size + 1)
+        }
+        self.searches = {1: {'id': 1, 'name': search_name, 'site_id': -1}}
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        """
+        Serve the fleet on a free localhost port from a background thread.
+
+        :return: JamfProStandIn self, for chaining.
+        """
+        standin = self
+
+        class Handler(JamfProRequestHandler):
+            jamf = standin
+
+        self.server = StandInServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, method, path):
+        endpoint = re.sub(r'/\d+', '/{id}', re.sub(r'/name/[^/]+', '/name/{name}', path))
+        with self.lock:
+            key = f'{method} {endpoint}'
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def search_results(self, search):
+        return [
+            computer for computer in self.computers.values()
+            if computer['encrypted'] and search['site_id'] in (-1, computer['site_id'])
+        ]
+
+    def inventory(self, computer):
+        return {
+            'id': str(computer['id']),
+            'general': {
+                'name': computer['name'],
+                'lastContactTime': computer['last_contact'],
+                'remoteManagement': {'managed': computer['managed']},
+                'site': {'id': str(computer['site_id']), 'name': self.sites[computer['site_id']]},
+            },
+        }
+
+    def find_search(self, path):
+        match = re.search(r'/advancedcomputersearches/(name|id)/([^/]+)$', path)
+        if not match:
+            return None
+        key, value = match.groups()
+        for search in self.searches.values():
+            if (key == 'id' and str(search['id']) == value) or \
+                    (key == 'name' and search['name'] == unquote(value)):
+                return search
+        return None
+
+
+class JamfProRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Jamf Pro API calls made by the workflows.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    jamf = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'', content_type='application/xml'):
+        if isinstance(body, str):
+            body = body.encode()
+        etag = None
+        if self.command == 'GET' and status == 200:
+            etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.jamf.count('GET', '304')
+                status, body = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Set-Cookie', 'APBALANCEID=aws.standin; Path=/')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode() if length else ''
+
+    def wants_json(self):
+        return 'application/json' in (self.headers.get('Accept') or '')
+
+    def dispatch(self, method):
+        body = self.read_body()
+        path, _, query = self.path.partition('?')
+        self.jamf.count(method, path)
+
+        if method != 'GET' and path != '/api/v1/auth/token':
+            jamf = self.jamf
+            with jamf.lock:
+                jamf.writes_in_flight += 1
+                jamf.peak_writes_in_flight = max(jamf.peak_writes_in_flight, jamf.writes_in_flight)
+                overloaded = jamf.write_capacity is not None and jamf.writes_in_flight > jamf.write_capacity
+            try:
+                if overloaded:
+                    jamf.count(method, '503')
+                    time.sleep(jamf.latency)
+                    return self.reply(503)
+                return self.answer(method, path, query, body)
+            finally:
+                with jamf.lock:
+                    jamf.writes_in_flight -= 1
+
+        return self.answer(method, path, query, body)
+
+    def answer(self, method, path, query, body):
+        if self.jamf.latency:
+            time.sleep(self.jamf.latency)
+
+        if self.jamf.error_rate and path != '/api/v1/auth/token' and random.random() < self.jamf.error_rate:
+            self.jamf.count(method, '503')
+            return self.reply(503)
+
+        if path == '/api/v1/auth/token' and method == 'POST':
+            expires = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(time.time() + 1800))
+            return self.reply(200, json.dumps({'token': 'stand-in', 'expires': expires}), 'application/json')
+
+        if not (self.headers.get('Authorization') or '').startswith(('Bearer ', 'Basic ')):
+            return self.reply(401)
+
+        if path == '/JSSResource/sites' and method == 'GET':
+            return self.reply(200, self.sites_xml())
+
+        if path == '/JSSResource/advancedcomputersearches' and method == 'GET':
+            searches = ''.join(
+                f'<advanced_computer_search><id>{search["id"]}</id><name>{search["name"]}</name></advanced_computer_search>'
+                for search in list(self.jamf.searches.values())
+            )
+            return self.reply(200, f'<advanced_computer_searches><size>{len(self.jamf.searches)}</size>{searches}</advanced_computer_searches>')
+
+        if '/JSSResource/advancedcomputersearches/' in path:
+            return self.advanced_search(method, path, body)
+
+        if path == '/api/v1/computers-inventory' and method == 'GET':
+            return self.computers_inventory(parse_qs(query))
+
+        match = re.match(r'^/JSSResource/computers/id/(\d+)(/subset/General)?$', path)
+        if match:
+            return self.computer(method, int(match.group(1)), body)
+
+        return self.reply(404)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def sites_xml(self):
+        sites = ''.join(f'<site><id>{i}</id><name>{name}</name></site>' for i, name in self.jamf.sites.items())
+        return f'<sites><size>{len(self.jamf.sites)}</size>{sites}</sites>'
+
+    def advanced_search(self, method, path, body):
+        jamf = self.jamf
+        if method == 'POST':
+            root = ElementTree.fromstring(body)
+            with jamf.lock:
+                search_id = max(jamf.searches) + 1
+                jamf.searches[search_id] = {
+                    'id': search_id,
+                    'name': root.findtext('name'),
+                    'site_id': int(root.findtext('site/id') or -1),
+                }
+            return self.reply(201, f'<advanced_computer_search><id>{search_id}</id></advanced_computer_search>')
+
+        search = jamf.find_search(path)
+        if search is None:
+            return self.reply(404)
+
+        if method == 'DELETE':
+            with jamf.lock:
+                jamf.searches.pop(search['id'])
+            return self.reply(200)
+
+        if method == 'PUT':
+            site_id = ElementTree.fromstring(body).findtext('site/id')
+            if site_id is not None:
+                search['site_id'] = int(site_id)
+            return self.reply(201, f'<advanced_computer_search><id>{search["id"]}</id></advanced_computer_search>')
+
+        results = jamf.search_results(search)
+        if self.wants_json():
+            computers = [
+                {'id': c['id'], 'name': c['name'], 'Computer_Name': c['name'], 'Site': jamf.sites[c['site_id']]}
+                for c in results
+            ]
+            return self.reply(200, json.dumps({'advanced_computer_search': {
+                'id': search['id'], 'name': search['name'], 'computers': computers
+            }}), 'application/json')
+
+        computers = ''.join(
+            f'<computer><id>{c["id"]}</id><name>{c["name"]}</name><Computer_Name>{c["name"]}</Computer_Name><Site>{jamf.sites[c["site_id"]]}</Site></computer>'
+            for c in results
+        )
+        return self.reply(200, (
+            f'<advanced_computer_search><id>{search["id"]}</id><name>{search["name"]}</name>'
+            f'<site><id>{search["site_id"]}</id></site><criteria/><display_fields/>'
+            f'<computers><size>{len(results)}</size>{computers}</computers></advanced_computer_search>'
+        ))
+
+    def computers_inventory(self, query):
+        """
+        Pages of the inventory, sorted by id. Filters support ; (and) joined
+        ==, !=, =lt=, =le=, =gt=, =ge= and id=in=(...) comparisons.
+        """
+        page = int(query.get('page', ['0'])[0])
+        page_size = int(query.get('page-size', ['100'])[0])
+        terms = [term.lstrip('(') for term in query.get('filter', [''])[0].split(';') if term]
+        # Drop the closing parenthesis of a group, but not the one ending id=in=(...)
+        terms = [term[:-1] if term.count(')') > term.count('(') else term for term in terms]
+        comparisons = [re.match(r'^([\w.]+)(==|!=|=lt=|=le=|=gt=|=ge=|=in=)(.*)$', term) for term in terms]
+
+        def matches(record):
+            for field, operator, expected in (c.groups() for c in comparisons):
+                value = record
+                for key in field.split('.'):
+                    value = value[key]
+                if isinstance(value, bool):
+                    value = str(value).lower()
+                elif field == 'id':
+                    value = int(value)
+                    if operator == '=in=':
+                        if value not in {int(i) for i in expected.strip('()').split(',')}:
+                            return False
+                        continue
+                    expected = int(expected)
+                if not {
+                    '==': value == expected, '!=': value != expected,
+                    '=lt=': value < expected, '=le=': value <= expected,
+                    '=gt=': value > expected, '=ge=': value >= expected,
+                }[operator]:
+                    return False
+            return True
+
+        results = [
+            record for record in map(self.jamf.inventory, sorted(self.jamf.computers.values(), key=lambda c: c['id']))
+            if matches(record)
+        ]
+        body = {'totalCount': len(results), 'results': results[page * page_size:(page + 1) * page_size]}
+        return self.reply(200, json.dumps(body), 'application/json')
+
+    def computer(self, method, computer_id, body):
+        computer = self.jamf.computers.get(computer_id)
+        if computer is None:
+            return self.reply(404)
+
+        if method == 'PUT':
+            managed = ElementTree.fromstring(body).findtext('general/remote_management/managed')
+            if managed is not None:
+                computer['managed'] = managed == 'true'
+            return self.reply(201, f'<computer><id>{computer_id}</id></computer>')
+
+        general = {
+            'id': computer['id'],
+            'name': computer['name'],
+            'remote_management': {'managed': computer['managed']},
+            'site': {'id': computer['site_id'], 'name': self.jamf.sites[computer['site_id']]},
+        }
+        return self.reply(200, json.dumps({'computer': {'general': general}}), 'application/json')
+
+
+class WebhookStandIn:
+    """
+    Microsoft Teams incoming webhook served over HTTP on localhost.
+    """
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, retry_after=1):
+        """
+        :param latency: Float Seconds every post takes before it is answered.
+        :param throttle_rate: Float The fraction of posts answered with 429 at random.
+        :param retry_after: Integer The Retry-After seconds sent with each 429.
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.posts = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}/webhook'
+
+    def start(self):
+        """
+        :return: WebhookStandIn self, for chaining.
+        """
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if webhook.latency:
+                    time.sleep(webhook.latency)
+                throttled = random.random() < webhook.throttle_rate
+                with webhook.lock:
+                    webhook.posts += 1
+                    webhook.throttled += throttled
+                self.send_response(429 if throttled else 200)
+                if throttled:
+                    self.send_header('Retry-After', str(webhook.retry_after))
+                self.send_header('Content-Length', '1')
+                self.end_headers()
+                self.wfile.write(b'1')
+
+        self.server = StandInServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LambdaContext:
+    """
+    The part of the Lambda context object the handlers use.
+    """
+
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:000000000000:function:standin'
+
+    def __init__(self, timeout):
+        """
+        :param timeout: Float The function timeout in seconds, counted from now.
+        """
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int(max(0, self.deadline - time.monotonic()) * 1000)
+
+
+class AWSStandIn:
+    """
+    Base for the in-process AWS clients. Each call sleeps for latency seconds.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class SSMStandIn(AWSStandIn):
+
+    def __init__(self, parameters, latency=0.0):
+        super().__init__(latency)
+        self.parameters = dict(parameters)
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self.record('GetParameter')
+        return {'Parameter': {'Name': Name, 'Value': self.parameters[Name]}}
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self.record('GetParameters')
+        return {
+            'Parameters': [{'Name': n, 'Value': self.parameters[n]} for n in Names if n in self.parameters],
+            'InvalidParameters': [n for n in Names if n not in self.parameters],
+        }
+
+
+class SQSStandIn(AWSStandIn):
+
+    def __init__(self, latency=0.0, keep_messages=True):
+        """
+        :param keep_messages: Boolean Store sent messages for drain(). When False only
+            the number sent to each queue is kept, so memory benchmarks are not skewed.
+        """
+        super().__init__(latency)
+        self.keep_messages = keep_messages
+        self.queues = {}
+        self.sent = {}
+
+    def enqueue(self, queue_url, bodies):
+        with self.lock:
+            self.sent[queue_url] = self.sent.get(queue_url, 0) + len(bodies)
+            if self.keep_messages:
+                self.queues.setdefault(queue_url, []).extend(bodies)
+            return self.sent[queue_url]
+
+    def send_message(self, QueueUrl, MessageBody):
+        self.record('SendMessage')
+        return {'MessageId': str(self.enqueue(QueueUrl, [MessageBody]))}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.record('SendMessageBatch')
+        self.enqueue(QueueUrl, [e['MessageBody'] for e in Entries])
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+    def drain(self, queue_url):
+        """
+        :return: [Dictionary] Lambda SQS records for every message in the queue, emptying it.
+        """
+        with self.lock:
+            messages = self.queues.pop(queue_url, [])
+        return [{'messageId': str(i), 'body': body} for i, body in enumerate(messages)]
+
+
+class SNSStandIn(AWSStandIn):
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.published = []
+
+    def publish(self, **kwargs):
+        self.record('Publish')
+        self.published.append(kwargs)
+        return {'MessageId': str(len(self.published))}
+
+
+class S3StandIn(AWSStandIn):
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        self.record('GetObject')
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.record('PutObject')
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.encode()
+        return {}
+
+
+class LambdaStandIn(AWSStandIn):
+    """
+    Lambda client keeping the payload of every asynchronous invocation, e.g. continuations.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b''):
+        self.record('Invoke')
+        with self.lock:
+            self.invocations.append(json.loads(Payload))
+        return {'StatusCode': 202}
+
+    def take(self):
+        """
+        :return: [Dictionary] The events invoked since the last call, oldest first.
+        """
+        with self.lock:
+            invocations, self.invocations = self.invocations, []
+        return invocations
+
+
+def workflow_parameters(jamf_url, stage='dev', webhook_url='http://127.0.0.1/webhook'):
+    """
+    :return: Dictionary of every SSM parameter the workflows read, pointing at jamf_url and webhook_url.
+    """
+    values = {f'/{stage}/JamfPro/Address': jamf_url}
+    for account in ('EncryptionReport', 'UnmanageComputers', 'RemanageComputers'):
+        values[f'/{stage}/JamfPro/Accts/{account}/Username'] = 'standin'
+        values[f'/{stage}/JamfPro/Accts/{account}/Password'] = 'standin'
+    values[f'/{stage}/Webhooks/MSTeams/TeamName/ChannelName'] = webhook_url
+    values[f'/{stage}/JamfPro/Webhooks/WVUAppleAdmins/AWS-Automation'] = webhook_url
+    return values
+
+
+def install_aws(ssm, sqs, sns, s3=None, lambda_client=None, construct_real_clients=False):
+    """
+    Make boto3.client return the stand-ins.
+
+    :param construct_real_clients: Boolean Also build (and discard) a real botocore
+        client for each call, so client construction cost is still measured.
+    """
+    import boto3
+    real_client = boto3.client
+    standins = {'ssm': ssm, 'sqs': sqs, 'sns': sns, 's3': s3 or S3StandIn(), 'lambda': lambda_client or LambdaStandIn()}
+
+    def client(service_name, *args, **kwargs):
+        if construct_real_clients:
+            kwargs.setdefault('region_name', 'us-east-1')
+            real_client(service_name, *args, **kwargs)
+        return standins[service_name]
+
+    boto3.client = client
+
+
+def load_workflow(workflow, module_name):
+    """
+    Import a workflow module from its src directory, as Lambda would.
+
+    :param workflow: String The workflow directory, e.g. JP-UnmanageStaleComputers
+    :param module_name: String The handler module, e.g. unmanage
+    :return: Module containing lambda_handler.
+    """
+    import importlib
+    src = os.path.join(SCRIPTS_DIR, workflow, 'src')
+    for path in (COMMON_DIR, src):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    sys.modules.pop(module_name, None)
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        sys.path.remove(src)
@@ -0,0 +1,145 @@
+"""
+Compare buffered and streamed discovery of a large Advanced Search.
+
+The stand-in Jamf Pro server runs in a separate process so only the
+discovery side is measured. For each fleet size the search is read and
+every computer is encoded and enqueued, either from the whole JSON
+document (the previous discovery path), from the streamed XML parse, or
+by the JP-UnmanageStaleComputers discovery handler itself, so anything the
+handler holds on to between the download and the queue is counted too.
+Wall time is measured untraced; peak Python memory is measured with
+tracemalloc on a second run.
+
+Usage: python streaming.py [--fleet-sizes N [N ...]]
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import standins
+
+
+SEARCH_NAME = 'Stand-In Search'
+
+
+def serve(fleet_size):
+    """
+    Runs inside the server process. Prints the server URL, then serves until stdin closes.
+    """
+    jamf = standins.JamfProStandIn(fleet_size=fleet_size, search_name=SEARCH_NAME).start()
+    # Every computer is returned by the search, as in a large stale-computer run
+    for computer in jamf.computers.values():
+        computer['encrypted'] = True
+    print(jamf.url, flush=True)
+    sys.stdin.read()
+    jamf.stop()
+
+
+def buffered(client, sqs, sqsbatch, computermessage):
+    path = f'/JSSResource/advancedcomputersearches/name/{SEARCH_NAME.replace(" ", "%20")}'
+    json_result = client.get_json(path)
+    debug = 'Value of the \'json\' parameter: ' + json.dumps(json_result)
+    computers = [dict(c, id=int(c['id'])) for c in json_result['advanced_computer_search']['computers']]
+    del debug
+    messages = (computermessage.encode(computer) for computer in computers)
+    return sqsbatch.send_message_batches(sqs, 'standin://discovery', messages)
+
+
+def streamed(client, sqs, sqsbatch, computermessage):
+    computers = client.iter_advancedcomputersearch_computers(SEARCH_NAME.replace(' ', '%20'))
+    messages = (computermessage.encode(computer) for computer in computers)
+    return sqsbatch.send_message_batches(sqs, 'standin://discovery', messages)
+
+
+@functools.lru_cache(maxsize=None)
+def load_discovery(url):
+    """
+    :return: Module containing the discovery lambda_handler, reading the Advanced Search at url.
+    """
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'GROUP_NAME': SEARCH_NAME,
+        'SQS_QUEUE_URL': 'standin://discovery',
+        'DISCOVERY_SOURCE': 'advanced_search',
+        'SNAPSHOT_STORE': '',
+        'DEBUG': 'False',
+    })
+    standins.install_aws(standins.SSMStandIn(standins.workflow_parameters(url)), standins.SQSStandIn(),
+                         standins.SNSStandIn())
+    return standins.load_workflow('JP-UnmanageStaleComputers', 'index')
+
+
+def handler(client, sqs, sqsbatch, computermessage):
+    discovery = load_discovery(client.url)
+    discovery.get_sqs.cache_clear()
+    standins.install_aws(standins.SSMStandIn(standins.workflow_parameters(client.url)), sqs, standins.SNSStandIn())
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = discovery.lambda_handler({}, standins.LambdaContext(900))
+    return result['enqueued'], result['failed']
+
+
+def measure(method, url, fleet_size):
+    """
+    :return: Tuple containing the wall time in seconds and the peak traced memory in bytes.
+    """
+    import computermessage
+    import jamfpro
+    import sqsbatch
+
+    client = jamfpro.JamfProClient(url, 'standin', 'standin')
+    client.token()
+
+    sqs = standins.SQSStandIn(keep_messages=False)
+    start = time.perf_counter()
+    sent, failed = method(client, sqs, sqsbatch, computermessage)
+    elapsed = time.perf_counter() - start
+    assert sent == fleet_size and not failed, (sent, failed)
+
+    tracemalloc.start()
+    method(client, standins.SQSStandIn(keep_messages=False), sqsbatch, computermessage)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--fleet-sizes', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='Numbers of computers in the search (default 1000 10000 50000)')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve)
+
+    sys.path.insert(0, standins.COMMON_DIR)
+    logging.disable(logging.CRITICAL)
+    print(f'{"Computers":>10} {"Method":<9} {"Time":>9} {"Computers/s":>12} {"Peak memory":>12}')
+    for fleet_size in args.fleet_sizes:
+        server = subprocess.Popen(
+            [sys.executable, __file__, '--serve', str(fleet_size)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        try:
+            url = server.stdout.readline().strip()
+            for label, method in (('buffered', buffered), ('streamed', streamed), ('handler', handler)):
+                elapsed, peak = measure(method, url, fleet_size)
+                print(f'{fleet_size:>10} {label:<9} {elapsed * 1000:>7.0f}ms {fleet_size / elapsed:>12.0f} '
+                      f'{peak / 2 ** 20:>10.1f}MB')
+        finally:
+            server.stdin.close()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
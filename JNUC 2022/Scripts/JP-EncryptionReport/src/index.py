@@ -3,105 +3,310 @@ Deletes computers via the Jamf Pro API based on given Computer IDs.
 """
 
 import os
+import functools
 import logging
+import queue
+import time
 import urllib
+import uuid
 import json
 import xml.etree.ElementTree as ElementTree
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+import requests
+import checkpoint
+import history
+import httpcache
+import jamfpro
+import metrics
+import parameters
+import report
 from botocore.exceptions import ClientError
 
 
+def parse_sites(xml):
+    """
+    :param xml: Bytes The /JSSResource/sites response.
+    :return: Dictionary containing each site ID and Name.
+    """
+    return {site.findtext('id'): site.findtext('name') for site in ElementTree.fromstring(xml).findall('site')}
+
+
 def api_get_sites():
     """
-    Get a dictionary listing each site from a Jamf Pro API.
+    Get a dictionary listing each site from a Jamf Pro API. The response is
+    cached, so unchanged sites are neither downloaded nor parsed again.
 
     :return: Dictionary containing each site ID and Name. If error, returns None.
     """
-    auth_tuple = (API_USER, API_PASS)
-    url = f'{API_URL}/JSSResource/sites'
-    LOGGER.debug(f'URL generated: {url}')
-
     try:
-        xml = requests.get(url, auth=auth_tuple).content
-        LOGGER.debug(f'XML Returned: {xml}')
-    except requests.exceptions.RequestException as e:
+        output = dict(get_response_cache().get(get_jamf(), '/JSSResource/sites', parse_sites))
+    except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
         LOGGER.error(e)
         return None
 
+    LOGGER.debug(f'api_get_sites() output: {output}')
+    return output
+
+
+def get_search_definition(name):
+    """
+    Read an Advanced Search without its results, to be copied.
+
+    The response lists every computer in the search, so it is read once per
+    run and not cached; only the definition is kept.
+
+    :param name: String The URL-quoted name of the Advanced Search.
+    :return: Element containing the search definition, without its id or
+        computers. If error, returns None.
+    """
+    xml = get_jamf().get_xml(f'/JSSResource/advancedcomputersearches/name/{name}')
+    if xml is None:
+        return None
+
     try:
-        sites = ElementTree.fromstring(xml).findall('site')
-        LOGGER.debug(f'Sites list: {sites}')
+        search = ElementTree.fromstring(xml)
     except ElementTree.ParseError as e:
         LOGGER.error(e)
         return None
 
-    output = {}
-    for site in sites:
-        output[site.find('id').text] = site.find('name').text
+    # Only the definition is copied; the results are regenerated by Jamf Pro
+    for element in search.findall('id') + search.findall('computers'):
+        search.remove(element)
+    return search
 
-    LOGGER.debug(f'api_get_sites() output: {output}')
-    return output
 
+def clone_advancedcomputersearch(definition, clone_name):
+    """
+    Create a copy of an Advanced Search so it can be re-scoped independently.
+
+    :param definition: Element The search definition, from get_search_definition().
+    :param clone_name: String The name to give the copy.
+    :return: String containing the ID of the new Advanced Search. If error, returns None.
+    """
+    definition.find('name').text = clone_name
+
+    r = get_jamf().post_xml('/JSSResource/advancedcomputersearches/id/0', ElementTree.tostring(definition, encoding='unicode'))
+    if r is None:
+        return None
+
+    try:
+        return ElementTree.fromstring(r.content).findtext('id')
+    except ElementTree.ParseError as e:
+        LOGGER.error(e)
+        return None
 
-def api_put_request(url, data):
+
+def delete_leftover_searches():
     """
-    Make a change to an existing Jamf Pro object via API.
+    Delete worker copies of the GROUP_NAME Advanced Search left behind by a
+    run that was stopped between creating and deleting them.
 
-    :param url: String The url to connect to.
-    :param data: String XML containing the changed elements.
-    :return: Dictionary containing each cookie from the PUT request. If error, returns None.
+    :return: Integer containing the number of copies deleted. If error, returns None.
     """
-    auth_tuple = (API_USER, API_PASS)
+    xml = get_jamf().get_xml('/JSSResource/advancedcomputersearches')
+    if xml is None:
+        return None
 
     try:
-        r = requests.put(url, auth=auth_tuple, data=data)
-    except requests.exceptions.RequestException as e:
+        searches = ElementTree.fromstring(xml).findall('advanced_computer_search')
+    except ElementTree.ParseError as e:
         LOGGER.error(e)
         return None
 
-    return r.cookies
+    prefix = worker_search_prefix()
+    deleted = 0
+    for search in searches:
+        if (search.findtext('name') or '').startswith(prefix):
+            LOGGER.warning(f'Deleting leftover worker search: {search.findtext("name")}')
+            if get_jamf().delete(f'/JSSResource/advancedcomputersearches/id/{search.findtext("id")}'):
+                deleted += 1
+    return deleted
 
 
-def get_encrypted_count_by_site_id(site_id):
+def worker_search_prefix():
+    """
+    :return: String The start of the name of every worker copy of the GROUP_NAME Advanced Search.
+    """
+    return f'{WORKER_SEARCH_PREFIX}{os.getenv("GROUP_NAME")} ('
+
+
+def get_encrypted_count_by_site_id(site_id, path=None):
     """
     Gets the number of encrypted devices within a given site.
 
     :param site_id: Integer The ID of a Jamf Pro site.
+    :param path: String Optional API path of the Advanced Search to re-scope. Defaults to GROUP_NAME.
     :return: Integer containing the number of computers that are encrypted. If error, returns None.
     """
     change_site_xml = f'<advanced_computer_search><site><id>{site_id}</id></site></advanced_computer_search>'
 
-    auth_tuple = (API_USER, API_PASS)
+    if path is None:
+        name = urllib.parse.quote(os.getenv("GROUP_NAME", ""))
+        path = f'/JSSResource/advancedcomputersearches/name/{name}'
+
+    # The session keeps the APBALANCEID cookie, so the GET reaches the node that took the PUT
+    if get_jamf().put_xml(path, change_site_xml) is None:
+        return None
+
+    # Only the size is needed, so the response is closed before the computer list is read
+    sizes = get_jamf().iter_xml(path, 'computers/size')
+    try:
+        size = next(sizes, None)
+    except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
+        LOGGER.error(e)
+        return None
+    finally:
+        sizes.close()
+
+    return None if size is None else size.text
+
+
+def reset_search_scope(path):
+    """
+    Scope an Advanced Search back to Full JSS (site -1).
+
+    :param path: String The API path of the Advanced Search.
+    :return: Response Object. If error, returns None.
+    """
+    return get_jamf().put_xml(path, FULL_JSS_SCOPE_XML)
+
+
+def get_encrypted_counts_concurrently(sites, max_workers, budget=None):
+    """
+    Gets the number of encrypted devices for many sites in parallel.
+
+    Each worker re-scopes its own temporary copy of the GROUP_NAME Advanced
+    Search, so concurrent site changes never race on a shared search. The
+    copies are deleted once every site has been counted, and copies left by
+    an earlier run that was stopped first are deleted before new ones are made.
+
+    :param sites: Dictionary containing each site ID and Name.
+    :param max_workers: Integer The maximum number of sites evaluated at once.
+    :param budget: TimeBudget Sites not started before it runs out are left out. None counts every site.
+    :return: Dictionary containing each counted site ID and its encrypted count. If error, returns None.
+    """
     name = urllib.parse.quote(os.getenv("GROUP_NAME", ""))
+    max_workers = max(1, min(max_workers, len(sites)))
+    run_id = uuid.uuid4().hex[:8]
 
-    url = f'{API_URL}/JSSResource/advancedcomputersearches/name/{name}'
-    LOGGER.debug(f'URL generated: {url}')
+    if delete_leftover_searches() is None:
+        LOGGER.error('Failed to check for leftover worker searches.')
 
-    r = api_put_request(url, change_site_xml)
-    cookies = dict(APBALANCEID=r.get('APBALANCEID'))
+    # Every worker copies the same search, so it is downloaded once
+    definition = get_search_definition(name)
+    if definition is None:
+        LOGGER.error('Failed to read the Advanced Search to copy.')
+        return None
+
+    clone_ids = []
+    for worker in range(max_workers):
+        clone_name = f'{worker_search_prefix()}{run_id}-{worker})'
+        clone_id = clone_advancedcomputersearch(definition, clone_name)
+        if clone_id is None:
+            LOGGER.error(f'Failed to create worker search: {clone_name}')
+            break
+        clone_ids.append(clone_id)
 
     try:
-        xml = requests.get(url, auth=auth_tuple, cookies=cookies).content
-    except requests.exceptions.RequestException as e:
-        LOGGER.error(e)
+        if not clone_ids:
+            return None
+
+        # Hand each in-flight site an exclusive search, returning it when done
+        searches = queue.Queue()
+        for clone_id in clone_ids:
+            searches.put(f'/JSSResource/advancedcomputersearches/id/{clone_id}')
+
+        def count_site(site_id):
+            path = searches.get()
+            try:
+                if budget is not None and budget.expired():
+                    return NOT_COUNTED
+                return get_encrypted_count_by_site_id(site_id, path)
+            finally:
+                searches.put(path)
+
+        with ThreadPoolExecutor(max_workers=len(clone_ids)) as executor:
+            counts = executor.map(count_site, sites.keys())
+            return {site_id: count for site_id, count in zip(sites.keys(), counts) if count is not NOT_COUNTED}
+    finally:
+        for clone_id in clone_ids:
+            get_jamf().delete(f'/JSSResource/advancedcomputersearches/id/{clone_id}')
+
+
+def get_encrypted_counts_aggregated(sites):
+    """
+    Gets the number of encrypted devices for every site from a single search.
+
+    The GROUP_NAME Advanced Search is scoped back to Full JSS, in case a
+    site-scoped run stopped before resetting it, then read once. The results
+    are grouped by their Site display field, so the search must include
+    "Site" as a display field.
+
+    :param sites: Dictionary containing each site ID and Name.
+    :return: Dictionary containing each site ID and its encrypted count. If error, returns None.
+    """
+    name = urllib.parse.quote(os.getenv("GROUP_NAME", ""))
+    if reset_search_scope(f'/JSSResource/advancedcomputersearches/name/{name}') is None:
+        LOGGER.error('Failed to scope the Advanced Search to Full JSS. Not reporting one site as every site.')
         return None
 
+    counts_by_name = {}
     try:
-        encrypted_count = ElementTree.fromstring(xml).findtext('computers/size')
-    except ElementTree.ParseError as e:
-        LOGGER.debug('Value of the \'xml\' parameter: '+str(xml))
+        for computer in get_jamf().iter_advancedcomputersearch_computers(name):
+            site_name = computer.get(SITE_DISPLAY_FIELD)
+            if site_name is None:
+                LOGGER.error(f'Advanced Search is missing the \'{SITE_DISPLAY_FIELD}\' display field.')
+                return None
+            counts_by_name[site_name] = counts_by_name.get(site_name, 0) + 1
+    except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
         LOGGER.error(e)
         return None
 
-    return encrypted_count
+    return {site_id: counts_by_name.get(site_name, 0) for site_id, site_name in sites.items()}
 
 
 def get_ssm_secret_value(parameter_name):
-    return SSM.get_parameter(
-        Name=parameter_name,
-        WithDecryption=True
-    ).get("Parameter").get("Value")
+    return PARAMETERS.get(parameter_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_response_cache():
+    """
+    :return: ResponseCache for sites and search definitions, reused by warm invocations.
+    """
+    stores = [httpcache.FileCacheStore(HTTP_CACHE_DIR) if HTTP_CACHE_DIR else None,
+              httpcache.open_store(HTTP_CACHE_STORE)]
+    return httpcache.ResponseCache(HTTP_CACHE_TTL, stores)
+
+
+@functools.lru_cache(maxsize=None)
+def get_history_store():
+    """
+    :return: History store for past report runs, or None when HISTORY_STORE is not set.
+    """
+    return history.open_store(HISTORY_STORE)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sns():
+    """
+    :return: SNS Client, created on first use and reused by warm invocations.
+    """
+    return boto3.client('sns')
+
+
+def get_jamf():
+    """
+    Get the shared Jamf Pro client, reading its credentials on first use.
+
+    :return: JamfProClient for this workflow's API account.
+    """
+    return jamfpro.get_client(
+        get_ssm_secret_value(ADDRESS_PARAMETER),
+        get_ssm_secret_value(USERNAME_PARAMETER),
+        get_ssm_secret_value(PASSWORD_PARAMETER)
+    )
 
 
 def send_to_sns(sns_topic_arl, subject, message):
@@ -116,48 +321,20 @@ def send_to_sns(sns_topic_arl, subject, message):
     """
     try:
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sns.html#SNS.Client.publish
-        response = SNS.publish(
-            TargetArn=sns_topic_arl,
-            Message=json.dumps({'default': json.dumps(message), 'email': message}),
-            Subject=subject,
-            MessageStructure='json'
-        )
+        with metrics.timer('SNSPublishTime'):
+            response = get_sns().publish(
+                TargetArn=sns_topic_arl,
+                Message=json.dumps({'default': json.dumps(message), 'email': message}),
+                Subject=subject,
+                MessageStructure='json'
+            )
     except ClientError as e:
         LOGGER.error(e)
         return None
     return response
 
 
-def table_print(data, title_row):
-    """
-    :param data: list of dicts,
-    :param title_row: e.g. [('name', 'Programming Language'), ('type', 'Language Type')]
-    :return: String containing an ASCII table view of the given data.
-    """
-    max_widths = {}
-    data_copy = [dict(title_row)] + list(data)
-    for col in data_copy[0].keys():
-        max_widths[col] = max([len(str(row[col])) for row in data_copy])
-    cols_order = [tup[0] for tup in title_row]
-    underline = '-+-'.join(['-' * max_widths[col] for col in cols_order])
-
-    def custom_just(col, value):
-        if type(value) == int:
-            return str(value).rjust(max_widths[col])
-        else:
-            return value.ljust(max_widths[col])
-
-    output = f'+-{underline}-+{os.linesep}'
-    for row in data_copy:
-        row_str = ' | '.join([custom_just(col, row[col]) for col in cols_order])
-        output += f'| {row_str} |{os.linesep}'
-        if data_copy.index(row) == 0:
-            output += f'+-{underline}-+{os.linesep}'
-    output += f'+-{underline}-+{os.linesep}'
-
-    return output
-
-
+@metrics.instrument('EncryptionReport')
 def lambda_handler(event, context):
     name = urllib.parse.quote(os.getenv("GROUP_NAME", ""))
     if not os.getenv("GROUP_NAME"):
@@ -169,30 +346,100 @@ def lambda_handler(event, context):
         LOGGER.critical('Invalid environment variable: SNS_TOPIC_ARN')
         return
 
-    data = []
+    if REPORT_FORMAT not in report.FORMATS:
+        LOGGER.critical('Invalid environment variable: REPORT_FORMAT')
+        return
+
+    # Retries and timeouts stop short of the Lambda timeout
+    get_jamf().set_deadline(jamfpro.deadline_from_context(context))
+
+    # A continuation event carries the counts made by the earlier parts of the run
+    cursor = checkpoint.start(event)
+    budget = checkpoint.TimeBudget(context)
+
+    results = []
     sites = api_get_sites()
+    if sites is None:
+        LOGGER.error('Failed to retreive the list of sites from the Jamf Pro API.')
+        return
+
+    counted = dict(cursor.get('counts', {}))
+    remaining = {site_id: site_name for site_id, site_name in sites.items() if site_id not in counted}
+
+    counts = None
+    if REPORT_MODE == 'aggregate':
+        counts = get_encrypted_counts_aggregated(sites)
+    elif MAX_WORKERS > 1:
+        counts = get_encrypted_counts_concurrently(remaining, MAX_WORKERS, budget)
+
+    rescoped = False
+    for site_id, site_name in sorted(remaining.items(), key=lambda x: x[1]):
+        if counts is not None:
+            if site_id in counts:
+                counted[site_id] = counts[site_id]
+        elif not budget.expired():
+            counted[site_id] = get_encrypted_count_by_site_id(site_id)
+            rescoped = True
+
+    if rescoped:
+        # Set the site back to -1 to set it back to 'Full JSS"
+        reset_search_scope(f'/JSSResource/advancedcomputersearches/name/{name}')
+
+    # Sites left uncounted when the time budget ran out are counted by a continuation
+    if len(counted) < len(sites):
+        LOGGER.info(f'Counted {len(counted)} of {len(sites)} sites before the time budget ran out.')
+        if checkpoint.continue_run(context, checkpoint.advance(cursor, counts=counted)):
+            return
+        LOGGER.error('Reporting the sites counted so far.')
+
     for site_id, site_name in sorted(sites.items(), key=lambda x: x[1]):
-        val = int(get_encrypted_count_by_site_id(site_id))
-        data.append(dict(count=val, site=site_name))
+        val = counted.get(site_id)
+        if val is None:
+            LOGGER.error(f'Failed to count encrypted computers for site {site_name}.')
+        else:
+            val = int(val)
+        results.append((site_id, site_name, val))
+
+    # Compare with last month's stored run, then store this one
+    store = get_history_store()
+    run = history.make_run(time.time(), results)
+    previous_month, rows = history.month_over_month(history.load(store), run)
+    history.append(store, run)
 
+    data = [dict(count='Error' if row['count'] is None else row['count'], change=row['change'], site=row['site'])
+            for row in rows]
     titles = [('count', 'Count'),
               ('site', 'Jamf Pro Site Name')]
+    if previous_month is not None:
+        titles.insert(1, ('change', f'Change since {previous_month}'))
+        data.append(dict(
+            count=sum(row['count'] for row in rows if row['count'] is not None),
+            change=sum(row['change'] for row in rows if row['change'] is not None),
+            site='All sites'
+        ))
 
-    table = table_print(data, titles)
+    table = report.render(data, titles, REPORT_FORMAT)
 
     print(table)
     send_to_sns(sns_topic_arl, 'Jamf Pro Encryption Report', table)
-
-    # Set the site back to -1 to set it back to 'Full JSS"
-    url = f'{API_URL}/JSSResource/advancedcomputersearches/name/{name}'
-    change_site_xml = '<advanced_computer_search><site><id>-1</id></site></advanced_computer_search>'
-    api_put_request(url, change_site_xml)
+    LOGGER.info(f'HTTP cache: {get_response_cache().stats()}')
 
 
-SNS = boto3.client('sns')
-SSM = boto3.client('ssm')
 STAGE = os.getenv("STAGE", "dev").lower()
 DEBUG = os.getenv("DEBUG", "False").lower()
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "1"))
+REPORT_MODE = os.getenv("REPORT_MODE", "site_scoped").lower()
+REPORT_FORMAT = os.getenv("REPORT_FORMAT", "ascii").lower()
+HISTORY_STORE = os.getenv("HISTORY_STORE", "")
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", httpcache.DEFAULT_DIRECTORY)
+HTTP_CACHE_STORE = os.getenv("HTTP_CACHE_STORE", "")
+HTTP_CACHE_TTL = float(os.getenv("HTTP_CACHE_TTL", "3600"))
+SITE_DISPLAY_FIELD = 'Site'
+FULL_JSS_SCOPE_XML = '<advanced_computer_search><site><id>-1</id></site></advanced_computer_search>'
+# Names the temporary copies of the Advanced Search, so copies left by a stopped run can be found
+WORKER_SEARCH_PREFIX = 'EncryptionReport worker - '
+# Left by get_encrypted_counts_concurrently for sites it had no time to start
+NOT_COUNTED = object()
 
 logging.basicConfig(format='%(levelname)s: %(asctime)s: %(message)s')
 LOGGER = logging.getLogger(__name__)
@@ -201,6 +448,11 @@ if DEBUG == 'true':
 else:
     LOGGER.setLevel(logging.INFO)
 
-API_URL = get_ssm_secret_value(f'/{STAGE}/JamfPro/Address')
-API_USER = get_ssm_secret_value(f'/{STAGE}/JamfPro/Accts/EncryptionReport/Username')
-API_PASS = get_ssm_secret_value(f'/{STAGE}/JamfPro/Accts/EncryptionReport/Password')
+ADDRESS_PARAMETER = f'/{STAGE}/JamfPro/Address'
+USERNAME_PARAMETER = f'/{STAGE}/JamfPro/Accts/EncryptionReport/Username'
+PASSWORD_PARAMETER = f'/{STAGE}/JamfPro/Accts/EncryptionReport/Password'
+PARAMETERS = parameters.ParameterCache([
+    ADDRESS_PARAMETER,
+    USERNAME_PARAMETER,
+    PASSWORD_PARAMETER,
+])
@@ -5,96 +5,165 @@ computers that have checked in within a designated timeframe and remanaged.
 """
 
 import os
-import json
+import datetime
+import time
+import functools
+import itertools
 import urllib
-import requests
 import logging
 import boto3
-from botocore.exceptions import ClientError
+import requests
+import xml.etree.ElementTree as ElementTree
 from http.client import HTTPConnection
+import checkpoint
+import computermessage
+import jamfpro
+import metrics
+import parameters
+import snapshot
+import sqsbatch
 
 
-def api_get_advancedcomputersearch_by_name(name):
+def get_computers_from_search(name):
     """
-    Retrieve saved search data given a group name.
-
-    :param name: String The name of a Jamf Pro Advanced Search
-    :return: JSON Object containing information about the requests get
-        action. If error, returns None.
-    """
-
-    auth_tuple = (API_USER, API_PASS)
-    headers = {'Accept': 'application/json'}
-    url = f'{API_URL}/JSSResource/advancedcomputersearches/name/{name}'
+    Stream the computers in a Jamf Pro Advanced Search.
 
-    LOGGER.debug(f'URL generated: {url}')
+    The response is parsed as it arrives, so computers reach the queue
+    before the whole search has been downloaded and memory use stays flat
+    regardless of fleet size.
 
+    :param name: String The URL-quoted name of a Jamf Pro Advanced Search
+    :return: Generator yielding a Dictionary containing each computer's id,
+        name and display fields. If error, logs it and stops early.
+    """
     try:
-        r = requests.get(url, auth=auth_tuple, headers=headers)
-    except requests.exceptions.RequestException as e:
+        yield from get_jamf().iter_advancedcomputersearch_computers(name)
+    except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
         LOGGER.error(e)
-        return None
-    return r.json()
+        LOGGER.error('Failed to retreive Computer IDs from the Jamf Pro API.')
 
 
-def get_computer_ids_from_json(json_result):
+def skip_read(computers, carried, offset):
     """
-    Parse the Jamf Pro API JSON output and return a list of computer IDs.
+    Skip the computers an earlier part of the run already read.
 
-    :param json_result: JSON Object containing Jamf Pro API output
-    :return: [String] containing Computer IDs. If error, returns None.
+    :param computers: Iterable of computer Dictionaries, in search order.
+    :param carried: Set of Integer IDs seen by the earlier parts. If empty, e.g.
+        without SNAPSHOT_STORE, the first offset computers are skipped instead.
+    :param offset: Integer The number of computers the earlier parts read.
+    :return: Generator yielding each computer not read yet.
     """
+    if not carried:
+        LOGGER.warning(f'Resuming the search after its first {offset} computers. Set SNAPSHOT_STORE to resume by ID.')
+        return itertools.islice(computers, offset, None)
+    return (computer for computer in computers if computer['id'] not in carried)
+
 
-    LOGGER.debug('Value of the \'json\' parameter: '+json.dumps(json_result))
+def get_computers_from_inventory(stale_days, after_id=None):
+    """
+    Page through the Jamf Pro API inventory for computers that have checked
+    in within stale_days days but are unmanaged.
 
-    output = []
-    for computer in json_result['advanced_computer_search']['computers']:
-        output.append(int(computer['id']))
+    :param stale_days: Integer The number of days since last check-in that makes a computer stale.
+    :param after_id: Integer Start after this computer ID, e.g. when continuing a run. None starts at the first.
+    :return: Generator yielding a Dictionary containing each computer's id and
+        name. If error, logs it and stops early.
+    """
+    cutoff = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=stale_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    rsql_filter = f'general.lastContactTime=ge={cutoff};general.remoteManagement.managed==false'
+    LOGGER.debug(f'Inventory filter: {rsql_filter}')
 
-    return output
+    try:
+        for computer in get_jamf().iter_computers_inventory(rsql_filter, page_size=INVENTORY_PAGE_SIZE, after_id=after_id):
+            yield {'id': int(computer['id']), 'name': computer['general']['name']}
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        LOGGER.error(e)
+        LOGGER.error('Failed to retreive Computer IDs from the Jamf Pro API.')
 
 
 def get_ssm_secret_value(parameter_name):
     """
     Retreive a stored parameter from the AWS Systems Manager parameter store.
+    Values come from PARAMETERS, which loads them in one batch and keeps
+    them in memory for SSM_CACHE_TTL seconds.
 
     :param paramater_name: String The Parameter Key to retreive
     :return: String containing the Parameter Value
     """
+    return PARAMETERS.get(parameter_name)
+
 
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameter
-    return SSM.get_parameter(
-        Name=parameter_name,
-        WithDecryption=True
-    ).get("Parameter").get("Value")
+@functools.lru_cache(maxsize=None)
+def get_sqs():
+    """
+    :return: SQS Client, created on first use and reused by warm invocations.
+    """
+    return boto3.client('sqs')
 
 
-def send_to_sqs(sqs_queue_url, message):
+@functools.lru_cache(maxsize=None)
+def get_snapshot_store():
     """
-    Publish a message to SNS.
+    :return: Snapshot store for delta discovery, or None when SNAPSHOT_STORE is not set.
+    """
+    return snapshot.open_store(SNAPSHOT_STORE)
+
 
-    :param sqs_queue_url: String URL of SQS Queue
-    :param message: String The message body
-    :return: Dictionary containing information about the sent message. If
-        error, returns None.
+@functools.lru_cache(maxsize=None)
+def get_partial_snapshot_store():
     """
+    :return: Snapshot store for the IDs seen by the earlier parts of a run split
+        across invocations, kept beside SNAPSHOT_STORE. None when it is not set.
+    """
+    return snapshot.open_store(f'{SNAPSHOT_STORE}.partial' if SNAPSHOT_STORE else '')
 
-    try:
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.send_message
-        response = SQS.send_message(
-            QueueUrl=sqs_queue_url,
-            MessageBody=str(message)
-        )
-    except ClientError as e:
-        LOGGER.error(e)
-        return None
-    return response
+
+def load_carried_ids(cursor):
+    """
+    Read the IDs seen by the earlier parts of a run.
+
+    :param cursor: Dictionary The continuation's cursor.
+    :return: Set of Integer computer IDs. Empty when delta discovery is disabled or
+        they could not be read, in which case the next run enqueues them again.
+    """
+    store = get_partial_snapshot_store()
+    if store is None:
+        return set()
+    carried = snapshot.load_previous(store, float('inf'))
+    if carried is None or carried[1] != cursor['started_at']:
+        LOGGER.warning('The IDs seen by the earlier parts of this run are missing. They will be enqueued again by the next run.')
+        return set()
+    return carried[0]
+
+
+def get_jamf():
+    """
+    Get the shared Jamf Pro client, reading its credentials on first use.
+
+    :return: JamfProClient for this workflow's API account.
+    """
+    return jamfpro.get_client(
+        get_ssm_secret_value(ADDRESS_PARAMETER),
+        get_ssm_secret_value(USERNAME_PARAMETER),
+        get_ssm_secret_value(PASSWORD_PARAMETER)
+    )
 
 
+@metrics.instrument('RemanageDiscovery')
 def lambda_handler(event, context):
+    # A continuation event carries on from where the previous part of the run stopped
+    cursor = checkpoint.start(event)
+
     name = urllib.parse.quote(os.getenv("GROUP_NAME", ""))
-    if not os.getenv("GROUP_NAME"):
-        LOGGER.critical('Invalid environment variable: GROUP_NAME')
+    if DISCOVERY_SOURCE == 'inventory':
+        computers = get_computers_from_inventory(STALE_DAYS, cursor.get('after_id'))
+    elif DISCOVERY_SOURCE == 'advanced_search':
+        if not os.getenv("GROUP_NAME"):
+            LOGGER.critical('Invalid environment variable: GROUP_NAME')
+            return
+        computers = get_computers_from_search(name)
+    else:
+        LOGGER.critical('Invalid environment variable: DISCOVERY_SOURCE')
         return
 
     sqs_queue_url = os.getenv("SQS_QUEUE_URL")
@@ -102,29 +171,74 @@ def lambda_handler(event, context):
         LOGGER.critical('Invalid environment variable: SQS_QUEUE_URL')
         return
 
-    json_result = api_get_advancedcomputersearch_by_name(name)
-    if not json_result:
-        LOGGER.error('Failed to retreive a result from the Jamf Pro API.')
-        return
+    # Retries and timeouts stop short of the Lambda timeout
+    get_jamf().set_deadline(jamfpro.deadline_from_context(context))
 
-    computer_ids = get_computer_ids_from_json(json_result)
-    if computer_ids is None:
-        LOGGER.error('Failed to retreive Computer IDs from the returned JSON.')
-        return
-    elif computer_ids == []:
+    # Only computers missing from the previous run's snapshot are enqueued. Every
+    # part of a run compares against the same snapshot, which is only replaced
+    # once the last part finishes.
+    store = get_snapshot_store()
+    if cursor['part'] == 1:
+        previous = snapshot.load_previous(store, SNAPSHOT_MAX_AGE_DAYS * 86400)
+        carried = set()
+    else:
+        previous = None if cursor['full'] else snapshot.load_previous(store, float('inf'))
+        carried = load_carried_ids(cursor)
+    if previous is None:
+        previous_ids, synced_at = None, cursor.get('synced_at', time.time())
+    else:
+        previous_ids, synced_at = previous
+    seen = set()
+    progress = checkpoint.Progress(checkpoint.TimeBudget(context))
+    # The budget is checked while the search is still downloading, as well as while skipping
+    computers = progress.iterate(computers)
+    if DISCOVERY_SOURCE == 'advanced_search' and cursor['part'] > 1:
+        computers = skip_read(computers, carried, cursor.get('offset', 0))
+    computers = snapshot.iter_new(computers, previous_ids, seen)
+
+    LOGGER.info('Sending computers to the queue to be remanaged.')
+    messages = (computermessage.encode(computer) for computer in computers)
+    sent, failed = sqsbatch.send_message_batches(get_sqs(), sqs_queue_url, messages)
+    unchanged = len(seen) - sent - len(failed)
+    read = len(seen)
+    if not seen and not carried and not progress.stopped:
         LOGGER.info('No Computer IDs returned. The search appears to be empty.')
-        return
 
-    for computer_id in computer_ids:
-        LOGGER.info(
-            f'Sending Computer ID \'{computer_id}\' to the queue to be remanaged.')
-        send_to_sqs(sqs_queue_url, computer_id)
+    LOGGER.info(f'Enqueued {sent} computers. {len(failed)} failed. {unchanged} unchanged since the last run.')
+    if failed:
+        LOGGER.error(f'Computers that could not be enqueued: {failed}')
+
+    # Computers that never reached the queue stay out of the snapshot, so the next run retries them
+    seen.difference_update(computermessage.decode(body)['id'] for body in failed)
+    seen.update(carried)
+
+    continued = False
+    if progress.stopped and not read:
+        # Another part would start from the same place and stop the same way
+        LOGGER.critical('No computers were read before the time budget ran out. Giving up.')
+    elif progress.stopped:
+        if DISCOVERY_SOURCE == 'inventory':
+            position = {'after_id': progress.last['id']}
+        else:
+            position = {'offset': progress.count}
+        next_cursor = checkpoint.advance(cursor, full=previous_ids is None, synced_at=synced_at, **position)
+        # The IDs seen so far are kept aside until the last part writes the snapshot
+        snapshot.save(get_partial_snapshot_store(), seen, cursor['started_at'])
+        continued = checkpoint.continue_run(context, next_cursor)
+    else:
+        snapshot.save(store, seen, synced_at)
+
+    return {'enqueued': sent, 'failed': len(failed), 'unchanged': unchanged, 'continued': continued}
 
 
-SQS = boto3.client('sqs')
-SSM = boto3.client('ssm')
 STAGE = os.getenv("STAGE", "dev").lower()
 DEBUG = os.getenv("DEBUG", "False").lower()
+DISCOVERY_SOURCE = os.getenv("DISCOVERY_SOURCE", "advanced_search").lower()
+STALE_DAYS = int(os.getenv("STALE_DAYS", "30"))
+INVENTORY_PAGE_SIZE = int(os.getenv("INVENTORY_PAGE_SIZE", "500"))
+SNAPSHOT_STORE = os.getenv("SNAPSHOT_STORE", "")
+# Days after a full run before another is required. Discovery runs daily, so one run a week is full
+SNAPSHOT_MAX_AGE_DAYS = float(os.getenv("SNAPSHOT_MAX_AGE_DAYS", "7"))
 
 logging.basicConfig(format='%(levelname)s: %(asctime)s: %(message)s')
 LOGGER = logging.getLogger(__name__)
@@ -134,8 +248,11 @@ if DEBUG == 'true':
 else:
     LOGGER.setLevel(logging.INFO)
 
-API_URL = get_ssm_secret_value(f'/{STAGE}/JamfPro/Address')
-API_USER = get_ssm_secret_value(
-    f'/{STAGE}/JamfPro/Accts/RemanageComputers/Username')
-API_PASS = get_ssm_secret_value(
-    f'/{STAGE}/JamfPro/Accts/RemanageComputers/Password')
+ADDRESS_PARAMETER = f'/{STAGE}/JamfPro/Address'
+USERNAME_PARAMETER = f'/{STAGE}/JamfPro/Accts/RemanageComputers/Username'
+PASSWORD_PARAMETER = f'/{STAGE}/JamfPro/Accts/RemanageComputers/Password'
+PARAMETERS = parameters.ParameterCache([
+    ADDRESS_PARAMETER,
+    USERNAME_PARAMETER,
+    PASSWORD_PARAMETER,
+])
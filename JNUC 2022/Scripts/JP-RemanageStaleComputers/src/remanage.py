@@ -3,167 +3,119 @@ Accepts Jamf Pro Computer IDs from an AWS SQS queue and remanages them.
 The list of computers should include machines that have checked in 
 within a designated timeframe and unmanaged.
 """
+
 import os
+import functools
 import json
-import urllib
-import requests
 import logging
 import boto3
 from botocore.exceptions import ClientError
 from http.client import HTTPConnection
+import jamfpro
+import metrics
+import parameters
+import transition
 
-def send_to_microsoft_teams(SendToMicrosoftTeams_URL, computer_id):
-    """
-    Publish a message to SNS.
 
-    :param sqs_queue_url: String URL of SQS Queue
-    :param computer_id: String identifier for a Jamf Pro computer object
-    :return: Dictionary containing information about the sent message. If
-        error, returns None.
+def get_ssm_secret_value(parameter_name):
     """
-    webhook_url = get_ssm_secret_value(f'/{STAGE}/JamfPro/Webhooks/WVUAppleAdmins/AWS-Automation')
-    computer_name = get_computer_name_by_id(computer_id)
-    teams_title = "Automated Remanagement"
-    teams_text = f"**Remanaged the following machine:**\n\rMachine Name: {computer_name}\n\rComputer ID: {computer_id}\n\rURL: {API_URL}/computers.html?id={computer_id}"
-
-    msg = {
-        "webhook": {
-            "url": webhook_url
-        },
-        "message": {
-            "title": teams_title,
-            "text": teams_text
-        }
-    }
+    Retreive a stored parameter from the AWS Systems Manager parameter store.
+    Values come from PARAMETERS, which loads them in one batch and keeps
+    them in memory for SSM_CACHE_TTL seconds.
 
-    encoded_msg = json.dumps(msg)
-    LOGGER.debug('Message being sent: {encoded_msg}')
+    :param paramater_name: String The Parameter Key to retreive
+    :return: String containing the Parameter Value
+    """
+    return PARAMETERS.get(parameter_name)
 
-    return send_to_sqs(SendToMicrosoftTeams_URL, encoded_msg)
 
-def send_to_sqs(sqs_queue_url, message):
+@functools.lru_cache(maxsize=None)
+def get_sqs():
     """
-    Publish a message to SNS.
-
-    :param sqs_queue_url: String URL of SQS Queue
-    :param message: String The message body
-    :return: Dictionary containing information about the sent message. If
-        error, returns None.
+    :return: SQS Client, created on first use and reused by warm invocations.
     """
+    return boto3.client('sqs')
 
-    try:
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.send_message
-        response = SQS.send_message(
-            QueueUrl=sqs_queue_url,
-            MessageBody=message
-        )
-    except ClientError as e:
-        LOGGER.error(e)
-        return None
-    return response
 
-def api_get_request(url):
+def get_jamf():
     """
-    Make a GET request to the Jamf Pro API.
+    Get the shared Jamf Pro client, reading its credentials on first use.
 
-    :param url: String The url to connect to.
-    :return: JSON Object containing information about the request's get
-        action. If error, returns None.
+    :return: JamfProClient for this workflow's API account.
     """
-    auth_tuple = (API_USER, API_PASS)
-    headers = { 'Accept': 'application/json' }
+    return jamfpro.get_client(
+        get_ssm_secret_value(ADDRESS_PARAMETER),
+        get_ssm_secret_value(USERNAME_PARAMETER),
+        get_ssm_secret_value(PASSWORD_PARAMETER)
+    )
 
-    try:
-        r = requests.get(url, auth=auth_tuple, headers=headers)
-    except requests.exceptions.RequestException as e:
-        LOGGER.error(e)
-        return None
-    return r.json()
 
-def api_put_request(url, data):
+def send_to_microsoft_teams(SendToMicrosoftTeams_URL, computer):
     """
-    Make a change to an existing Jamf Pro object via API.
+    Queue a Teams message saying a computer was remanaged.
 
-    :param url: String The url to connect to.
-    :param data: String XML containing the changed elements.
-    :return: Dictionary containing each cookie from the PUT request. If error, returns None.
+    :param SendToMicrosoftTeams_URL: String URL of the SendToTeams SQS Queue
+    :param computer: Dictionary containing the computer's id and name.
+    :return: Dictionary containing information about the sent message. If
+        error, returns None.
     """
-    auth_tuple = (API_USER, API_PASS)
+    webhook_url = get_ssm_secret_value(WEBHOOK_PARAMETER)
+    msg = transition.REMANAGE.teams_message(webhook_url, get_jamf().url, computer)
 
-    try:
-        r = requests.put(url, auth=auth_tuple, data=data)
-        LOGGER.debug(str(r.content))
-    
-    except requests.exceptions.RequestException as e:
-        LOGGER.error(e)
-        return None
-
-    return r.cookies
+    encoded_msg = json.dumps(msg)
+    LOGGER.debug(f'Message being sent: {encoded_msg}')
 
-def get_computer_name_by_id(computer_id):
-    """
-    Get a computer record from a Jamf Pro API given the computer ID.
-    
-    :param computer_id: String identifier for a Jamf Pro computer object
-    :return: Response Object containing information about the requests get
-        action. If error, returns None.
-    """
-    url = f'{API_URL}/JSSResource/computers/id/{computer_id}/subset/General'
-    LOGGER.debug(f'URL generated: {url}')
-   
-    computer_record = api_get_request(url)
+    return send_to_sqs(SendToMicrosoftTeams_URL, encoded_msg)
 
-    return computer_record["computer"]["general"]["name"]
 
-def api_remanage_computer_by_id(computer_id):
+def send_to_sqs(sqs_queue_url, message):
     """
-    Remanage a computer from the Jamf Pro API given the computer ID.
+    Publish a message to SQS.
 
-    :param computer_id: String identifier for a Jamf Pro computer object
-    :return: Response Object containing information about the requests 
-        action. If error, returns None.
+    :param sqs_queue_url: String URL of SQS Queue
+    :param message: String The message body
+    :return: Dictionary containing information about the sent message. If
+        error, returns None.
     """
-    url = f'{API_URL}/JSSResource/computers/id/{computer_id}'
-    LOGGER.debug(f'URL generated: {url}')
 
-    remanage_computer_xml = u'<?xml version="1.0" encoding="UTF-8"?><computer><general><remote_management><managed>true</managed><management_username>automated-remanagenment</management_username><management_password>Remanaged-Machine</management_password></remote_management></general></computer>'
-
-    return api_put_request(url, remanage_computer_xml)
-
-def get_ssm_secret_value(parameter_name):
-    """
-    Retreive a stored parameter from the AWS Systems Manager parameter store.
+    try:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.send_message
+        with metrics.timer('SQSSendTime'):
+            response = get_sqs().send_message(
+                QueueUrl=sqs_queue_url,
+                MessageBody=message
+            )
+    except ClientError as e:
+        LOGGER.error(e)
+        return None
+    return response
 
-    :param paramater_name: String The Parameter Key to retreive
-    :return: String containing the Parameter Value
-    """
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameter
-    return SSM.get_parameter(
-        Name=parameter_name,
-        WithDecryption=True
-    ).get("Parameter").get("Value")
 
+@metrics.instrument('RemanageComputers')
 def lambda_handler(event, context):
     SendToMicrosoftTeams_URL = os.getenv("SendToMicrosoftTeams_URL")
     if not SendToMicrosoftTeams_URL:
         LOGGER.critical('Invalid environment variable: SendToMicrosoftTeams_URL')
         return
 
-    for record in event['Records']:
-        computer_id = record["body"]
+    # Retries and timeouts stop short of the Lambda timeout
+    get_jamf().set_deadline(jamfpro.deadline_from_context(context))
 
-        LOGGER.info(f'Remanaging Computer ID: {computer_id}')
-        LOGGER.debug('Debug is enabled. Computer will not be Remanaged.')
+    engine = transition.TransitionEngine(
+        get_jamf(),
+        transition.REMANAGE,
+        notify=lambda computer: send_to_microsoft_teams(SendToMicrosoftTeams_URL, computer) is not None,
+        max_workers=MAX_WORKERS,
+        async_limit=ASYNC_LIMIT
+    )
+    # Debug mode plans the batch and reports it without writing
+    return transition.handle_sqs_batch(event, engine, 'RemanageComputers', dry_run=DEBUG != 'false')
 
-        if DEBUG == 'false':
-            # Only perform remanage if not in debug mode
-            if api_remanage_computer_by_id(computer_id):
-                send_to_microsoft_teams(SendToMicrosoftTeams_URL, computer_id)
 
-SSM = boto3.client('ssm')
-SQS = boto3.client('sqs')
 STAGE = os.getenv("STAGE", "dev").lower()
 DEBUG = os.getenv("DEBUG", "False").lower()
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "10"))
+ASYNC_LIMIT = int(os.getenv("ASYNC_LIMIT", "0"))
 
 logging.basicConfig(format='%(levelname)s: %(asctime)s: %(message)s')
 LOGGER = logging.getLogger(__name__)
@@ -173,6 +125,13 @@ if DEBUG == 'true':
 else:
     LOGGER.setLevel(logging.INFO)
 
-API_URL = get_ssm_secret_value(f'/{STAGE}/JamfPro/Address')
-API_USER = get_ssm_secret_value(f'/{STAGE}/JamfPro/Accts/RemanageComputers/Username')
-API_PASS = get_ssm_secret_value(f'/{STAGE}/JamfPro/Accts/RemanageComputers/Password')
\ No newline at end of file
+WEBHOOK_PARAMETER = f'/{STAGE}/JamfPro/Webhooks/WVUAppleAdmins/AWS-Automation'
+ADDRESS_PARAMETER = f'/{STAGE}/JamfPro/Address'
+USERNAME_PARAMETER = f'/{STAGE}/JamfPro/Accts/RemanageComputers/Username'
+PASSWORD_PARAMETER = f'/{STAGE}/JamfPro/Accts/RemanageComputers/Password'
+PARAMETERS = parameters.ParameterCache([
+    ADDRESS_PARAMETER,
+    USERNAME_PARAMETER,
+    PASSWORD_PARAMETER,
+    WEBHOOK_PARAMETER,
+])
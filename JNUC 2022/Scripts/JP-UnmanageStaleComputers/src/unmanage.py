@@ -5,117 +5,72 @@ within a designated timeframe.
 """
 
 import os
+import functools
 import json
-import requests
 import logging
 import boto3
 from botocore.exceptions import ClientError
 from http.client import HTTPConnection
+import jamfpro
+import metrics
+import parameters
+import transition
 
 
-def api_get_request(url):
+def get_ssm_secret_value(parameter_name):
     """
-    Make a GET request to the Jamf Pro API.
+    Retreive a stored parameter from the AWS Systems Manager parameter store.
+    Values come from PARAMETERS, which loads them in one batch and keeps
+    them in memory for SSM_CACHE_TTL seconds.
 
-    :param url: String The url to connect to.
-    :return: JSON Object containing information about the request's get
-        action. If error, returns None.
+    :param paramater_name: String The Parameter Key to retreive
+    :return: String containing the Parameter Value
     """
-    auth_tuple = (API_USER, API_PASS)
-    headers = { 'Accept': 'application/json' }
-
-    try:
-        r = requests.get(url, auth=auth_tuple, headers=headers)
-    except requests.exceptions.RequestException as e:
-        LOGGER.error(e)
-        return None
-    return r.json()
+    return PARAMETERS.get(parameter_name)
 
 
-def api_put_request(url, data):
+@functools.lru_cache(maxsize=None)
+def get_sqs():
     """
-    Make a change to an existing Jamf Pro object via API.
-
-    :param url: String The url to connect to.
-    :param data: String XML containing the changed elements.
-    :return: Dictionary containing each cookie from the PUT request. If error, returns None.
+    :return: SQS Client, created on first use and reused by warm invocations.
     """
-    auth_tuple = (API_USER, API_PASS)
-
-    try:
-        r = requests.put(url, auth=auth_tuple, data=data)
-        LOGGER.debug(str(r.content))
-    except requests.exceptions.RequestException as e:
-        LOGGER.error(e)
-        return None
-
-    return r.cookies
+    return boto3.client('sqs')
 
 
-def get_computer_name_by_id(computer_id):
+def get_jamf():
     """
-    Get a computer record from a Jamf Pro API given the computer ID.
-    
-    :param computer_id: String identifier for a Jamf Pro computer object
-    :return: Response Object containing information about the requests get
-        action. If error, returns None.
-    """
-    url = f'{API_URL}/JSSResource/computers/id/{computer_id}/subset/General'
-    LOGGER.debug(f'URL generated: {url}')
-    
-    computer_record = api_get_request(url)
-
-    return computer_record["computer"]["general"]["name"]
-    
+    Get the shared Jamf Pro client, reading its credentials on first use.
 
-def get_ssm_secret_value(parameter_name):
-    """
-    Retreive a stored parameter from the AWS Systems Manager parameter store.
-
-    :param paramater_name: String The Parameter Key to retreive
-    :return: String containing the Parameter Value
+    :return: JamfProClient for this workflow's API account.
     """
+    return jamfpro.get_client(
+        get_ssm_secret_value(ADDRESS_PARAMETER),
+        get_ssm_secret_value(USERNAME_PARAMETER),
+        get_ssm_secret_value(PASSWORD_PARAMETER)
+    )
 
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameter
-    return SSM.get_parameter(
-        Name=parameter_name,
-        WithDecryption=True
-    ).get("Parameter").get("Value")
 
-
-def send_to_microsoft_teams(SendToTeams_URL, computer_id):
+def send_to_microsoft_teams(SendToTeams_URL, computer):
     """
-    Publish a message to SNS.
+    Queue a Teams message saying a computer was unmanaged.
 
-    :param sqs_queue_url: String URL of SQS Queue
-    :param computer_id: String identifier for a Jamf Pro computer object
+    :param SendToTeams_URL: String URL of the SendToTeams SQS Queue
+    :param computer: Dictionary containing the computer's id and name.
     :return: Dictionary containing information about the sent message. If
         error, returns None.
     """
-    webhook_url = get_ssm_secret_value(f'/{STAGE}/Webhooks/MSTeams/TeamName/ChannelName')
-    computer_name = get_computer_name_by_id(computer_id)
-    teams_title = "Automated Unmanagement"
-    teams_text = f"**Unmanaged the following machine:**\n\rMachine Name: {computer_name}\n\rComputer ID: {computer_id}\n\rURL: {API_URL}/computers.html?id={computer_id}"
-
-    msg = {
-        "webhook": {
-            "url": webhook_url
-        },
-        "message": {
-            "title": teams_title,
-            "text": teams_text
-        }
-    }
+    webhook_url = get_ssm_secret_value(WEBHOOK_PARAMETER)
+    msg = transition.UNMANAGE.teams_message(webhook_url, get_jamf().url, computer)
 
     encoded_msg = json.dumps(msg)
-    LOGGER.debug('Message being sent: {encoded_msg}')
+    LOGGER.debug(f'Message being sent: {encoded_msg}')
 
     return send_to_sqs(SendToTeams_URL, encoded_msg)
 
 
 def send_to_sqs(sqs_queue_url, message):
     """
-    Publish a message to SNS.
+    Publish a message to SQS.
 
     :param sqs_queue_url: String URL of SQS Queue
     :param message: String The message body
@@ -125,54 +80,42 @@ def send_to_sqs(sqs_queue_url, message):
 
     try:
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.send_message
-        response = SQS.send_message(
-            QueueUrl=sqs_queue_url,
-            MessageBody=message
-        )
+        with metrics.timer('SQSSendTime'):
+            response = get_sqs().send_message(
+                QueueUrl=sqs_queue_url,
+                MessageBody=message
+            )
     except ClientError as e:
         LOGGER.error(e)
         return None
     return response
 
 
-def unmanage_computer_by_id(computer_id):
-    """
-    Unmanage a computer from the Jamf Pro API given the computer ID.
-
-    :param computer_id: String identifier for a Jamf Pro computer object
-    :return: Response Object containing information about the requests 
-        action. If error, returns None.
-    """
-    url = f'{API_URL}/JSSResource/computers/id/{computer_id}'
-    LOGGER.debug(f'URL generated: {url}')
-
-    unmanage_computer_xml = u'<?xml version="1.0" encoding="UTF-8"?><computer><general><remote_management><managed>false</managed></remote_management></general></computer>'
-
-    return api_put_request(url, unmanage_computer_xml)
-
-
+@metrics.instrument('UnmanageComputers')
 def lambda_handler(event, context):
     SendToTeams_URL = os.getenv("SendToTeams_URL")
     if not SendToTeams_URL:
         LOGGER.critical('Invalid environment variable: SendToTeams_URL')
         return
 
-    for record in event['Records']:
-        computer_id = record["body"]
-        
-        LOGGER.info(f'Unmanaging Computer ID: {computer_id}')
-        LOGGER.debug('Debug is enabled. Computer will not be unmanaged.')
+    # Retries and timeouts stop short of the Lambda timeout
+    get_jamf().set_deadline(jamfpro.deadline_from_context(context))
 
-        if DEBUG == 'false':
-            # Only perform unmanage if not in debug mode
-            if unmanage_computer_by_id(computer_id):
-                send_to_microsoft_teams(SendToTeams_URL, computer_id)
+    engine = transition.TransitionEngine(
+        get_jamf(),
+        transition.UNMANAGE,
+        notify=lambda computer: send_to_microsoft_teams(SendToTeams_URL, computer) is not None,
+        max_workers=MAX_WORKERS,
+        async_limit=ASYNC_LIMIT
+    )
+    # Debug mode plans the batch and reports it without writing
+    return transition.handle_sqs_batch(event, engine, 'UnmanageComputers', dry_run=DEBUG != 'false')
 
 
-SQS = boto3.client('sqs')
-SSM = boto3.client('ssm')
 STAGE = os.getenv("STAGE", "dev").lower()
 DEBUG = os.getenv("DEBUG", "False").lower()
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "10"))
+ASYNC_LIMIT = int(os.getenv("ASYNC_LIMIT", "0"))
 
 logging.basicConfig(format='%(levelname)s: %(asctime)s: %(message)s')
 LOGGER = logging.getLogger(__name__)
@@ -182,6 +125,13 @@ if DEBUG == 'true':
 else:
     LOGGER.setLevel(logging.INFO)
 
-API_URL = get_ssm_secret_value(f'/{STAGE}/JamfPro/Address')
-API_USER = get_ssm_secret_value(f'/{STAGE}/JamfPro/Accts/UnmanageComputers/Username')
-API_PASS = get_ssm_secret_value(f'/{STAGE}/JamfPro/Accts/UnmanageComputers/Password')
+WEBHOOK_PARAMETER = f'/{STAGE}/Webhooks/MSTeams/TeamName/ChannelName'
+ADDRESS_PARAMETER = f'/{STAGE}/JamfPro/Address'
+USERNAME_PARAMETER = f'/{STAGE}/JamfPro/Accts/UnmanageComputers/Username'
+PASSWORD_PARAMETER = f'/{STAGE}/JamfPro/Accts/UnmanageComputers/Password'
+PARAMETERS = parameters.ParameterCache([
+    ADDRESS_PARAMETER,
+    USERNAME_PARAMETER,
+    PASSWORD_PARAMETER,
+    WEBHOOK_PARAMETER,
+])
@@ -0,0 +1,270 @@
+"""
+Asynchronous fan-out over the Jamf Pro API.
+
+JamfProClient holds one request per thread, so a thread pool bounds how many
+calls are in flight. The helpers here send many independent requests, e.g. a
+GET or PUT per computer, from a single thread with asyncio and aiohttp, with
+at most `limit` of them in flight at once. They borrow the server address,
+bearer token, deadline and circuit breaker of a JamfProClient and retry the
+same failures the same way, so the two clients can be used side by side.
+
+Each helper runs its own event loop and returns once every request has
+finished, so callers stay synchronous:
+
+records = asyncjamf.get_json_many(client, paths, limit=100)
+
+Writes sent this way are also held to the client's adaptive write limit,
+shared with its threads, so at most the smaller of the two is in flight.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import aiohttp
+import requests
+import jamfpro
+import metrics
+
+
+DEFAULT_LIMIT = 100
+# How often a write waiting for the adaptive limit checks it again, in case a thread freed a place
+WRITE_POLL_SECONDS = 0.05
+
+# A received response. It has headers like a requests Response, for jamfpro.retry_delay
+Reply = collections.namedtuple('Reply', ['status', 'headers', 'body'])
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AsyncJamfProSession:
+    """
+    aiohttp session sending requests on behalf of a JamfProClient.
+    """
+
+    def __init__(self, client, session):
+        """
+        :param client: JamfProClient whose server, token, deadline and circuit breaker are used.
+        :param session: aiohttp.ClientSession The session requests are sent with.
+        """
+        self.client = client
+        self.session = session
+
+        self._token = None
+        self._token_lock = asyncio.Lock()
+        self._write_released = asyncio.Condition()
+
+    async def token(self, rejected=None):
+        """
+        Get the client's bearer token. Token requests are blocking, so they run in the default executor.
+
+        :param rejected: String A token the server refused. It is replaced once,
+            however many requests saw it refused.
+        :return: String containing the bearer token.
+        """
+        async with self._token_lock:
+            if self._token is None or self._token == rejected:
+                if rejected is not None:
+                    self.client.invalidate_token()
+                self._token = await asyncio.get_running_loop().run_in_executor(None, self.client.token)
+            return self._token
+
+    async def acquire_write(self, write_limiter):
+        """
+        Wait for a place under the adaptive write limit without blocking the event loop.
+
+        :param write_limiter: limiter.AdaptiveLimiter The client's write limiter.
+        :return: Float start time to pass to release_write().
+        """
+        async with self._write_released:
+            while True:
+                started = write_limiter.try_acquire()
+                if started is not None:
+                    return started
+                try:
+                    await asyncio.wait_for(self._write_released.wait(), WRITE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release_write(self, write_limiter, started, status_code):
+        """
+        Free a place under the adaptive write limit and wake the writes waiting for one.
+        """
+        write_limiter.release(started, status_code)
+        async with self._write_released:
+            self._write_released.notify_all()
+
+    def timeout(self):
+        """
+        :return: aiohttp.ClientTimeout cut short by the client's deadline.
+        :raises jamfpro.DeadlineExceeded: If the deadline has passed.
+        """
+        connect, read = self.client.timeout()
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+    async def send(self, method, url, headers, data):
+        """
+        Send one authenticated request, renewing the token once if it was rejected.
+
+        :return: Reply, whatever its status.
+        :raises aiohttp.ClientError: If no response was received.
+        :raises asyncio.TimeoutError: If the server did not answer in time.
+        """
+        write_limiter = self.client.write_limiter if method in jamfpro.WRITE_METHODS else None
+        for attempt in range(2):
+            token = await self.token()
+            headers['Authorization'] = f'Bearer {token}'
+            if write_limiter is None:
+                r, body = await self.send_once(method, url, headers, data)
+            else:
+                started = await self.acquire_write(write_limiter)
+                status_code = None
+                try:
+                    r, body = await self.send_once(method, url, headers, data)
+                    status_code = r.status
+                finally:
+                    await self.release_write(write_limiter, started, status_code)
+            if r.status != 401 or attempt:
+                return Reply(r.status, r.headers, body)
+            await self.token(rejected=token)
+
+    async def send_once(self, method, url, headers, data):
+        """
+        :return: Tuple of the aiohttp.ClientResponse and its Bytes body.
+        """
+        async with self.session.request(method, url, headers=headers, data=data, timeout=self.timeout()) as r:
+            body = await r.read()
+        return r, body
+
+    async def request(self, method, path, headers=None, data=None):
+        """
+        Send an authenticated request, retrying transient failures as JamfProClient.request does.
+
+        :param method: String The HTTP method.
+        :param path: String The API path, e.g. /JSSResource/computers/id/1
+        :param headers: Dictionary of extra request headers.
+        :param data: String request body, or None.
+        :return: Bytes body of a successful response.
+        :raises requests.exceptions.RequestException: If the request failed. This
+            includes circuit.CircuitOpenError while the server is failing.
+        """
+        url = f'{self.client.url}{path}'
+        endpoint = f'{method} {jamfpro.endpoint_name(path)}'
+        breaker = self.client.breaker
+
+        headers = dict(headers or {})
+        for attempt in range(jamfpro.MAX_ATTEMPTS):
+            breaker.before_request()
+            try:
+                with metrics.timer('JamfRequestTime', Endpoint=endpoint):
+                    reply = await self.send(method, url, headers, data)
+            except jamfpro.DeadlineExceeded:
+                breaker.cancel_trial()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                error = requests.exceptions.ConnectionError(f'{method} {url} failed: {e!r}')
+                if method not in jamfpro.IDEMPOTENT_METHODS:
+                    raise error
+                delay = jamfpro.retry_delay(None, attempt)
+            except requests.exceptions.RequestException:
+                # e.g. the token request was refused, which retrying will not fix
+                breaker.cancel_trial()
+                raise
+            else:
+                error = requests.exceptions.HTTPError(f'{reply.status} Error for url: {url}')
+                if reply.status not in jamfpro.RETRY_STATUS_CODES:
+                    breaker.record_success()
+                    if reply.status >= 400:
+                        raise error
+                    return reply.body
+                breaker.record_failure()
+                if method not in jamfpro.IDEMPOTENT_METHODS and reply.status not in jamfpro.NOT_PROCESSED_STATUS_CODES:
+                    raise error
+                delay = jamfpro.retry_delay(reply, attempt)
+
+            remaining = self.client.remaining()
+            if attempt + 1 == jamfpro.MAX_ATTEMPTS or (remaining is not None and delay >= remaining):
+                break
+            LOGGER.warning(f'{method} {path} failed ({error}). Retrying in {delay:.2f}s.')
+            metrics.count('JamfRetries', Endpoint=endpoint)
+            await asyncio.sleep(delay)
+
+        metrics.count('JamfFailures', Endpoint=endpoint)
+        raise error
+
+
+async def fan_out(calls, limit=DEFAULT_LIMIT):
+    """
+    Await many calls, at most limit of them at once.
+
+    :param calls: Iterable of Functions, each taking no arguments and returning a coroutine.
+    :param limit: Integer The largest number of calls in flight.
+    :return: List of each call's result, in the order of calls.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(call):
+        async with semaphore:
+            return await call()
+
+    return await asyncio.gather(*(bounded(call) for call in calls))
+
+
+async def request_many(client, method, items, limit, headers=None):
+    """
+    Send one request per item from a single session.
+
+    :param client: JamfProClient whose server, token, deadline and circuit breaker are used.
+    :param method: String The HTTP method.
+    :param items: [(String, String)] Each request's API path and body (None for no body).
+    :param limit: Integer The largest number of requests in flight.
+    :param headers: Dictionary of headers sent with every request.
+    :return: List of each response's Bytes body, or None where the request failed.
+    """
+    connector = aiohttp.TCPConnector(limit=limit)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        jamf = AsyncJamfProSession(client, session)
+
+        async def send(path, data):
+            try:
+                return await jamf.request(method, path, headers, data)
+            except requests.exceptions.RequestException as e:
+                LOGGER.error(e)
+                return None
+
+        return await fan_out([lambda path=path, data=data: send(path, data) for path, data in items], limit)
+
+
+def get_json_many(client, paths, limit=DEFAULT_LIMIT):
+    """
+    Make many GET requests to the Jamf Pro API at once.
+
+    :param client: JamfProClient whose server and credentials are used.
+    :param paths: [String] The API paths to connect to.
+    :param limit: Integer The largest number of requests in flight.
+    :return: List of each path's JSON Object, in the order of paths. If error, that entry is None.
+    """
+    bodies = asyncio.run(request_many(client, 'GET', [(path, None) for path in paths], limit,
+                                      {'Accept': 'application/json'}))
+    results = []
+    for path, body in zip(paths, bodies):
+        try:
+            results.append(None if body is None else json.loads(body))
+        except ValueError as e:
+            LOGGER.error(f'Invalid JSON from {path}: {e}')
+            results.append(None)
+    return results
+
+
+def put_xml_many(client, items, limit=DEFAULT_LIMIT):
+    """
+    Make many changes to existing Jamf Pro objects at once.
+
+    :param client: JamfProClient whose server and credentials are used.
+    :param items: [(String, String)] Each API path and the XML of its changed elements.
+    :param limit: Integer The largest number of requests in flight.
+    :return: List of Booleans, True where the change was made, in the order of items.
+    """
+    bodies = asyncio.run(request_many(client, 'PUT', items, limit, {'Content-Type': 'application/xml'}))
+    return [body is not None for body in bodies]
@@ -0,0 +1,149 @@
+"""
+Time budgets and continuations for runs that outlast one invocation.
+
+A handler working through a long list (sites, search results, inventory
+pages) checks its TimeBudget between items. Once only the reserve is left
+it stops, records where it got to in a cursor, and invokes its own function
+asynchronously with that cursor. The continuation carries on from the
+cursor, so a run too large for one invocation finishes across several
+instead of being killed and starting again from zero.
+
+A cursor is a Dictionary that is small enough for the invocation payload.
+It always holds the run's part number and start time, plus the handler's
+own position, e.g. an offset or the last ID handled:
+
+{"checkpoint": {"part": 2, "started_at": 1790000000.0, "after_id": 41250}}
+"""
+
+import functools
+import json
+import logging
+import os
+import time
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+import metrics
+
+
+# Seconds kept back to finish in-flight work, save state and invoke the continuation. Keep it
+# above jamfpro.DEADLINE_MARGIN_SECONDS, or requests started within the budget are cut short.
+RESERVE_SECONDS = float(os.getenv("CHECKPOINT_RESERVE_SECONDS", "3"))
+# Parts a run may be split into before it is abandoned, so a run that never progresses cannot loop forever
+MAX_PARTS = int(os.getenv("CHECKPOINT_MAX_PARTS", "20"))
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TimeBudget:
+    """
+    The time an invocation has left for work, short of its reserve.
+    """
+
+    def __init__(self, context, reserve=RESERVE_SECONDS):
+        """
+        :param context: Lambda context Object, or None outside Lambda.
+        :param reserve: Float Seconds kept back for finishing up.
+        """
+        self.context = context
+        self.reserve = reserve
+
+    def remaining(self):
+        """
+        :return: Float seconds left for work, or None if there is no context.
+        """
+        if self.context is None:
+            return None
+        return self.context.get_remaining_time_in_millis() / 1000 - self.reserve
+
+    def expired(self):
+        """
+        :return: Boolean True once no more work should be started.
+        """
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+
+class Progress:
+    """
+    Passes on items from an iterable until a time budget runs out, counting them.
+    """
+
+    def __init__(self, budget):
+        """
+        :param budget: TimeBudget checked before each item.
+        """
+        self.budget = budget
+        self.count = 0
+        self.last = None
+        self.stopped = False
+
+    def iterate(self, items):
+        """
+        :param items: Iterable of items to pass on.
+        :return: Generator yielding each item until the budget runs out. stopped
+            is then True, and count and last describe the items passed on.
+        """
+        for item in items:
+            if self.budget.expired():
+                self.stopped = True
+                return
+            self.count += 1
+            self.last = item
+            yield item
+
+
+def start(event):
+    """
+    :param event: Dictionary The Lambda event.
+    :return: Dictionary The cursor of a continuation event, or a new cursor for the first part of a run.
+    """
+    cursor = event.get('checkpoint') if isinstance(event, dict) else None
+    if isinstance(cursor, dict) and 'part' in cursor:
+        LOGGER.info(f'Continuing run started at {cursor["started_at"]}, part {cursor["part"]}.')
+        return cursor
+    return {'part': 1, 'started_at': time.time()}
+
+
+def advance(cursor, **position):
+    """
+    :param cursor: Dictionary The current part's cursor.
+    :param position: The handler's position, e.g. after_id=41250
+    :return: Dictionary cursor for the next part.
+    """
+    return dict(cursor, part=cursor['part'] + 1, **position)
+
+
+@functools.lru_cache(maxsize=None)
+def get_lambda():
+    """
+    :return: Lambda Client, created on first use and reused by warm invocations.
+    """
+    return boto3.client('lambda')
+
+
+def continue_run(context, cursor):
+    """
+    Invoke the running function again, asynchronously, to carry on from a cursor.
+
+    :param context: Lambda context Object of the current invocation.
+    :param cursor: Dictionary from advance().
+    :return: Boolean True if the continuation was started, otherwise False.
+    """
+    if cursor['part'] > MAX_PARTS:
+        LOGGER.critical(f'Run started at {cursor["started_at"]} is still unfinished after {MAX_PARTS} parts. Giving up.')
+        return False
+
+    try:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/lambda.html#Lambda.Client.invoke
+        get_lambda().invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({'checkpoint': cursor}).encode()
+        )
+    except (BotoCoreError, ClientError) as e:
+        LOGGER.error(f'Failed to start the continuation: {e}')
+        return False
+
+    LOGGER.info(f'Time budget reached. Part {cursor["part"]} will continue the run.')
+    metrics.count('Continuations')
+    return True
@@ -0,0 +1,79 @@
+"""
+Circuit breaker for Jamf Pro API calls.
+
+After a run of consecutive transient failures the circuit opens and calls
+fail immediately instead of piling more load onto an unhealthy server.
+Once the reset timeout passes, a single trial call is let through: success
+closes the circuit again, failure keeps it open for another timeout.
+"""
+
+import logging
+import threading
+import time
+import requests
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of sending a request while the circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker shared by every thread using a client.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        """
+        :param failure_threshold: Integer The consecutive failures that open the circuit.
+        :param reset_timeout: Float Seconds the circuit stays open before a trial call.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+        self._lock = threading.Lock()
+        self._trial_in_flight = False
+
+    def before_request(self):
+        """
+        Check that a request may be sent.
+
+        :raises CircuitOpenError: If the circuit is open.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        raise CircuitOpenError('Jamf Pro circuit is open after repeated failures. Failing fast.')
+
+    def cancel_trial(self):
+        """
+        Forget a request that ended without saying whether the server is healthy.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                LOGGER.info('Jamf Pro is responding again. Circuit closed.')
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                LOGGER.error(f'Jamf Pro failed {self.failures} times in a row. '
+                             f'Circuit open for {self.reset_timeout}s.')
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
@@ -0,0 +1,45 @@
+"""
+Queue message format for computers passed between the Jamf Pro workflows.
+
+Discovery sends each computer as a JSON object holding its ID, name and any
+other display fields from the Advanced Search, e.g.
+
+{"id": 42, "name": "Mac-000042", "Serial_Number": "C02XXXXXXXXX"}
+
+so consumers do not have to look the computer up again. Messages written
+before this format existed hold only the bare computer ID; those decode
+with a name of None.
+"""
+
+import json
+
+
+def encode(computer):
+    """
+    Build the queue message for a computer.
+
+    :param computer: Dictionary containing at least the computer's id. Usually
+        one computer from an Advanced Search result.
+    :return: String JSON message body.
+    """
+    message = dict(computer)
+    message['id'] = int(message['id'])
+    return json.dumps(message, separators=(',', ':'))
+
+
+def decode(body):
+    """
+    Read a computer from a queue message.
+
+    :param body: String The message body, JSON or a bare computer ID.
+    :return: Dictionary containing the computer's id, name and display fields.
+        The name is None when the message did not carry one.
+    """
+    body = body.strip()
+    if body.isdigit():
+        return {'id': int(body), 'name': None}
+
+    computer = json.loads(body)
+    computer['id'] = int(computer['id'])
+    computer.setdefault('name', None)
+    return computer
@@ -0,0 +1,236 @@
+"""
+History of EncryptionReport runs, for trends without asking Jamf Pro again.
+
+Each run is stored once and never rewritten, as columns of equal length:
+
+{"taken_at": 1790000000.0, "site_id": [1, 2], "site": ["Main", "Lab"], "encrypted": [120, null]}
+
+A count of null means the site could not be counted that run. The query
+functions work on loaded runs: month_over_month compares the latest run of
+each month with the latest run of an earlier month, and fleet_totals and
+rank_sites summarise them. Stores are chosen with a URL:
+
+file:///tmp/encryption.jsonl     JSON Lines file, one run appended per line
+s3://bucket/encryption/          One JSON object per run under the prefix
+"""
+
+import json
+import logging
+import time
+import urllib.parse
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+# Errors any store may raise while reading or writing
+STORE_ERRORS = (OSError, ValueError, KeyError, BotoCoreError, ClientError)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FileHistoryStore:
+    """
+    Runs kept as lines of a JSON Lines file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: String The file to append to and read.
+        """
+        self.path = path
+
+    def load(self):
+        """
+        :return: [Dictionary] Every stored run, oldest first.
+        """
+        try:
+            with open(self.path) as f:
+                runs = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        return sorted(runs, key=lambda run: run['taken_at'])
+
+    def append(self, run):
+        """
+        :param run: Dictionary The run to add.
+        """
+        with open(self.path, 'a') as f:
+            f.write(encode(run) + '\n')
+
+
+class S3HistoryStore:
+    """
+    Runs kept as one S3 object each, so no object is ever rewritten.
+    """
+
+    def __init__(self, bucket, prefix, s3=None):
+        """
+        :param bucket: String The S3 bucket name.
+        :param prefix: String The key prefix of the run objects.
+        :param s3: S3 Client used to read and write. Created on first use if omitted.
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = s3
+
+    def client(self):
+        if self.s3 is None:
+            self.s3 = boto3.client('s3')
+        return self.s3
+
+    def load(self):
+        """
+        :return: [Dictionary] Every stored run, oldest first.
+        """
+        runs = []
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Paginator.ListObjectsV2
+        for page in self.client().get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                response = self.client().get_object(Bucket=self.bucket, Key=item['Key'])
+                runs.append(json.loads(response['Body'].read()))
+        return sorted(runs, key=lambda run: run['taken_at'])
+
+    def append(self, run):
+        """
+        :param run: Dictionary The run to add, stored under a key named after when it was taken.
+        """
+        key = f'{self.prefix}{time.strftime("%Y-%m-%dT%H%M%SZ", time.gmtime(run["taken_at"]))}.json'
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.put_object
+        self.client().put_object(Bucket=self.bucket, Key=key, Body=encode(run).encode(),
+                                 ContentType='application/json')
+
+
+def encode(run):
+    return json.dumps(run, separators=(',', ':'))
+
+
+def open_store(url):
+    """
+    Create the history store described by a URL.
+
+    :param url: String file:// or s3:// URL. See the module docstring.
+    :return: History store. If the URL is empty, returns None.
+    :raises ValueError: If the URL scheme is not supported.
+    """
+    if not url:
+        return None
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'file':
+        return FileHistoryStore(parts.path)
+    if parts.scheme == 's3':
+        return S3HistoryStore(parts.netloc, parts.path.lstrip('/'))
+    raise ValueError(f'Unsupported history store: {url}')
+
+
+def make_run(taken_at, counts):
+    """
+    :param taken_at: Float Unix time of the run.
+    :param counts: Iterable of (site ID, site name, encrypted count or None) tuples.
+    :return: Dictionary The run in its stored, columnar form.
+    """
+    run = {'taken_at': taken_at, 'site_id': [], 'site': [], 'encrypted': []}
+    for site_id, site_name, count in counts:
+        run['site_id'].append(int(site_id))
+        run['site'].append(site_name)
+        run['encrypted'].append(count)
+    return run
+
+
+def load(store):
+    """
+    Read every stored run, logging rather than raising on failure.
+
+    :param store: History store, or None when history is disabled.
+    :return: [Dictionary] The stored runs, oldest first. Empty if there are
+        none or they could not be read.
+    """
+    if store is None:
+        return []
+    try:
+        return store.load()
+    except STORE_ERRORS as e:
+        LOGGER.error(f'Failed to read the report history: {e}')
+        return []
+
+
+def append(store, run):
+    """
+    Store a run, logging rather than raising on failure.
+
+    :param store: History store, or None when history is disabled.
+    :param run: Dictionary The run to add.
+    :return: Boolean True if the run was stored, otherwise False.
+    """
+    if store is None:
+        return False
+    try:
+        store.append(run)
+    except STORE_ERRORS as e:
+        LOGGER.error(f'Failed to save the report history: {e}')
+        return False
+    return True
+
+
+def month(run):
+    """
+    :return: String The UTC month the run was taken in, e.g. 2026-10
+    """
+    return time.strftime('%Y-%m', time.gmtime(run['taken_at']))
+
+
+def monthly(runs):
+    """
+    :param runs: [Dictionary] Stored runs, oldest first.
+    :return: [(String, Dictionary)] Each month and its latest run, oldest first.
+    """
+    latest = {}
+    for run in runs:
+        latest[month(run)] = run
+    return sorted(latest.items())
+
+
+def month_over_month(runs, current=None):
+    """
+    Compare each site's count with the latest run of the previous stored month.
+
+    :param runs: [Dictionary] Stored runs, oldest first.
+    :param current: Dictionary The run to compare. Defaults to the latest stored run.
+    :return: Tuple containing the previous month's String (None if there is no
+        earlier month) and a [Dictionary] row per site in the current run with its
+        site_id, site, count, previous count and change. previous and change are
+        None when either run has no count for the site.
+    """
+    if current is None:
+        if not runs:
+            return None, []
+        current = runs[-1]
+
+    earlier = [(name, run) for name, run in monthly(runs) if name < month(current)]
+    previous_month, previous = earlier[-1] if earlier else (None, None)
+    previous_counts = dict(zip(previous['site_id'], previous['encrypted'])) if previous else {}
+
+    rows = []
+    for site_id, site_name, count in zip(current['site_id'], current['site'], current['encrypted']):
+        before = previous_counts.get(site_id)
+        change = count - before if count is not None and before is not None else None
+        rows.append({'site_id': site_id, 'site': site_name, 'count': count, 'previous': before, 'change': change})
+    return previous_month, rows
+
+
+def fleet_totals(runs):
+    """
+    :param runs: [Dictionary] Stored runs, oldest first.
+    :return: [(String, Integer)] Each month and the encrypted total of its latest
+        run, oldest first. Sites that could not be counted are left out.
+    """
+    return [(name, sum(count for count in run['encrypted'] if count is not None)) for name, run in monthly(runs)]
+
+
+def rank_sites(rows, key='count'):
+    """
+    :param rows: [Dictionary] Rows from month_over_month.
+    :param key: String The value to rank by, 'count' or 'change'.
+    :return: [Dictionary] The rows with a value for key, highest first.
+    """
+    return sorted((row for row in rows if row[key] is not None), key=lambda row: row[key], reverse=True)
@@ -0,0 +1,253 @@
+"""
+Conditional-request cache for Jamf Pro API responses that rarely change.
+
+Responses are keyed by URL and kept in memory, in a local directory (Lambda
+/tmp by default) and optionally in S3, so a new Lambda environment starts
+warm. A cached response younger than the TTL is served without a request.
+An older one is revalidated with If-None-Match / If-Modified-Since when the
+server sent an ETag or Last-Modified; a 304 reply transfers no body and
+reuses the already parsed value. Stores are chosen with a URL:
+
+file:///tmp/jamf-http-cache      One file per response in a directory
+s3://bucket/http-cache/          One object per response under the prefix
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+import metrics
+
+
+DEFAULT_DIRECTORY = '/tmp/jamf-http-cache'
+# Errors any store may raise while reading or writing
+STORE_ERRORS = (OSError, ValueError, KeyError, BotoCoreError, ClientError)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FileCacheStore:
+    """
+    Cached responses kept as files in a directory.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: String The directory to keep responses in. Created on first write.
+        """
+        self.directory = directory
+
+    def get(self, key):
+        """
+        :param key: String The entry's key.
+        :return: Bytes The stored entry, or None if there is none.
+        """
+        try:
+            with open(os.path.join(self.directory, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        """
+        Store an entry. It is written beside the old one and moved into place,
+        so a reader never sees half of it.
+
+        :param key: String The entry's key.
+        :param data: Bytes The entry.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{path}.tmp', path)
+
+
+class S3CacheStore:
+    """
+    Cached responses kept as S3 objects, shared by every Lambda environment.
+    """
+
+    def __init__(self, bucket, prefix, s3=None):
+        """
+        :param bucket: String The S3 bucket name.
+        :param prefix: String The key prefix of the cached responses.
+        :param s3: S3 Client used to read and write. Created on first use if omitted.
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = s3
+
+    def client(self):
+        if self.s3 is None:
+            self.s3 = boto3.client('s3')
+        return self.s3
+
+    def get(self, key):
+        """
+        :param key: String The entry's key.
+        :return: Bytes The stored entry, or None if there is none.
+        """
+        try:
+            # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.get_object
+            response = self.client().get_object(Bucket=self.bucket, Key=f'{self.prefix}{key}')
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return response['Body'].read()
+
+    def put(self, key, data):
+        """
+        :param key: String The entry's key.
+        :param data: Bytes The entry.
+        """
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.put_object
+        self.client().put_object(Bucket=self.bucket, Key=f'{self.prefix}{key}', Body=data,
+                                 ContentType='application/json')
+
+
+def open_store(url):
+    """
+    Create the cache store described by a URL.
+
+    :param url: String file:// or s3:// URL. See the module docstring.
+    :return: Cache store. If the URL is empty, returns None.
+    :raises ValueError: If the URL scheme is not supported.
+    """
+    if not url:
+        return None
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'file':
+        return FileCacheStore(parts.path)
+    if parts.scheme == 's3':
+        return S3CacheStore(parts.netloc, parts.path.lstrip('/'))
+    raise ValueError(f'Unsupported HTTP cache store: {url}')
+
+
+class ResponseCache:
+    """
+    Cache of GET responses, revalidated with conditional requests.
+    """
+
+    def __init__(self, ttl, stores=()):
+        """
+        :param ttl: Float Seconds a response is served without asking the server.
+        :param stores: [Store] Persistent stores, fastest first. Entries found in a
+            later store are copied to the earlier ones.
+        """
+        self.ttl = ttl
+        self.stores = [store for store in stores if store is not None]
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        :return: Dictionary of the hit, revalidated and miss counts so far.
+        """
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses}
+
+    def count(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        metrics.count({'hits': 'HTTPCacheHits', 'revalidated': 'HTTPCacheRevalidated', 'misses': 'HTTPCacheMisses'}[outcome])
+
+    def load(self, url):
+        """
+        :return: Dictionary The entry for url from memory or the first store that has it, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is not None:
+            return entry
+
+        key = hashlib.sha256(url.encode()).hexdigest()
+        for i, store in enumerate(self.stores):
+            try:
+                data = store.get(key)
+                if data is None:
+                    continue
+                entry = json.loads(data)
+                if entry['url'] != url:
+                    continue
+                entry['body'] = base64.b64decode(entry['body'])
+            except STORE_ERRORS as e:
+                LOGGER.warning(f'Failed to read a cached response, ignoring it: {e}')
+                continue
+            self.save(url, entry, self.stores[:i])
+            return entry
+        return None
+
+    def save(self, url, entry, stores=None):
+        """
+        Keep an entry in memory and write it to the stores, logging rather than raising on failure.
+        """
+        with self._lock:
+            self._entries[url] = entry
+
+        key = hashlib.sha256(url.encode()).hexdigest()
+        stored = {name: value for name, value in entry.items() if name != 'parsed'}
+        data = json.dumps(dict(stored, body=base64.b64encode(entry['body']).decode())).encode()
+        for store in self.stores if stores is None else stores:
+            try:
+                store.put(key, data)
+            except STORE_ERRORS as e:
+                LOGGER.warning(f'Failed to store a cached response: {e}')
+
+    def get(self, client, path, parse=None, accept='application/xml'):
+        """
+        Make a GET request to the Jamf Pro API through the cache.
+
+        :param client: JamfProClient used when the response must be fetched or revalidated.
+        :param path: String The API path to connect to.
+        :param parse: Function turning the response body into the value returned.
+            Each body is parsed once and the value is shared, so callers must not
+            change it. Omit to get the Bytes body.
+        :param accept: String The Accept header sent.
+        :return: The parsed value, or the Bytes body if parse is omitted.
+        :raises requests.exceptions.RequestException: If the request failed.
+        """
+        url = f'{client.url}{path}'
+        entry = self.load(url)
+        now = time.time()
+
+        if entry is not None and now - entry['stored_at'] < self.ttl:
+            self.count('hits')
+        else:
+            headers = {'Accept': accept}
+            if entry is not None and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry is not None and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+            r = client.request('GET', path, headers=headers)
+            if r.status_code == 304 and entry is not None:
+                self.count('revalidated')
+                entry = dict(entry, stored_at=now)
+            else:
+                self.count('misses')
+                entry = {
+                    'url': url,
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'stored_at': now,
+                    'body': r.content,
+                }
+            self.save(url, entry)
+
+        if parse is None:
+            return entry['body']
+        if 'parsed' not in entry:
+            entry['parsed'] = parse(entry['body'])
+        return entry['parsed']
@@ -0,0 +1,492 @@
+"""
+Shared Jamf Pro API client for the Jamf Pro workflows.
+
+One keep-alive connection pool and bearer token are kept per Jamf Pro
+server and account. Clients live at module level, so warm Lambda
+invocations reuse both instead of opening a new TLS connection and
+authenticating on every call. Writes pass through an adaptive concurrency
+limit (see limiter) so large runs back off when the server slows down.
+
+Transient failures (connection errors, timeouts, 429, 502, 503 and 504)
+are retried with jittered exponential backoff, but never past the
+invocation's deadline. A circuit breaker (see circuit) fails calls fast
+while the server keeps failing.
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+import circuit
+import limiter
+import metrics
+
+
+TOKEN_ENDPOINT = '/api/v1/auth/token'
+INVENTORY_ENDPOINT = '/api/v1/computers-inventory'
+INVENTORY_PAGE_SIZE = 500
+# IDs per id=in=(...) filter, so the query string stays well under server URL limits (8KB on Tomcat)
+INVENTORY_ID_CHUNK_SIZE = 100
+TOKEN_LIFETIME_SECONDS = 1800
+TOKEN_REFRESH_SECONDS = 60
+POOL_MAXSIZE = 32
+# Per-process ceiling for concurrent PUT, POST and DELETE requests. 0 disables the limit.
+WRITE_CONCURRENCY = int(os.getenv("JAMF_WRITE_CONCURRENCY", "8"))
+WRITE_TARGET_LATENCY = float(os.getenv("JAMF_WRITE_TARGET_LATENCY", "2.0"))
+WRITE_METHODS = ('PUT', 'POST', 'DELETE')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+MAX_ATTEMPTS = int(os.getenv("JAMF_MAX_ATTEMPTS", "4"))
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 8
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+# Statuses that mean the request was not processed, so even a POST can be sent again
+NOT_PROCESSED_STATUS_CODES = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = float(os.getenv("JAMF_READ_TIMEOUT", "60"))
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+# Time kept back from the Lambda deadline for the handler to finish up
+DEADLINE_MARGIN_SECONDS = 1.0
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised instead of sending a request once the invocation deadline has passed.
+    """
+
+
+class JamfProClient:
+    """
+    Pooled Jamf Pro API client authenticating with a cached bearer token.
+    """
+
+    def __init__(self, url, username, password, pool_maxsize=POOL_MAXSIZE, write_concurrency=WRITE_CONCURRENCY):
+        """
+        :param url: String The Jamf Pro server address.
+        :param username: String The API account username.
+        :param password: String The API account password.
+        :param pool_maxsize: Integer The maximum number of kept-alive connections.
+        :param write_concurrency: Integer The ceiling for the adaptive limit on concurrent
+            writes. 0 sends writes without a limit.
+        """
+        self.url = url.rstrip('/')
+        self.auth_tuple = (username, password)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.write_limiter = None
+        if write_concurrency:
+            self.write_limiter = limiter.AdaptiveLimiter(write_concurrency, WRITE_TARGET_LATENCY)
+        self.breaker = circuit.CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+        self.deadline = None
+
+        self._token = None
+        self._token_expires = 0
+        self._token_lock = threading.Lock()
+
+    def token(self):
+        """
+        Get a bearer token, requesting a new one shortly before the cached token expires.
+
+        :return: String containing the bearer token.
+        """
+        with self._token_lock:
+            if self._token is None or time.time() >= self._token_expires - TOKEN_REFRESH_SECONDS:
+                with metrics.timer('JamfRequestTime', Endpoint=f'POST {TOKEN_ENDPOINT}'):
+                    r = self.session.post(f'{self.url}{TOKEN_ENDPOINT}', auth=self.auth_tuple, timeout=self.timeout())
+                r.raise_for_status()
+                body = r.json()
+                self._token = body['token']
+                self._token_expires = parse_expires(body.get('expires'))
+                LOGGER.debug('Obtained a new Jamf Pro bearer token.')
+            return self._token
+
+    def invalidate_token(self):
+        """
+        Forget the cached bearer token so the next request obtains a new one.
+        """
+        with self._token_lock:
+            self._token = None
+
+    def set_deadline(self, deadline):
+        """
+        Stop retrying, and shorten timeouts, so calls finish before a deadline.
+
+        :param deadline: Float time.monotonic() value, or None for no deadline.
+        """
+        self.deadline = deadline
+
+    def remaining(self):
+        """
+        :return: Float seconds left before the deadline, or None if there is none.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def timeout(self):
+        """
+        :return: Tuple of the connect and read timeouts, cut short by the deadline.
+        :raises DeadlineExceeded: If the deadline has passed.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS
+        if remaining <= 0:
+            raise DeadlineExceeded('No time left before the invocation deadline.')
+        return min(CONNECT_TIMEOUT_SECONDS, remaining), min(READ_TIMEOUT_SECONDS, remaining)
+
+    def send(self, method, url, headers, **kwargs):
+        """
+        Send one authenticated request, renewing the token once if it was rejected.
+
+        :return: Response Object, whatever its status.
+        :raises requests.exceptions.RequestException: If no response was received.
+        """
+        write_limiter = self.write_limiter if method in WRITE_METHODS else None
+        for attempt in range(2):
+            headers['Authorization'] = f'Bearer {self.token()}'
+            if write_limiter is None:
+                r = self.session.request(method, url, headers=headers, timeout=self.timeout(), **kwargs)
+            else:
+                started = write_limiter.acquire()
+                status_code = None
+                try:
+                    r = self.session.request(method, url, headers=headers, timeout=self.timeout(), **kwargs)
+                    status_code = r.status_code
+                finally:
+                    write_limiter.release(started, status_code)
+            if r.status_code != 401 or attempt:
+                return r
+            r.close()
+            self.invalidate_token()
+
+    def request(self, method, path, **kwargs):
+        """
+        Send an authenticated request, retrying transient failures with jittered backoff.
+
+        :param method: String The HTTP method.
+        :param path: String The API path, e.g. /JSSResource/sites
+        :return: Response Object for a successful request.
+        :raises requests.exceptions.RequestException: If the request failed. This
+            includes circuit.CircuitOpenError while the server is failing.
+        """
+        url = f'{self.url}{path}'
+        LOGGER.debug(f'URL generated: {url}')
+        endpoint = f'{method} {endpoint_name(path)}'
+
+        headers = kwargs.pop('headers', {})
+        for attempt in range(MAX_ATTEMPTS):
+            self.breaker.before_request()
+            try:
+                with metrics.timer('JamfRequestTime', Endpoint=endpoint):
+                    r = self.send(method, url, headers, **kwargs)
+            except DeadlineExceeded:
+                self.breaker.cancel_trial()
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.breaker.record_failure()
+                if method not in IDEMPOTENT_METHODS:
+                    raise
+                error = e
+                delay = retry_delay(None, attempt)
+            except requests.exceptions.RequestException:
+                # e.g. the token request was refused, which retrying will not fix
+                self.breaker.cancel_trial()
+                raise
+            else:
+                if r.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    r.raise_for_status()
+                    return r
+                self.breaker.record_failure()
+                if method not in IDEMPOTENT_METHODS and r.status_code not in NOT_PROCESSED_STATUS_CODES:
+                    r.raise_for_status()
+                error = requests.exceptions.HTTPError(f'{r.status_code} Error for url: {url}', response=r)
+                delay = retry_delay(r, attempt)
+                r.close()
+
+            remaining = self.remaining()
+            if attempt + 1 == MAX_ATTEMPTS or (remaining is not None and delay >= remaining):
+                break
+            LOGGER.warning(f'{method} {path} failed ({error}). Retrying in {delay:.2f}s.')
+            metrics.count('JamfRetries', Endpoint=endpoint)
+            time.sleep(delay)
+
+        metrics.count('JamfFailures', Endpoint=endpoint)
+        raise error
+
+    def get_json(self, path):
+        """
+        Make a GET request to the Jamf Pro API.
+
+        :param path: String The API path to connect to.
+        :return: JSON Object containing information about the request's get
+            action. If error, returns None.
+        """
+        try:
+            return self.request('GET', path, headers={'Accept': 'application/json'}).json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            LOGGER.error(e)
+            return None
+
+    def get_xml(self, path):
+        """
+        Make a GET request to the Jamf Pro API.
+
+        :param path: String The API path to connect to.
+        :return: Bytes containing the XML response. If error, returns None.
+        """
+        try:
+            return self.request('GET', path, headers={'Accept': 'application/xml'}).content
+        except requests.exceptions.RequestException as e:
+            LOGGER.error(e)
+            return None
+
+    def iter_xml(self, path, element_path):
+        """
+        Stream a GET response, yielding matching elements as soon as they are parsed.
+
+        Each element is detached from the tree once the caller moves on to the
+        next one, so memory use does not grow with the size of the response.
+        Closing the generator early closes the response without reading the rest.
+
+        :param path: String The API path to connect to.
+        :param element_path: String Slash-separated tags below the root element, e.g. computers/computer
+        :return: Generator yielding each matching Element.
+        :raises requests.exceptions.RequestException: If the request failed.
+        :raises xml.etree.ElementTree.ParseError: If the response is not valid XML.
+        """
+        target = element_path.split('/')
+        r = self.request('GET', path, headers={'Accept': 'application/xml'}, stream=True)
+        try:
+            parser = ElementTree.XMLPullParser(events=('start', 'end'))
+            parents = []
+            tags = []
+            for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                parser.feed(chunk)
+                for event, element in parser.read_events():
+                    if event == 'start':
+                        parents.append(element)
+                        tags.append(element.tag)
+                        continue
+                    matched = tags[1:] == target
+                    parents.pop()
+                    tags.pop()
+                    if matched:
+                        yield element
+                        parents[-1].remove(element)
+            parser.close()
+        finally:
+            r.close()
+
+    def put_xml(self, path, data):
+        """
+        Make a change to an existing Jamf Pro object via API.
+
+        :param path: String The API path to connect to.
+        :param data: String XML containing the changed elements.
+        :return: Response Object for the PUT request. If error, returns None.
+        """
+        try:
+            r = self.request('PUT', path, data=data, headers={'Content-Type': 'application/xml'})
+            LOGGER.debug(str(r.content))
+        except requests.exceptions.RequestException as e:
+            LOGGER.error(e)
+            return None
+        return r
+
+    def post_xml(self, path, data):
+        """
+        Create a new Jamf Pro object via API.
+
+        :param path: String The API path to connect to.
+        :param data: String XML describing the new object.
+        :return: Response Object for the POST request. If error, returns None.
+        """
+        try:
+            return self.request('POST', path, data=data, headers={'Content-Type': 'application/xml'})
+        except requests.exceptions.RequestException as e:
+            LOGGER.error(e)
+            return None
+
+    def delete(self, path):
+        """
+        Delete an existing Jamf Pro object via API.
+
+        :param path: String The API path to connect to.
+        :return: Boolean True if the object was deleted, otherwise False.
+        """
+        try:
+            self.request('DELETE', path)
+        except requests.exceptions.RequestException as e:
+            LOGGER.error(e)
+            return False
+        return True
+
+    def get_advancedcomputersearch_by_name(self, name):
+        """
+        Retrieve saved search data given a group name.
+
+        :param name: String The URL-quoted name of a Jamf Pro Advanced Search
+        :return: JSON Object containing information about the request's get
+            action. If error, returns None.
+        """
+        return self.get_json(f'/JSSResource/advancedcomputersearches/name/{name}')
+
+    def iter_advancedcomputersearch_computers(self, name):
+        """
+        Stream the computers in a saved search given a group name.
+
+        :param name: String The URL-quoted name of a Jamf Pro Advanced Search
+        :return: Generator yielding a Dictionary for each computer, holding its
+            integer id, name and display fields.
+        :raises requests.exceptions.RequestException: If the request failed.
+        :raises xml.etree.ElementTree.ParseError: If the response is not valid XML.
+        """
+        path = f'/JSSResource/advancedcomputersearches/name/{name}'
+        for element in self.iter_xml(path, 'computers/computer'):
+            computer = {child.tag: child.text for child in element}
+            computer['id'] = int(computer['id'])
+            yield computer
+
+    def iter_computers_inventory(self, rsql_filter=None, sections=('GENERAL',), page_size=INVENTORY_PAGE_SIZE,
+                                 after_id=None):
+        """
+        Page through the Jamf Pro API computer inventory.
+
+        Pages are requested in id order, each starting after the last id of the
+        previous page, so computers leaving the filter mid-run (e.g. as they are
+        unmanaged) never shift later pages. The next page is fetched in the
+        background while the caller works through the current one.
+
+        :param rsql_filter: String Optional RSQL filter, e.g. general.remoteManagement.managed==true
+        :param sections: (String) The inventory sections to return.
+        :param page_size: Integer The number of computers requested per page.
+        :param after_id: Integer Start after this computer id, e.g. to resume an earlier run. None starts at the first.
+        :return: Generator yielding each computer's inventory Dictionary.
+        :raises requests.exceptions.RequestException: If a request failed.
+        :raises ValueError: If a response is not valid JSON.
+        """
+        def fetch(after_id):
+            filters = [f'({rsql_filter})'] if rsql_filter else []
+            if after_id is not None:
+                filters.append(f'id=gt={after_id}')
+            params = {'section': list(sections), 'page': 0, 'page-size': page_size, 'sort': 'id:asc'}
+            if filters:
+                params['filter'] = ';'.join(filters)
+            return self.request('GET', INVENTORY_ENDPOINT, params=params, headers={'Accept': 'application/json'}).json()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch, after_id)
+            while future is not None:
+                results = future.result().get('results', [])
+                if len(results) == page_size:
+                    future = executor.submit(fetch, results[-1]['id'])
+                else:
+                    future = None
+                yield from results
+
+    def get_computers_general(self, computer_ids):
+        """
+        Read the general inventory of many computers, INVENTORY_ID_CHUNK_SIZE IDs per request.
+
+        :param computer_ids: [Integer] The Jamf Pro computer IDs.
+        :return: Dictionary mapping each Integer computer ID to its general inventory
+            Dictionary. IDs not found are left out. If any request fails, returns None.
+        """
+        computers = {}
+        for start in range(0, len(computer_ids), INVENTORY_ID_CHUNK_SIZE):
+            chunk = computer_ids[start:start + INVENTORY_ID_CHUNK_SIZE]
+            rsql_filter = f'id=in=({",".join(str(computer_id) for computer_id in chunk)})'
+            try:
+                computers.update(
+                    (int(computer['id']), computer['general'])
+                    for computer in self.iter_computers_inventory(rsql_filter)
+                )
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                LOGGER.error(e)
+                return None
+        return computers
+
+
+def endpoint_name(path):
+    """
+    :param path: String An API path, e.g. /JSSResource/computers/id/42/subset/General?x=1
+    :return: String The path with IDs, names and the query replaced by placeholders,
+        e.g. /JSSResource/computers/id/{id}/subset/General, for use as a metric dimension.
+    """
+    path = path.split('?', 1)[0]
+    path = re.sub(r'/name/[^/]+', '/name/{name}', path)
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+
+def retry_delay(response, attempt):
+    """
+    :param response: Response Object The failed response, or None if none was received.
+    :param attempt: Integer The number of attempts made so far, starting at 0.
+    :return: Float seconds to wait, from Retry-After or a jittered exponential backoff.
+    """
+    if response is not None:
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            pass
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def deadline_from_context(context, margin=DEADLINE_MARGIN_SECONDS):
+    """
+    :param context: Lambda context Object, or None outside Lambda.
+    :param margin: Float Seconds kept back for the handler to finish up.
+    :return: Float time.monotonic() value to finish calls by, or None if there is no context.
+    """
+    if context is None:
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin
+
+
+def parse_expires(expires):
+    """
+    Convert a Jamf Pro token expiry into a Unix timestamp.
+
+    :param expires: String ISO 8601 expiry, e.g. 2022-10-18T12:00:00.123Z
+    :return: Float containing the expiry time. Unparseable values assume the default token lifetime.
+    """
+    try:
+        expiry = datetime.strptime(expires[:19], '%Y-%m-%dT%H:%M:%S')
+    except (TypeError, ValueError):
+        return time.time() + TOKEN_LIFETIME_SECONDS
+    return expiry.replace(tzinfo=timezone.utc).timestamp()
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(url, username, password):
+    """
+    Get the shared client for a Jamf Pro server and account, creating it on first use.
+
+    :param url: String The Jamf Pro server address.
+    :param username: String The API account username.
+    :param password: String The API account password.
+    :return: JamfProClient shared by every caller in this process.
+    """
+    key = (url, username, password)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = JamfProClient(url, username, password)
+        return _CLIENTS[key]
@@ -0,0 +1,91 @@
+"""
+Adaptive concurrency limit for Jamf Pro API traffic.
+
+The limit follows AIMD (additive increase, multiplicative decrease): every
+request that completes quickly raises it by about one per round of
+requests, up to the configured ceiling. A 429 or 503 response, a failed
+connection, or a response slower than the target latency cuts it in half.
+Callers beyond the limit wait, so a struggling server sees fewer requests
+until it recovers.
+"""
+
+import logging
+import threading
+import time
+
+
+# Responses that mean the server is shedding load
+OVERLOAD_STATUS_CODES = (429, 503)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit shared by every thread making requests.
+    """
+
+    def __init__(self, ceiling, target_latency, initial=None, minimum=1, backoff=0.5):
+        """
+        :param ceiling: Integer The largest number of requests allowed in flight.
+        :param target_latency: Float Seconds. Slower responses count as overload.
+        :param initial: Integer The starting limit. Defaults to half the ceiling.
+        :param minimum: Integer The smallest limit the decrease can reach.
+        :param backoff: Float The factor the limit is multiplied by on overload.
+        """
+        self.ceiling = ceiling
+        self.target_latency = target_latency
+        self.minimum = minimum
+        self.backoff = backoff
+        self.limit = float(initial if initial is not None else max(minimum, ceiling // 2))
+        self.in_flight = 0
+
+        self._condition = threading.Condition()
+        self._last_decrease = 0
+
+    def acquire(self):
+        """
+        Wait until a request may be sent.
+
+        :return: Float time.monotonic() value to pass to release().
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def try_acquire(self):
+        """
+        Take a place for a request without waiting, for callers that must not block, e.g. an event loop.
+
+        :return: Float time.monotonic() value to pass to release(), or None if the limit is reached.
+        """
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, status_code=None):
+        """
+        Record a finished request and adjust the limit.
+
+        :param started: Float The value returned by acquire().
+        :param status_code: Integer The response status, or None if the request failed to complete.
+        """
+        latency = time.monotonic() - started
+        overloaded = status_code is None or status_code in OVERLOAD_STATUS_CODES or latency > self.target_latency
+
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                # Requests already in flight report the same overload, so only react once per round trip
+                if started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = time.monotonic()
+                    LOGGER.warning(f'Jamf Pro is overloaded (status {status_code}, {latency:.2f}s). '
+                                   f'Concurrency limit lowered to {int(self.limit)}.')
+            else:
+                self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+            self._condition.notify_all()
@@ -0,0 +1,153 @@
+"""
+CloudWatch metrics for the Jamf Pro workflows.
+
+Metrics are printed to stdout in CloudWatch Embedded Metric Format, so
+Lambda's log stream turns them into metrics without any API calls and
+they can be read locally.
+https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+
+emit() writes a record straight away. Timings and counts taken on the hot
+path with timer() and count() are collected in memory instead, and written
+once per invocation by the instrument() handler decorator. Each metric is
+written as an array of values, which CloudWatch keeps as a distribution, so
+percentiles of e.g. JamfRequestTime can be graphed per Endpoint.
+"""
+
+import functools
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+NAMESPACE = 'JamfPro/Workflows'
+# EMF accepts at most 100 values for one metric in a record
+MAX_VALUES_PER_RECORD = 100
+
+
+def write_record(values, units, dimensions, namespace=NAMESPACE, stream=None):
+    """
+    Write one Embedded Metric Format record.
+
+    :param values: Dictionary mapping each metric name to its value or list of values.
+    :param units: Dictionary mapping each metric name to its CloudWatch unit.
+    :param dimensions: Dictionary of dimension names and values.
+    :param namespace: String The CloudWatch namespace.
+    :param stream: File Object to write to. Defaults to stdout.
+    """
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': units[name]} for name in values],
+            }],
+        },
+    }
+    record.update(dimensions)
+    record.update(values)
+    print(json.dumps(record, separators=(',', ':')), file=stream or sys.stdout, flush=True)
+
+
+def emit(values, dimensions, unit='Count', namespace=NAMESPACE, stream=None):
+    """
+    Write one Embedded Metric Format record.
+
+    :param values: Dictionary mapping each metric name to its value.
+    :param dimensions: Dictionary of dimension names and values, e.g. {'Workflow': 'UnmanageComputers'}
+    :param unit: String The CloudWatch unit shared by the values.
+    :param namespace: String The CloudWatch namespace.
+    :param stream: File Object to write to. Defaults to stdout.
+    """
+    write_record(values, {name: unit for name in values}, dimensions, namespace, stream)
+
+
+class Recorder:
+    """
+    Timings and counts collected from every thread until they are flushed.
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, value, unit='Milliseconds', **dimensions):
+        """
+        :param name: String The metric name.
+        :param value: Number The sample.
+        :param unit: String The CloudWatch unit of the metric.
+        :param dimensions: String values for extra dimensions, e.g. Endpoint='GET /JSSResource/sites'
+        """
+        key = tuple(sorted(dimensions.items()))
+        with self._lock:
+            self._samples.setdefault(key, {}).setdefault(name, (unit, []))[1].append(value)
+
+    def count(self, name, value=1, **dimensions):
+        self.record(name, value, 'Count', **dimensions)
+
+    @contextmanager
+    def timer(self, name, **dimensions):
+        """
+        Record how long the with block took in milliseconds, even if it raised.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, round((time.perf_counter() - start) * 1000, 3), **dimensions)
+
+    def flush(self, dimensions, namespace=NAMESPACE, stream=None):
+        """
+        Write everything recorded since the last flush and start again.
+
+        :param dimensions: Dictionary of dimensions added to every record, e.g. {'Workflow': 'SendToTeams'}
+        :param namespace: String The CloudWatch namespace.
+        :param stream: File Object to write to. Defaults to stdout.
+        """
+        with self._lock:
+            samples, self._samples = self._samples, {}
+
+        for key, metrics in samples.items():
+            record_dimensions = dict(dimensions, **dict(key))
+            units = {name: unit for name, (unit, _) in metrics.items()}
+            longest = max(len(values) for _, values in metrics.values())
+            for start in range(0, longest, MAX_VALUES_PER_RECORD):
+                values = {
+                    name: values[start:start + MAX_VALUES_PER_RECORD]
+                    for name, (_, values) in metrics.items() if len(values) > start
+                }
+                write_record(values, units, record_dimensions, namespace, stream)
+
+
+RECORDER = Recorder()
+record = RECORDER.record
+count = RECORDER.count
+timer = RECORDER.timer
+flush = RECORDER.flush
+
+COLD_START = True
+
+
+def instrument(workflow):
+    """
+    Decorate a Lambda handler to record cold and warm starts and HandlerTime,
+    and flush the invocation's metrics when it returns or raises.
+
+    :param workflow: String The Workflow dimension, e.g. 'UnmanageComputers'
+    :return: Decorator for the lambda_handler function.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global COLD_START
+            cold_start, COLD_START = COLD_START, False
+            count('ColdStart' if cold_start else 'WarmStart')
+            try:
+                with timer('HandlerTime'):
+                    return handler(event, context)
+            finally:
+                flush({'Workflow': workflow})
+        return wrapper
+    return decorator
@@ -0,0 +1,97 @@
+"""
+In-memory cache of AWS Systems Manager parameters for the Jamf Pro workflows.
+
+Every parameter a workflow needs is loaded with batched GetParameters calls
+and kept for a configurable TTL, so warm Lambda invocations read them from
+memory. Once a value is older than the TTL it is still served while a
+background thread refreshes the whole set.
+"""
+
+import logging
+import os
+import threading
+import time
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+import metrics
+
+
+# GetParameters accepts at most ten names per call
+SSM_BATCH_SIZE = 10
+DEFAULT_TTL_SECONDS = int(os.getenv("SSM_CACHE_TTL", "300"))
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ParameterCache:
+    """
+    TTL cache of decrypted SSM parameters, refreshed as one batch.
+    """
+
+    def __init__(self, names, ssm=None, ttl=DEFAULT_TTL_SECONDS):
+        """
+        :param names: [String] The Parameter Keys to load together.
+        :param ssm: SSM Client used to read the parameters. Created on first load if omitted.
+        :param ttl: Integer The number of seconds a loaded value is considered fresh.
+        """
+        self.ssm = ssm
+        self.names = list(dict.fromkeys(names))
+        self.ttl = ttl
+
+        self._values = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def load(self):
+        """
+        Read every parameter from the parameter store, replacing the cached values.
+
+        :raises KeyError: If any parameter does not exist.
+        """
+        if self.ssm is None:
+            self.ssm = boto3.client('ssm')
+
+        values = {}
+        for start in range(0, len(self.names), SSM_BATCH_SIZE):
+            # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameters
+            with metrics.timer('SSMFetchTime'):
+                response = self.ssm.get_parameters(
+                    Names=self.names[start:start + SSM_BATCH_SIZE],
+                    WithDecryption=True
+                )
+            if response.get('InvalidParameters'):
+                raise KeyError(f'Parameters not found: {response["InvalidParameters"]}')
+            for parameter in response['Parameters']:
+                values[parameter['Name']] = parameter['Value']
+
+        with self._lock:
+            self._values = values
+            self._loaded_at = time.monotonic()
+        LOGGER.debug(f'Loaded {len(values)} parameters from SSM.')
+
+    def _refresh_in_background(self):
+        try:
+            self.load()
+        except (BotoCoreError, ClientError, KeyError) as e:
+            LOGGER.error(f'Failed to refresh SSM parameters, keeping cached values: {e}')
+        finally:
+            self._refreshing = False
+
+    def get(self, name):
+        """
+        Get a parameter value, loading the set on first use.
+
+        :param name: String The Parameter Key to retrieve. Must be one of the cached names.
+        :return: String containing the Parameter Value
+        """
+        if self._loaded_at is None:
+            self.load()
+        elif time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+        return self._values[name]
@@ -0,0 +1,162 @@
+"""
+Table rendering for the Jamf Pro workflow reports.
+
+Rows are dictionaries and columns are (key, title) tuples, e.g.
+[('count', 'Count'), ('site', 'Jamf Pro Site Name')]. Tables are written
+row by row to a stream, or to a string buffer by render(). ASCII and
+Markdown tables pad every column, so their widths are measured in one pass
+over the rows before writing. CSV and HTML are written as the rows arrive,
+so they can be fed a generator of any length.
+"""
+
+import csv
+import html
+import io
+import os
+
+
+FORMATS = ('ascii', 'csv', 'markdown', 'html')
+
+
+def cell(value):
+    return '' if value is None else str(value)
+
+
+def markdown_cell(value):
+    return cell(value).replace('|', '\\|')
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def measure(rows, columns, text=cell):
+    """
+    :param rows: [Dictionary] The table rows.
+    :param columns: [(String, String)] Each column's key and title.
+    :param text: Function converting a value to the text written for it.
+    :return: Dictionary mapping each column key to the width of its longest cell or title.
+    """
+    widths = {key: len(text(title)) for key, title in columns}
+    for row in rows:
+        for key, _ in columns:
+            widths[key] = max(widths[key], len(text(row[key])))
+    return widths
+
+
+def justify(value, width, text=cell):
+    """
+    Right-align numbers and left-align everything else.
+    """
+    if is_number(value):
+        return text(value).rjust(width)
+    return text(value).ljust(width)
+
+
+def write_ascii(rows, columns, stream):
+    """
+    Write a table bordered with +, - and |.
+
+    :param rows: [Dictionary] The table rows. Read twice, so not a generator.
+    :param columns: [(String, String)] Each column's key and title.
+    :param stream: File Object to write to.
+    """
+    widths = measure(rows, columns)
+    border = f'+-{"-+-".join("-" * widths[key] for key, _ in columns)}-+{os.linesep}'
+
+    stream.write(border)
+    stream.write(f'| {" | ".join(title.ljust(widths[key]) for key, title in columns)} |{os.linesep}')
+    stream.write(border)
+    for row in rows:
+        stream.write(f'| {" | ".join(justify(row[key], widths[key]) for key, _ in columns)} |{os.linesep}')
+    stream.write(border)
+
+
+def write_markdown(rows, columns, stream):
+    """
+    Write a GitHub-flavoured Markdown table.
+
+    :param rows: [Dictionary] The table rows. Read twice, so not a generator.
+    :param columns: [(String, String)] Each column's key and title.
+    :param stream: File Object to write to.
+    """
+    widths = {key: max(3, width) for key, width in measure(rows, columns, markdown_cell).items()}
+
+    stream.write(f'| {" | ".join(markdown_cell(title).ljust(widths[key]) for key, title in columns)} |\n')
+    stream.write(f'| {" | ".join("-" * widths[key] for key, _ in columns)} |\n')
+    for row in rows:
+        stream.write(f'| {" | ".join(justify(row[key], widths[key], markdown_cell) for key, _ in columns)} |\n')
+
+
+def write_csv(rows, columns, stream):
+    """
+    Write an RFC 4180 CSV table with a title row.
+
+    :param rows: Iterable of Dictionary rows. Consumed lazily.
+    :param columns: [(String, String)] Each column's key and title.
+    :param stream: File Object to write to.
+    """
+    writer = csv.writer(stream)
+    writer.writerow([title for _, title in columns])
+    for row in rows:
+        writer.writerow([cell(row[key]) for key, _ in columns])
+
+
+def write_html(rows, columns, stream):
+    """
+    Write an HTML table with escaped cells.
+
+    :param rows: Iterable of Dictionary rows. Consumed lazily.
+    :param columns: [(String, String)] Each column's key and title.
+    :param stream: File Object to write to.
+    """
+    stream.write('<table>\n<thead><tr>')
+    stream.write(''.join(f'<th>{html.escape(title)}</th>' for _, title in columns))
+    stream.write('</tr></thead>\n<tbody>\n')
+    for row in rows:
+        stream.write('<tr>')
+        stream.write(''.join(
+            f'<td align="right">{row[key]}</td>' if is_number(row[key])
+            else f'<td>{html.escape(cell(row[key]))}</td>'
+            for key, _ in columns
+        ))
+        stream.write('</tr>\n')
+    stream.write('</tbody>\n</table>\n')
+
+
+WRITERS = {
+    'ascii': write_ascii,
+    'csv': write_csv,
+    'markdown': write_markdown,
+    'html': write_html,
+}
+
+
+def write(rows, columns, stream, fmt='ascii'):
+    """
+    Write a table to a stream.
+
+    :param rows: Iterable of Dictionary rows. ASCII and Markdown read a list of them.
+    :param columns: [(String, String)] Each column's key and title.
+    :param stream: File Object to write to.
+    :param fmt: String One of FORMATS.
+    :raises ValueError: If the format is not supported.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f'Unsupported report format: {fmt}. Expected one of {", ".join(FORMATS)}.')
+    if fmt in ('ascii', 'markdown') and not isinstance(rows, (list, tuple)):
+        rows = list(rows)
+    WRITERS[fmt](rows, columns, stream)
+
+
+def render(rows, columns, fmt='ascii'):
+    """
+    :param rows: Iterable of Dictionary rows.
+    :param columns: [(String, String)] Each column's key and title.
+    :param fmt: String One of FORMATS.
+    :return: String containing the table.
+    :raises ValueError: If the format is not supported.
+    """
+    buffer = io.StringIO()
+    write(rows, columns, buffer, fmt)
+    return buffer.getvalue()
@@ -0,0 +1,249 @@
+"""
+Snapshots of the computer IDs a discovery run enqueued, for delta discovery.
+
+Each store keeps the ID set from the previous run and when the last full
+run happened. Discovery compares the current search against it and
+enqueues only the computers that are new since then. Once the snapshot is
+older than its maximum age, one full run enqueues everything again so
+computers that failed downstream are retried. Stores are chosen with a URL:
+
+file:///tmp/unmanage.json        JSON file
+sqlite:///tmp/unmanage.db        SQLite database
+s3://bucket/unmanage.json        JSON object in S3
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import urllib.parse
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+# Errors any store may raise while reading or writing
+STORE_ERRORS = (OSError, ValueError, KeyError, sqlite3.Error, BotoCoreError, ClientError)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FileSnapshotStore:
+    """
+    Snapshot kept as a JSON file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: String The file to read and write.
+        """
+        self.path = path
+
+    def load(self):
+        """
+        :return: Tuple containing the set of IDs and the Unix time of the last full
+            run, or None if no snapshot has been saved.
+        """
+        try:
+            with open(self.path) as f:
+                return decode(f.read())
+        except FileNotFoundError:
+            return None
+
+    def save(self, ids, synced_at):
+        """
+        Replace the snapshot. The new file is written beside the old one and moved
+        into place, so an interrupted save leaves the previous snapshot intact.
+
+        :param ids: Iterable of Integer computer IDs.
+        :param synced_at: Float Unix time of the last full run.
+        """
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(encode(ids, synced_at))
+        os.replace(temp_path, self.path)
+
+
+class SQLiteSnapshotStore:
+    """
+    Snapshot kept in a SQLite database.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: String The database file to read and write.
+        """
+        self.path = path
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE IF NOT EXISTS computers (id INTEGER PRIMARY KEY)')
+        connection.execute('CREATE TABLE IF NOT EXISTS synced (synced_at REAL)')
+        return connection
+
+    def load(self):
+        """
+        :return: Tuple containing the set of IDs and the Unix time of the last full
+            run, or None if no snapshot has been saved.
+        """
+        connection = self.connect()
+        try:
+            synced = connection.execute('SELECT synced_at FROM synced').fetchone()
+            if synced is None:
+                return None
+            return {row[0] for row in connection.execute('SELECT id FROM computers')}, synced[0]
+        finally:
+            connection.close()
+
+    def save(self, ids, synced_at):
+        """
+        Replace the snapshot in a single transaction.
+
+        :param ids: Iterable of Integer computer IDs.
+        :param synced_at: Float Unix time of the last full run.
+        """
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM computers')
+                connection.executemany('INSERT OR IGNORE INTO computers (id) VALUES (?)', ((i,) for i in ids))
+                connection.execute('DELETE FROM synced')
+                connection.execute('INSERT INTO synced (synced_at) VALUES (?)', (synced_at,))
+        finally:
+            connection.close()
+
+
+class S3SnapshotStore:
+    """
+    Snapshot kept as a JSON object in S3, so it survives between Lambda environments.
+    """
+
+    def __init__(self, bucket, key, s3=None):
+        """
+        :param bucket: String The S3 bucket name.
+        :param key: String The object key.
+        :param s3: S3 Client used to read and write. Created on first use if omitted.
+        """
+        self.bucket = bucket
+        self.key = key
+        self.s3 = s3
+
+    def client(self):
+        if self.s3 is None:
+            self.s3 = boto3.client('s3')
+        return self.s3
+
+    def load(self):
+        """
+        :return: Tuple containing the set of IDs and the Unix time of the last full
+            run, or None if no snapshot has been saved.
+        """
+        try:
+            # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.get_object
+            response = self.client().get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return decode(response['Body'].read())
+
+    def save(self, ids, synced_at):
+        """
+        :param ids: Iterable of Integer computer IDs.
+        :param synced_at: Float Unix time of the last full run.
+        """
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.put_object
+        self.client().put_object(Bucket=self.bucket, Key=self.key, Body=encode(ids, synced_at).encode(),
+                                 ContentType='application/json')
+
+
+def encode(ids, synced_at):
+    return json.dumps({'synced_at': synced_at, 'ids': sorted(ids)}, separators=(',', ':'))
+
+
+def decode(body):
+    snapshot = json.loads(body)
+    return set(snapshot['ids']), snapshot['synced_at']
+
+
+def open_store(url):
+    """
+    Create the snapshot store described by a URL.
+
+    :param url: String file://, sqlite:// or s3:// URL. See the module docstring.
+    :return: Snapshot store. If the URL is empty, returns None.
+    :raises ValueError: If the URL scheme is not supported.
+    """
+    if not url:
+        return None
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'file':
+        return FileSnapshotStore(parts.path)
+    if parts.scheme == 'sqlite':
+        return SQLiteSnapshotStore(parts.path)
+    if parts.scheme == 's3':
+        return S3SnapshotStore(parts.netloc, parts.path.lstrip('/'))
+    raise ValueError(f'Unsupported snapshot store: {url}')
+
+
+def load_previous(store, max_age):
+    """
+    Read the previous run's snapshot for a delta run.
+
+    :param store: Snapshot store, or None when delta discovery is disabled.
+    :param max_age: Float The number of seconds after a full run before another is required.
+    :return: Tuple containing the set of IDs and the Unix time of the last full
+        run. Returns None when this run must enqueue every computer: no store,
+        no snapshot yet, the snapshot is too old, or it could not be read.
+    """
+    if store is None:
+        return None
+
+    try:
+        previous = store.load()
+    except STORE_ERRORS as e:
+        LOGGER.error(f'Failed to read the discovery snapshot, running a full discovery: {e}')
+        return None
+
+    if previous is None:
+        LOGGER.info('No discovery snapshot found. Running a full discovery.')
+    elif time.time() - previous[1] > max_age:
+        LOGGER.info('Discovery snapshot has reached its maximum age. Running a full discovery.')
+        previous = None
+    return previous
+
+
+def save(store, ids, synced_at):
+    """
+    Write the snapshot for the next run, logging rather than raising on failure.
+
+    :param store: Snapshot store, or None when delta discovery is disabled.
+    :param ids: Iterable of Integer computer IDs.
+    :param synced_at: Float Unix time of the last full run.
+    :return: Boolean True if the snapshot was written, otherwise False.
+    """
+    if store is None:
+        return False
+
+    try:
+        store.save(ids, synced_at)
+    except STORE_ERRORS as e:
+        LOGGER.error(f'Failed to save the discovery snapshot: {e}')
+        return False
+    return True
+
+
+def iter_new(computers, previous, seen):
+    """
+    Pass on only the computers that were not in the previous snapshot.
+
+    :param computers: Iterable of computer Dictionaries, each with an integer id.
+    :param previous: Set of Integer IDs from the previous run, or None to pass on every computer.
+    :param seen: Set that every computer's ID is added to, for the next snapshot.
+    :return: Generator yielding each new computer.
+    """
+    for computer in computers:
+        seen.add(computer['id'])
+        if previous is None or computer['id'] not in previous:
+            yield computer
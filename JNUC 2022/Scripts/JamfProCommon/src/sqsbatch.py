@@ -0,0 +1,116 @@
+"""
+Batched, concurrent SQS enqueueing for the Jamf Pro workflows.
+
+Messages are grouped into SendMessageBatch calls of up to ten entries and
+the batches are sent from a small thread pool. Entries SQS reports as
+failed are retried with a short backoff before being handed back to the
+caller.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from botocore.exceptions import BotoCoreError, ClientError
+import metrics
+
+
+SQS_BATCH_SIZE = 10
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 0.2
+
+LOGGER = logging.getLogger(__name__)
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most size items.
+
+    :param iterable: Iterable The items to split.
+    :param size: Integer The maximum length of each list.
+    :return: Generator yielding each list in order.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def send_batch(sqs, sqs_queue_url, messages, max_attempts=MAX_ATTEMPTS):
+    """
+    Publish up to ten messages to SQS, retrying entries that fail.
+
+    :param sqs: SQS Client used to send the messages.
+    :param sqs_queue_url: String URL of SQS Queue
+    :param messages: [String] The message bodies.
+    :param max_attempts: Integer The number of times a failing entry is sent.
+    :return: Tuple containing the number of messages sent and a list of the
+        message bodies that could not be sent.
+    """
+    pending = dict(enumerate(messages))
+    failed = []
+    sent = 0
+
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+
+        entries = [{'Id': str(i), 'MessageBody': body} for i, body in pending.items()]
+        try:
+            # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.send_message_batch
+            with metrics.timer('SQSSendTime'):
+                response = sqs.send_message_batch(QueueUrl=sqs_queue_url, Entries=entries)
+        except (BotoCoreError, ClientError) as e:
+            LOGGER.error(e)
+            continue
+
+        for entry in response.get('Successful', []):
+            pending.pop(int(entry['Id']))
+            sent += 1
+
+        for entry in response.get('Failed', []):
+            LOGGER.warning(f'SQS rejected message {entry["Id"]}: {entry.get("Code")} {entry.get("Message")}')
+            if entry.get('SenderFault'):
+                # The message itself is invalid, so sending it again will not help
+                failed.append(pending.pop(int(entry['Id'])))
+
+    return sent, failed + list(pending.values())
+
+
+def send_message_batches(sqs, sqs_queue_url, messages, max_workers=MAX_WORKERS):
+    """
+    Publish any number of messages to SQS using concurrent batch requests.
+
+    :param sqs: SQS Client used to send the messages.
+    :param sqs_queue_url: String URL of SQS Queue
+    :param messages: Iterable of String message bodies. Consumed lazily.
+    :param max_workers: Integer The maximum number of batches in flight.
+    :return: Tuple containing the number of messages sent and a list of the
+        message bodies that could not be sent.
+    """
+    sent = 0
+    failed = []
+
+    def collect(done):
+        nonlocal sent
+        for future in done:
+            batch_sent, batch_failed = future.result()
+            sent += batch_sent
+            failed.extend(batch_failed)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for batch in chunked(messages, SQS_BATCH_SIZE):
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(executor.submit(send_batch, sqs, sqs_queue_url, batch))
+        collect(wait(in_flight).done)
+
+    return sent, failed
@@ -0,0 +1,367 @@
+"""
+Bulk management transitions for the Jamf Pro workflows.
+
+A transition is one change written to each computer with a Classic API PUT,
+e.g. unmanaging it. TransitionEngine runs a transition over a batch of
+computers: it reads their current state with a few inventory requests,
+skips the computers already in the target state, writes the rest from a worker
+pool shared by warm invocations, and reports a result for every item.
+With an async limit, the writes and name lookups are instead sent from one
+thread with asyncjamf, and only the notifications use the worker pool.
+
+If the current state cannot be read the whole batch fails, so it is
+retried rather than written blind.
+
+A dry run stops after the read and reports what would change and how many
+API requests the run would make, without writing anything.
+"""
+
+import functools
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+import computermessage
+import jamfpro
+import metrics
+
+
+# Per-item results
+WRITTEN = 'written'
+SKIPPED = 'skipped'
+PLANNED = 'planned'
+FAILED = 'failed'
+
+COMPUTER_PATH = '/JSSResource/computers/id/{computer_id}'
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Transition:
+    """
+    A change to a computer's record, e.g. unmanaging it.
+    """
+
+    def __init__(self, name, past_tense, title, body, is_done):
+        """
+        :param name: String The transition's name, e.g. 'Unmanage'
+        :param past_tense: String Used in notifications, e.g. 'Unmanaged'
+        :param title: String The Teams message title, e.g. 'Automated Unmanagement'
+        :param body: String Classic API computer XML to PUT, or a Function taking the
+            computer Dictionary and returning it.
+        :param is_done: Function taking a computer's general inventory Dictionary
+            from the Jamf Pro API, returning True if it is already in the target state.
+        """
+        self.name = name
+        self.past_tense = past_tense
+        self.title = title
+        self.body = body
+        self.is_done = is_done
+
+    def xml(self, computer):
+        """
+        :param computer: Dictionary containing the computer's id and name, from a computer message
+        :return: String XML written to the computer's record.
+        """
+        return self.body(computer) if callable(self.body) else self.body
+
+    def teams_message(self, webhook_url, jamf_url, computer):
+        """
+        :param webhook_url: String The Teams webhook the message is posted to.
+        :param jamf_url: String The Jamf Pro server address.
+        :param computer: Dictionary containing the computer's id and name.
+        :return: Dictionary in the form SendToTeams accepts.
+        """
+        computer_id = computer["id"]
+        text = f"**{self.past_tense} the following machine:**\n\rMachine Name: {computer['name']}\n\rComputer ID: {computer_id}\n\rURL: {jamf_url}/computers.html?id={computer_id}"
+        return {
+            "webhook": {
+                "url": webhook_url
+            },
+            "message": {
+                "title": self.title,
+                "text": text
+            }
+        }
+
+
+def managed_state(general):
+    return general.get('remoteManagement', {}).get('managed')
+
+
+UNMANAGE = Transition(
+    'Unmanage', 'Unmanaged', 'Automated Unmanagement',
+    u'<?xml version="1.0" encoding="UTF-8"?><computer><general><remote_management><managed>false</managed></remote_management></general></computer>',
+    lambda general: managed_state(general) is False
+)
+
+REMANAGE = Transition(
+    'Remanage', 'Remanaged', 'Automated Remanagement',
+    u'<?xml version="1.0" encoding="UTF-8"?><computer><general><remote_management><managed>true</managed><management_username>automated-remanagenment</management_username><management_password>Remanaged-Machine</management_password></remote_management></general></computer>',
+    lambda general: managed_state(general) is True
+)
+
+
+def move_to_site(site_id, site_name):
+    """
+    :param site_id: Integer The Jamf Pro site ID.
+    :param site_name: String The site's name, for notifications.
+    :return: Transition moving computers to the site.
+    """
+    return Transition(
+        'Move site', f'Moved to site {site_name}', 'Automated Site Change',
+        f'<?xml version="1.0" encoding="UTF-8"?><computer><general><site><id>{int(site_id)}</id></site></general></computer>',
+        lambda general: str(general.get('site', {}).get('id')) == str(site_id)
+    )
+
+
+class Plan:
+    """
+    The computers a run would write and skip, and the API requests it would make.
+    """
+
+    def __init__(self, transition, pending, skipped, precheck_requests, notify, failed=None):
+        """
+        :param transition: Transition The change being planned.
+        :param pending: Dictionary mapping each item key to a computer that needs writing.
+        :param skipped: Dictionary mapping each item key to a computer already in the target state.
+        :param precheck_requests: Integer The inventory requests made to read the current state.
+        :param notify: Boolean True if each write is followed by a notification.
+        :param failed: Dictionary mapping each item key to a computer whose state could not be read.
+        """
+        self.transition = transition
+        self.pending = pending
+        self.skipped = skipped
+        self.failed = failed or {}
+        self.precheck_requests = precheck_requests
+        self.notify = notify
+
+    def estimate(self):
+        """
+        :return: Dictionary of the API requests the run makes, assuming no retries.
+        """
+        lookups = sum(1 for computer in self.pending.values() if computer["name"] is None) if self.notify else 0
+        return {
+            'EstimatedJamfReads': self.precheck_requests + lookups,
+            'EstimatedJamfWrites': len(self.pending),
+            'EstimatedNotifications': len(self.pending) if self.notify else 0,
+        }
+
+    def summary(self):
+        estimate = self.estimate()
+        return (f'{self.transition.name}: {len(self.pending)} to write, {len(self.skipped)} already done, '
+                f'{len(self.failed)} failed. '
+                f'Estimated {estimate["EstimatedJamfReads"]} Jamf Pro reads, {estimate["EstimatedJamfWrites"]} writes '
+                f'and {estimate["EstimatedNotifications"]} notifications.')
+
+
+@functools.lru_cache(maxsize=None)
+def get_pool(max_workers):
+    """
+    :param max_workers: Integer The number of worker threads.
+    :return: ThreadPoolExecutor, created on first use and reused by warm invocations.
+    """
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transition')
+
+
+class TransitionEngine:
+    """
+    Runs a transition over batches of computers with a shared Jamf Pro client and worker pool.
+    """
+
+    def __init__(self, client, transition, notify=None, max_workers=10, async_limit=0):
+        """
+        :param client: JamfProClient used for every read and write.
+        :param transition: Transition The change to make.
+        :param notify: Function taking a written computer's Dictionary and returning
+            True once a notification was sent, or None to skip notifications.
+        :param max_workers: Integer The number of computers written at once, or
+            notified at once when writes are asynchronous.
+        :param async_limit: Integer The number of requests asyncjamf keeps in flight
+            for writes and name lookups. 0 writes from the worker pool instead.
+        """
+        self.client = client
+        self.transition = transition
+        self.notify = notify
+        self.max_workers = max_workers
+        self.async_limit = async_limit
+
+    def plan(self, computers):
+        """
+        Read the current state of a batch and work out which computers need writing.
+        Names missing from the computers are filled in from the inventory.
+
+        :param computers: Dictionary mapping each item key (e.g. an SQS message ID) to
+            a computer Dictionary containing its id and name.
+        :return: Plan for the batch. If the current state cannot be read, every
+            computer is failed and none is written.
+        """
+        computer_ids = [computer["id"] for computer in computers.values()]
+        precheck_requests = math.ceil(len(computer_ids) / jamfpro.INVENTORY_ID_CHUNK_SIZE)
+        current = self.client.get_computers_general(computer_ids)
+        if current is None:
+            LOGGER.error(f'{self.transition.name}: Could not read the current management state. Failing the batch.')
+            return Plan(self.transition, {}, {}, precheck_requests, self.notify is not None, failed=dict(computers))
+
+        pending = {}
+        skipped = {}
+        for key, computer in computers.items():
+            general = current.get(computer["id"])
+            if general is not None:
+                if computer["name"] is None:
+                    computer["name"] = general.get("name")
+                if self.transition.is_done(general):
+                    LOGGER.info(f'{self.transition.name}: Computer ID {computer["id"]} is already in the target state. Skipping.')
+                    skipped[key] = computer
+                    continue
+            pending[key] = computer
+
+        return Plan(self.transition, pending, skipped, precheck_requests, self.notify is not None)
+
+    def get_computer_name(self, computer_id):
+        """
+        :param computer_id: Integer The Jamf Pro computer ID.
+        :return: String containing the computer's name. If error, returns None.
+        """
+        computer_record = self.client.get_json(f'/JSSResource/computers/id/{computer_id}/subset/General')
+        if computer_record is None:
+            return None
+        return computer_record["computer"]["general"]["name"]
+
+    def announce(self, computer):
+        """
+        Notify that a computer was written, looking up its name if it is missing.
+
+        :param computer: Dictionary containing the computer's id and name.
+        :return: Boolean True if the notification was sent or notifications are off, otherwise False.
+        """
+        if self.notify is None:
+            return True
+        try:
+            if computer["name"] is None:
+                computer["name"] = self.get_computer_name(computer["id"]) or 'Unknown'
+            return bool(self.notify(computer))
+        except Exception as e:
+            LOGGER.exception(f'{self.transition.name} notification failed for Computer ID {computer["id"]}: {e}')
+            return False
+
+    def apply(self, computer):
+        """
+        Write the transition to one computer, then notify.
+
+        :param computer: Dictionary containing the computer's id and name.
+        :return: Boolean True if the computer was written and notified, otherwise False.
+        """
+        computer_id = computer["id"]
+        LOGGER.info(f'{self.transition.name}: Computer ID {computer_id}')
+
+        try:
+            with metrics.timer('RecordTime'):
+                path = COMPUTER_PATH.format(computer_id=computer_id)
+                if not self.client.put_xml(path, self.transition.xml(computer)):
+                    return False
+                return self.announce(computer)
+        except Exception as e:
+            LOGGER.exception(f'{self.transition.name} failed for Computer ID {computer_id}: {e}')
+            return False
+
+    def apply_async(self, computers):
+        """
+        Write the transition to many computers with asyncjamf, fill in missing
+        names the same way, then notify from the worker pool.
+
+        :param computers: [Dictionary] Each computer's id and name.
+        :return: [Boolean] True where the computer was written and notified, in the order of computers.
+        """
+        # aiohttp adds about a quarter of a second to a cold start, so only engines that use it import it
+        import asyncjamf
+
+        for computer in computers:
+            LOGGER.info(f'{self.transition.name}: Computer ID {computer["id"]}')
+        with metrics.timer('AsyncWriteTime'):
+            written = asyncjamf.put_xml_many(
+                self.client,
+                [(COMPUTER_PATH.format(computer_id=computer["id"]), self.transition.xml(computer)) for computer in computers],
+                self.async_limit
+            )
+
+        unnamed = [computer for computer, ok in zip(computers, written) if ok and computer["name"] is None]
+        if self.notify is not None and unnamed:
+            records = asyncjamf.get_json_many(
+                self.client,
+                [f'{COMPUTER_PATH.format(computer_id=computer["id"])}/subset/General' for computer in unnamed],
+                self.async_limit
+            )
+            for computer, record in zip(unnamed, records):
+                computer["name"] = record["computer"]["general"]["name"] if record else 'Unknown'
+
+        notified = get_pool(self.max_workers).map(self.announce, [computer for computer, ok in zip(computers, written) if ok])
+        return [ok and next(notified) for ok in written]
+
+    def run(self, computers, dry_run=False):
+        """
+        Plan a batch, then write every computer that needs it.
+
+        :param computers: Dictionary mapping each item key to a computer Dictionary.
+        :param dry_run: Boolean True to stop after planning.
+        :return: Tuple containing the Plan and a Dictionary mapping each item key to
+            WRITTEN, SKIPPED, PLANNED (dry run) or FAILED.
+        """
+        plan = self.plan(computers)
+        LOGGER.info(plan.summary())
+
+        results = dict.fromkeys(plan.failed, FAILED)
+        results.update(dict.fromkeys(plan.skipped, SKIPPED))
+        if dry_run:
+            results.update(dict.fromkeys(plan.pending, PLANNED))
+            return plan, results
+
+        if self.async_limit:
+            outcomes = self.apply_async(list(plan.pending.values()))
+        else:
+            outcomes = get_pool(self.max_workers).map(self.apply, plan.pending.values())
+        for key, ok in zip(plan.pending, outcomes):
+            results[key] = WRITTEN if ok else FAILED
+        return plan, results
+
+
+def handle_sqs_batch(event, engine, workflow, dry_run=False):
+    """
+    Run a transition over the computer messages in an SQS event and record the outcome.
+
+    :param event: Dictionary The Lambda SQS event.
+    :param engine: TransitionEngine The engine to run.
+    :param workflow: String The Workflow metrics dimension, e.g. 'UnmanageComputers'
+    :param dry_run: Boolean True to plan without writing.
+    :return: Dictionary Lambda response listing the failed records (ReportBatchItemFailures).
+    """
+    failures = []
+    invalid = 0
+    computers = {}
+    for record in event['Records']:
+        try:
+            computers[record["messageId"]] = computermessage.decode(record["body"])
+        except (ValueError, KeyError, TypeError) as e:
+            # It would fail the same way on every delivery, so it is dropped rather than retried
+            LOGGER.error(f'Dropping invalid message {record["messageId"]}: {e}')
+            invalid += 1
+
+    plan, results = engine.run(computers, dry_run)
+    failures.extend(key for key, result in results.items() if result == FAILED)
+
+    metrics.emit({
+        # A dry run writes nothing; the planned writes are in EstimatedJamfWrites
+        'Writes': 0 if dry_run else len(plan.pending),
+        'SkippedWrites': len(plan.skipped),
+        'FailedRecords': len(failures),
+        'InvalidRecords': invalid,
+    }, {'Workflow': workflow})
+    if dry_run:
+        metrics.emit(plan.estimate(), {'Workflow': workflow})
+    if engine.client.write_limiter is not None:
+        metrics.emit({'WriteConcurrencyLimit': int(engine.client.write_limiter.limit)}, {'Workflow': workflow}, unit='None')
+
+    # Only the failed records return to the queue (ReportBatchItemFailures)
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]
+    }
+
@@ -12,26 +12,206 @@ The message is expected to be in the following form.
         "text": "Message Body"
     }
 }
+
+Records are posted concurrently. Each webhook is paced by its own token
+bucket, and a 429 or Retry-After response pauses only that webhook. Records
+that cannot be delivered before the Lambda deadline are reported back to
+SQS as batch item failures so they are retried later. Malformed records and
+messages the webhook rejects outright (4xx other than 408 and 429) are logged
+and dropped, as no retry would deliver them.
 """
 
 import json
 import logging
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+import jamfpro
+import metrics
 
 
-def lambda_handler(event, context):
-    for record in event["Records"]:
-        message_body = json.loads(record["body"])
+class TokenBucket:
+    """
+    Paces requests to a single webhook.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Float The number of requests allowed per second.
+        :param capacity: Integer The largest burst allowed.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline):
+        """
+        Wait for a token.
+
+        :param deadline: Float time.monotonic() value to give up at.
+        :return: Boolean True if a token was taken before the deadline, otherwise False.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for a number of seconds, e.g. after a 429.
+
+        :param seconds: Float The time to wait before the next request.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
 
-        url = message_body["webhook"]["url"]
-        msg = json.dumps(message_body["message"])
 
+def get_session(url):
+    """
+    Get the keep-alive session for a webhook host, creating it on first use.
+
+    :param url: String The webhook URL.
+    :return: Session shared by every post to the same host.
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with LOCK:
+        if host not in SESSIONS:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=MAX_WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            SESSIONS[host] = session
+        return SESSIONS[host]
+
+
+def get_bucket(url):
+    """
+    :param url: String The webhook URL.
+    :return: TokenBucket pacing posts to that webhook.
+    """
+    with LOCK:
+        if url not in BUCKETS:
+            BUCKETS[url] = TokenBucket(WEBHOOK_RATE, WEBHOOK_BURST)
+        return BUCKETS[url]
+
+
+def post_to_teams(url, msg, deadline):
+    """
+    Post a message to a Teams webhook, retrying throttled and transient failures.
+
+    :param url: String The webhook URL.
+    :param msg: String JSON message card.
+    :param deadline: Float time.monotonic() value to give up at.
+    :return: String DELIVERED, REJECTED if retrying cannot help, or FAILED.
+    """
+    session = get_session(url)
+    bucket = get_bucket(url)
+
+    for attempt in range(MAX_ATTEMPTS):
+        if not bucket.acquire(deadline):
+            LOGGER.warning('Ran out of time waiting to post to the webhook.')
+            return FAILED
+
+        timeout = max(0.1, min(REQUEST_TIMEOUT_SECONDS, deadline - time.monotonic()))
         try:
-            requests.post(url, data=msg)
+            with metrics.timer('WebhookPostTime'):
+                r = session.post(url, data=msg, headers={'Content-Type': 'application/json'}, timeout=timeout)
         except requests.exceptions.RequestException as e:
             LOGGER.error(e)
-            return None
+            bucket.pause(jamfpro.retry_delay(None, attempt))
+            continue
+
+        if r.ok:
+            return DELIVERED
+        if r.status_code not in RETRY_STATUS_CODES and r.status_code < 500:
+            LOGGER.error(f'Webhook rejected the message: {r.status_code} {r.text}')
+            return REJECTED
+
+        delay = jamfpro.retry_delay(r, attempt)
+        LOGGER.warning(f'Webhook returned {r.status_code}. Waiting {delay:.2f}s before retrying.')
+        metrics.count('WebhookRetries')
+        bucket.pause(delay)
+
+    return FAILED
+
+
+def process_record(record, deadline):
+    """
+    Send the message in one SQS record to its webhook.
+
+    :param record: Dictionary containing an SQS record.
+    :param deadline: Float time.monotonic() value to give up at.
+    :return: Boolean True if the record is done with, delivered or dropped, otherwise False to retry it.
+    """
+    try:
+        message_body = json.loads(record["body"])
+        url = message_body["webhook"]["url"]
+        msg = json.dumps(message_body["message"])
+    except (ValueError, KeyError, TypeError) as e:
+        LOGGER.error(f'Dropping invalid message {record["messageId"]}: {e}')
+        metrics.count('DroppedMessages')
+        return True
+
+    with metrics.timer('RecordTime'):
+        result = post_to_teams(url, msg, deadline)
+
+    if result == REJECTED:
+        LOGGER.error(f'Dropping message {record["messageId"]}, which the webhook will not accept.')
+        metrics.count('DroppedMessages')
+    return result != FAILED
+
+
+@metrics.instrument('SendToTeams')
+def lambda_handler(event, context):
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() / 1000
+    else:
+        remaining = float('inf')
+    deadline = time.monotonic() + remaining - DEADLINE_MARGIN_SECONDS
+
+    records = event["Records"]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(lambda record: process_record(record, deadline), records)
+        failures = [record for record, ok in zip(records, results) if not ok]
+
+    # Only the failed records return to the queue (ReportBatchItemFailures)
+    return {
+        'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in failures]
+    }
+
+
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "10"))
+# Teams connectors accept roughly four requests per second per webhook
+WEBHOOK_RATE = float(os.getenv("WEBHOOK_RATE", "4"))
+WEBHOOK_BURST = int(os.getenv("WEBHOOK_BURST", "4"))
+MAX_ATTEMPTS = 5
+# Other 4xx responses reject the message itself, so it is dropped rather than retried
+RETRY_STATUS_CODES = (408, 429)
+DELIVERED = 'delivered'
+REJECTED = 'rejected'
+FAILED = 'failed'
+REQUEST_TIMEOUT_SECONDS = 5
+DEADLINE_MARGIN_SECONDS = 0.5
 
+SESSIONS = {}
+BUCKETS = {}
+LOCK = threading.Lock()
 
 logging.basicConfig(format='%(levelname)s: %(asctime)s: %(message)s')
 LOGGER = logging.getLogger(__name__)
@@ -0,0 +1,310 @@
+"""Measure the webhook Lambda's ingestion during a check-in storm.
+
+A storm of signed ComputerCheckIn and ComputerInventoryCompleted webhooks is
+sent through lambda_handler, one API Gateway request at a time, to an SQS
+sink whose every SendMessageBatch call takes a fixed latency. Each scenario
+prints the webhooks forwarded, the sink calls made, the handler latency per
+request and the events accepted per second:
+
+    per-event        BATCH_SIZE=1, one sink call per webhook
+    batched          BATCH_SIZE=10, warm invocations fill batches (BATCH_MAX_WAIT_SECONDS)
+    forwarded arrays Requests carry 10 webhooks each, written before the invocation returns
+    coalesced        As batched, forwarding only the newest webhook per device and event type
+
+After the storm, once the wait and window have passed, the scheduled
+release event is sent, so what warm environments still hold is forwarded
+the way it would be in AWS. The time spent waiting is not counted.
+
+Then the sink refuses every call for a while, so it refuses flushes holding
+webhooks released from earlier requests. Requests answered 503 are sent
+again once it recovers, and every device and event type answered 202 must
+reach the queue with its newest webhook.
+
+Next every webhook is delivered twice, spread over several environments, to
+compare coalescing in memory only with a shared store. Last, validation with
+the schemas compiled at import is compared with compiling the schema for
+every payload.
+
+Usage: python ingestion.py [--events N] [--devices N] [--sqs-latency SECONDS] [--max-wait SECONDS] [--window SECONDS]
+"""
+import argparse
+import hashlib
+import hmac
+import importlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "sample_with_requirements", "src")
+sys.path.insert(0, SRC_DIR)
+
+import fastjsonschema  # noqa: E402
+from aws_lambda_powertools.utilities.parameters import base, ssm  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+
+import coalesce  # noqa: E402
+import schemas  # noqa: E402
+
+SECRET = "benchmark-secret"
+SECRET_PARAMETER = "/sample-webhook-handler/webhook-secret"
+QUEUE_URL = "sqs://sqs.us-west-1.amazonaws.com/000000000000/webhooks"
+SCHEDULED_EVENT = {"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}}
+
+
+class SQSStandIn:
+    """Accepts SendMessageBatch calls after a fixed latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.messages = 0
+
+    def send_message_batch(self, QueueUrl: str, Entries: list) -> dict:
+        time.sleep(self.latency)
+        self.calls += 1
+        self.messages += len(Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+
+class RefusingSQSStandIn(SQSStandIn):
+    """Refuses every entry while refusing is set, otherwise records each message sent."""
+
+    def __init__(self, latency: float):
+        super().__init__(latency)
+        self.refusing = False
+        self.bodies = []
+
+    def send_message_batch(self, QueueUrl: str, Entries: list) -> dict:
+        if self.refusing:
+            time.sleep(self.latency)
+            self.calls += 1
+            failed = [{"Id": entry["Id"], "Code": "ServiceUnavailable", "Message": "Refused"} for entry in Entries]
+            return {"Successful": [], "Failed": failed}
+        self.bodies.extend(entry["MessageBody"] for entry in Entries)
+        return super().send_message_batch(QueueUrl, Entries)
+
+
+class SSMStandIn:
+    """Returns the webhook secret."""
+
+    def get_parameter(self, Name: str, WithDecryption: bool = False) -> dict:
+        return {"Parameter": {"Name": Name, "Value": SECRET}}
+
+
+class DynamoDBStandIn:
+    """Evaluates the coalescing store's conditional PutItem."""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName: str, Item: dict, ConditionExpression: str, ExpressionAttributeValues: dict) -> dict:
+        now = int(ExpressionAttributeValues[":now"]["N"])
+        timestamp = int(ExpressionAttributeValues[":timestamp"]["N"])
+        item = self.items.get(Item["pk"]["S"])
+        if item and int(item["expires_at"]["N"]) > now and int(item["event_timestamp"]["N"]) >= timestamp:
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+        self.items[Item["pk"]["S"]] = Item
+        return {}
+
+
+class LambdaContext:
+    function_name = "sample-webhook-handler-lambda-enroll"
+    memory_limit_in_mb = 512
+    invoked_function_arn = "arn:aws:lambda:us-west-1:000000000000:function:sample-webhook-handler-lambda-enroll"
+    aws_request_id = "00000000-0000-0000-0000-000000000000"
+
+
+def storm(count: int, devices: int) -> list[dict]:
+    """Webhooks from a fleet checking in and reporting inventory after an outage."""
+    payloads = []
+    for i in range(count):
+        device = {"jssID": i % devices + 1, "udid": f"UDID-{i % devices + 1}", "serialNumber": f"C02X{i % devices + 1:06d}"}
+        if i % 2:
+            webhook_event, event = "ComputerInventoryCompleted", dict(device, deviceName=f"Mac {device['jssID']}")
+        else:
+            webhook_event, event = "ComputerCheckIn", {"computer": device, "trigger": "CLIENT_CHECKIN"}
+        payloads.append(
+            {
+                "webhook": {"id": 1, "name": "Storm", "webhookEvent": webhook_event, "eventTimestamp": 1790000000000 + i},
+                "event": event,
+            }
+        )
+    return payloads
+
+
+def request(payload) -> dict:
+    """Build a signed API Gateway request."""
+    body = json.dumps(payload)
+    signature = "sha256=" + hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).hexdigest()
+    return {"body": body, "isBase64Encoded": False, "headers": {"x-webhook-signature": signature}}
+
+
+def load_handler(batch_size: int, max_wait: float, window: float, sqs: SQSStandIn, event_types: str = ""):
+    """Load a fresh copy of the handler module, as a new execution environment would."""
+    os.environ.update(
+        {
+            "SINK_URL": QUEUE_URL,
+            "BATCH_SIZE": str(batch_size),
+            "BATCH_MAX_WAIT_SECONDS": str(max_wait),
+            "COALESCE_WINDOW_SECONDS": str(window),
+            "WEBHOOK_SECRET_PARAMETER": SECRET_PARAMETER,
+        }
+    )
+    if event_types:
+        os.environ["COALESCE_EVENT_TYPES"] = event_types
+    else:
+        os.environ.pop("COALESCE_EVENT_TYPES", None)
+    import index
+
+    index = importlib.reload(index)
+    index.BATCHER.sink.sqs = sqs
+    return index
+
+
+def run(requests: list[dict], batch_size: int, max_wait: float, window: float, sqs: SQSStandIn):
+    """Send every request through a freshly loaded handler, returning the latency of each and the total time."""
+    index = load_handler(batch_size, max_wait, window, sqs)
+    context = LambdaContext()
+
+    latencies = []
+    start = time.perf_counter()
+    for event in requests:
+        request_start = time.perf_counter()
+        result = index.lambda_handler(event, context)
+        latencies.append(time.perf_counter() - request_start)
+        assert result["statusCode"] == 202, result
+    elapsed = time.perf_counter() - start
+
+    # The next scheduled release after the storm
+    time.sleep(max(max_wait, window))
+    result = index.lambda_handler(SCHEDULED_EVENT, context)
+    assert not result["held"] and not result["buffered"], result
+    return latencies, elapsed
+
+
+def check_refused_release(payloads: list[dict], window: float, sqs_latency: float) -> tuple[int, int, int]:
+    """Refuse sink writes while held webhooks are released and check that none answered 202 is lost.
+
+    Check-ins are coalesced and inventory reports pass straight through, so
+    refused flushes mix released webhooks with the request's own. Returns the
+    requests answered 503, the scheduled releases needed and the messages written.
+    """
+    sqs = RefusingSQSStandIn(sqs_latency)
+    index = load_handler(10, 0, window, sqs, event_types="ComputerCheckIn")
+    context = LambdaContext()
+    half = len(payloads) // 2
+
+    accepted = []
+    retries = []
+    for i, payload in enumerate(payloads):
+        if i == half:
+            # Windows opened by the first half close while the sink is down
+            time.sleep(window)
+            sqs.refusing = True
+        if i == half + half // 2:
+            sqs.refusing = False
+        result = index.lambda_handler(request(payload), context)
+        if result["statusCode"] == 202:
+            accepted.append(payload)
+        else:
+            assert result["statusCode"] == 503, result
+            retries.append(payload)
+    for payload in retries:
+        result = index.lambda_handler(request(payload), context)
+        assert result["statusCode"] == 202, result
+        accepted.append(payload)
+
+    releases = 0
+    while index.COALESCER.held or index.BATCHER.records:
+        time.sleep(window)
+        index.lambda_handler(SCHEDULED_EVENT, context)
+        releases += 1
+
+    def newest(payloads):
+        latest = {}
+        for payload in payloads:
+            key = (coalesce.device_of(payload), payload["webhook"]["webhookEvent"])
+            latest[key] = max(latest.get(key, 0), coalesce.timestamp_of(payload))
+        return latest
+
+    written = [json.loads(body) for body in sqs.bodies]
+    assert newest(written) == newest(accepted), "webhooks answered 202 were lost"
+    inventory = [p for p in accepted if p["webhook"]["webhookEvent"] != "ComputerCheckIn"]
+    assert len([p for p in written if p["webhook"]["webhookEvent"] != "ComputerCheckIn"]) == len(inventory)
+    return len(retries), releases, len(written)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=4000, help="Webhooks in the storm (default 4000)")
+    parser.add_argument("--devices", type=int, default=500, help="Computers sending them (default 500)")
+    parser.add_argument("--sqs-latency", type=float, default=0.01, help="Seconds per SQS call (default 0.01)")
+    parser.add_argument("--max-wait", type=float, default=1.0, help="BATCH_MAX_WAIT_SECONDS when batched (default 1)")
+    parser.add_argument("--window", type=float, default=2.0, help="COALESCE_WINDOW_SECONDS when coalesced (default 2)")
+    parser.add_argument("--environments", type=int, default=4, help="Environments sharing duplicates (default 4)")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-1")
+    base.DEFAULT_PROVIDERS["ssm"] = ssm.SSMProvider(boto3_client=SSMStandIn())
+
+    payloads = storm(args.events, args.devices)
+    scenarios = (
+        ("per-event", [request(p) for p in payloads], 1, 0, 0),
+        ("batched", [request(p) for p in payloads], 10, args.max_wait, 0),
+        ("forwarded arrays", [request(payloads[i : i + 10]) for i in range(0, len(payloads), 10)], 10, 0, 0),
+        ("coalesced", [request(p) for p in payloads], 10, args.max_wait, args.window),
+    )
+
+    print(f"{args.events} signed webhooks from {args.devices} computers, SQS latency {args.sqs_latency * 1000:.0f}ms")
+    print(f"{'Scenario':<18} {'Requests':>9} {'Forwarded':>10} {'SQS calls':>10} {'p50':>9} {'p99':>9} {'Events/s':>9}")
+    for label, requests, batch_size, max_wait, window in scenarios:
+        sqs = SQSStandIn(args.sqs_latency)
+        latencies, elapsed = run(requests, batch_size, max_wait, window, sqs)
+        if not window:
+            assert sqs.messages == args.events, (sqs.messages, args.events)
+        p50 = statistics.median(latencies)
+        p99 = statistics.quantiles(latencies, n=100)[98]
+        print(
+            f"{label:<18} {len(requests):>9} {sqs.messages:>10} {sqs.calls:>10} {p50 * 1000:>7.2f}ms "
+            f"{p99 * 1000:>7.2f}ms {args.events / elapsed:>9.0f}"
+        )
+
+    # Each request while the sink is down rewrites the whole buffer, so a smaller storm
+    retried, releases, written = check_refused_release(storm(400, 50), min(args.window, 1.0), args.sqs_latency)
+    print(
+        f"\nSink refusing a quarter of 400 webhooks: {retried} requests answered 503 and sent again, "
+        f"{releases} scheduled releases, {written} written, none answered 202 lost"
+    )
+
+    # The storm delivered twice, each copy to the next environment in turn
+    deliveries = [payload for payload in payloads for _ in range(2)]
+    print(f"\n{len(deliveries)} deliveries over {args.environments} environments, {args.window:.0f}s window")
+    print(f"{'Coalescing':<18} {'Forwarded':>10}")
+    for label, store in (("memory only", None), ("shared store", coalesce.DynamoDBStore("coalesce", DynamoDBStandIn()))):
+        environments = [coalesce.Coalescer(args.window, store=store) for _ in range(args.environments)]
+        forwarded = 0
+        for i, payload in enumerate(deliveries):
+            passed, released = environments[i % args.environments].add([payload])
+            forwarded += len(passed) + len(released)
+        # What each environment releases once the window has closed
+        closed = time.monotonic() + args.window
+        forwarded += sum(len(environment.expire(closed)) for environment in environments)
+        print(f"{label:<18} {forwarded:>10}")
+
+    print(f"\n{'Validation':<18} {'Per payload':>12}")
+    for label, check in (
+        ("precompiled", schemas.validate),
+        ("compiled per call", lambda p: fastjsonschema.validate(schemas.EVENTS[p["webhook"]["webhookEvent"]], p["event"])),
+    ):
+        start = time.perf_counter()
+        for payload in payloads:
+            check(payload)
+        print(f"{label:<18} {(time.perf_counter() - start) / len(payloads) * 1e6:>10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Coalescing window for repeated webhooks from the same device.
+
+During a storm Jamf Pro sends ComputerCheckIn, ComputerInventoryCompleted and
+similar webhooks for the same device again and again. The Coalescer holds
+each one for a window keyed by device and event type. A newer webhook for a
+held key replaces the one held. When the window closes only the newest is
+released, so one event per key and window goes downstream.
+
+Windows are kept in the order they opened, up to max_keys. When full the
+oldest window is released early, so memory stays bounded and nothing is
+dropped. Held webhooks live in the execution environment's memory and are
+released by the first invocation after their window closes, whether it
+carries webhooks or is the scheduled release event.
+
+A persistent store (COALESCE_STORE, e.g. dynamodb://table-name) extends this
+across concurrent environments. Before releasing a webhook the Coalescer
+claims its key in the store. The claim fails if another environment already
+released a webhook for that key, as new or newer, within the window, so the
+stale copy is dropped.
+"""
+import math
+import time
+import urllib.parse
+from collections import OrderedDict
+
+import boto3
+from aws_lambda_powertools import Logger
+from botocore.exceptions import BotoCoreError, ClientError
+
+LOGGER = Logger(child=True)
+
+# Webhooks that only report the latest state of a device, so older ones can be dropped
+DEFAULT_EVENT_TYPES = (
+    "ComputerCheckIn",
+    "ComputerInventoryCompleted",
+    "MobileDeviceCheckIn",
+    "MobileDeviceInventoryCompleted",
+)
+
+
+def device_of(payload: dict) -> str | None:
+    """Return the UDID of the device a webhook is about, or None."""
+    event = payload["event"]
+    device = event.get("computer", event)
+    udid = device.get("udid") if isinstance(device, dict) else None
+    return udid or None
+
+
+def timestamp_of(payload: dict) -> int:
+    """Return when Jamf Pro sent a webhook, in milliseconds, or 0 if it doesn't say."""
+    return payload["webhook"].get("eventTimestamp", 0)
+
+
+class DynamoDBStore:
+    """Records the newest webhook released per key in a DynamoDB table.
+
+    The table's partition key is the string "pk". Turn on TTL for the
+    "expires_at" attribute to remove closed windows.
+    """
+
+    def __init__(self, table_name: str, dynamodb=None):
+        self.table_name = table_name
+        self.dynamodb = dynamodb
+
+    def client(self):
+        if self.dynamodb is None:
+            self.dynamodb = boto3.client("dynamodb")
+        return self.dynamodb
+
+    def claim(self, key: str, timestamp: int, window: float) -> bool:
+        """Record a release unless one as new or newer is recorded for a window still open.
+
+        Returns True if the webhook should be released. If the table can't be
+        reached the webhook is released, as a duplicate is better than a loss.
+        """
+        now = int(time.time())
+        try:
+            self.client().put_item(
+                TableName=self.table_name,
+                Item={
+                    "pk": {"S": key},
+                    "event_timestamp": {"N": str(timestamp)},
+                    "expires_at": {"N": str(now + max(math.ceil(window), 1))},
+                },
+                ConditionExpression="attribute_not_exists(pk) OR expires_at <= :now OR event_timestamp < :timestamp",
+                ExpressionAttributeValues={":now": {"N": str(now)}, ":timestamp": {"N": str(timestamp)}},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            LOGGER.error(f"Failed to claim {key} in {self.table_name}: {e}")
+        except BotoCoreError as e:
+            LOGGER.error(f"Failed to claim {key} in {self.table_name}: {e}")
+        return True
+
+
+def open_store(url: str):
+    """Create the persistent store described by a URL, or None for memory only.
+
+    Raises ValueError if the URL scheme is not supported.
+    """
+    if not url:
+        return None
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == "dynamodb":
+        return DynamoDBStore(parts.netloc)
+    raise ValueError(f"Unsupported coalescing store: {url}")
+
+
+class Coalescer:
+    """Holds webhooks for a window per device and event type, releasing the newest."""
+
+    def __init__(self, window: float, max_keys: int = 10000, event_types=DEFAULT_EVENT_TYPES, store=None):
+        self.window = window
+        self.max_keys = max_keys
+        self.event_types = frozenset(event_types)
+        self.store = store
+        # key -> (window opened at, newest payload), oldest window first
+        self.held = OrderedDict()
+        self.coalesced = 0
+
+    def key_of(self, payload: dict) -> str | None:
+        """Return the coalescing key of a webhook, or None if it must not be held."""
+        event_type = payload["webhook"]["webhookEvent"]
+        if self.window <= 0 or event_type not in self.event_types:
+            return None
+        udid = device_of(payload)
+        return f"{udid}#{event_type}" if udid else None
+
+    def add(self, payloads: list[dict]) -> tuple[list[dict], list[dict]]:
+        """Hold what can be coalesced.
+
+        Returns the webhooks that are not held, and those released from
+        windows opened by earlier webhooks, closed or pushed out by new ones.
+        """
+        now = time.monotonic()
+        passed = []
+        released = []
+        for payload in payloads:
+            key = self.key_of(payload)
+            if key is None:
+                passed.append(payload)
+                continue
+            entry = self.held.get(key)
+            if entry is None:
+                self.held[key] = (now, payload)
+                continue
+            self.coalesced += 1
+            opened, held = entry
+            if timestamp_of(payload) >= timestamp_of(held):
+                self.held[key] = (opened, payload)
+        while len(self.held) > self.max_keys:
+            released.extend(self.release(*self.held.popitem(last=False)))
+        released.extend(self.expire(now))
+        return passed, released
+
+    def expire(self, now: float | None = None) -> list[dict]:
+        """Release the newest webhook of every window that has closed."""
+        now = time.monotonic() if now is None else now
+        released = []
+        while self.held:
+            key, (opened, payload) = next(iter(self.held.items()))
+            if now - opened < self.window:
+                break
+            del self.held[key]
+            released.extend(self.release(key, (opened, payload)))
+        return released
+
+    def release(self, key: str, entry: tuple) -> list[dict]:
+        """Check a window's newest webhook against the store before it is released."""
+        payload = entry[1]
+        if self.store is not None and not self.store.claim(key, timestamp_of(payload), self.window):
+            LOGGER.debug(f"Dropped {key}; another environment released it or a newer one")
+            self.coalesced += 1
+            return []
+        return [payload]
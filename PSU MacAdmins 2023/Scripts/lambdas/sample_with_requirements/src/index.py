@@ -1,20 +1,156 @@
-"""Sample Lambda with Python Requirements"""
+"""Sample Lambda with Python Requirements
+
+Receives Jamf Pro webhooks from API Gateway, one per request or several as a
+JSON array. Signed requests are checked against the secret in Parameter
+Store, each payload is validated against its event schema, repeated webhooks
+from the same device are coalesced, and accepted events are written to the
+sink in batches.
+
+Held webhooks, in coalescing windows or partial batches, are released by
+every invocation once due, and by a scheduled EventBridge event when no
+webhooks arrive.
+
+Environment:
+    SINK_URL                  Where accepted events go, see sinks.py (default log://)
+    BATCH_SIZE                Events per sink write (default 10)
+    BATCH_MAX_WAIT_SECONDS    How long warm invocations may hold events to fill a batch (default 0)
+    WEBHOOK_SECRET_PARAMETER  SecureString parameter with the HMAC secret. Signatures aren't checked if unset.
+    SIGNATURE_HEADER          Header with the "sha256=<hex>" HMAC of the body (default X-Webhook-Signature)
+    COALESCE_WINDOW_SECONDS   Hold device webhooks this long, sending only the newest per event type (default 0, off)
+    COALESCE_MAX_KEYS         Devices and event types held at once (default 10000)
+    COALESCE_EVENT_TYPES      Comma separated event types to coalesce (default: check-ins and inventory)
+    COALESCE_STORE            Shared store across environments, see coalesce.py (default none)
+"""
+import base64
 import json
 import os
+from collections import Counter
 
+import fastjsonschema
 from aws_lambda_powertools import Logger
+from aws_lambda_powertools.utilities import parameters
+
+import coalesce
+import ingest
+import schemas
+import sinks
 
 LOGGER = Logger(level=os.environ.get("LOG_LEVEL"), default="WARNING")
 
+SECRET_PARAMETER = os.environ.get("WEBHOOK_SECRET_PARAMETER")
+SIGNATURE_HEADER = os.environ.get("SIGNATURE_HEADER", "X-Webhook-Signature").lower()
+
+# Created once per environment so warm invocations reuse the sink's client and buffer
+BATCHER = ingest.Batcher(
+    sinks.open_sink(os.environ.get("SINK_URL", "log://")),
+    max_size=int(os.environ.get("BATCH_SIZE", "10")),
+    max_wait=float(os.environ.get("BATCH_MAX_WAIT_SECONDS", "0")),
+)
+COALESCER = coalesce.Coalescer(
+    window=float(os.environ.get("COALESCE_WINDOW_SECONDS", "0")),
+    max_keys=int(os.environ.get("COALESCE_MAX_KEYS", "10000")),
+    event_types=os.environ.get("COALESCE_EVENT_TYPES", ",".join(coalesce.DEFAULT_EVENT_TYPES)).split(","),
+    store=coalesce.open_store(os.environ.get("COALESCE_STORE", "")),
+)
+
+if not SECRET_PARAMETER:
+    LOGGER.warning("WEBHOOK_SECRET_PARAMETER is not set. Webhook signatures will not be checked.")
+
+
+def response(status_code: int, body: dict) -> dict:
+    """Build an API Gateway response."""
+    return {"statusCode": status_code, "headers": {"Content-Type": "application/json"}, "body": json.dumps(body)}
+
+
+def read_body(event: dict) -> bytes:
+    """Return the raw request body, exactly as it was signed."""
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        return base64.b64decode(body)
+    return body.encode("utf-8")
+
+
+def serialize(payloads: list[dict]) -> list[str]:
+    """Encode webhooks as compact JSON for the sink."""
+    return [json.dumps(payload, separators=(",", ":")) for payload in payloads]
+
+
+def accept(payloads: list) -> tuple[list[dict], int]:
+    """Validate webhook payloads, returning the accepted ones and the number rejected."""
+    accepted = []
+    rejected = 0
+    for payload in payloads:
+        try:
+            event_type = schemas.validate(payload)
+        except fastjsonschema.JsonSchemaException as e:
+            LOGGER.warning(f"Rejected an invalid webhook: {e.message}")
+            rejected += 1
+            continue
+        LOGGER.debug(f"Accepted {event_type} from webhook {payload['webhook']['id']}")
+        accepted.append(payload)
+    return accepted, rejected
+
+
+def release_held() -> list[str]:
+    """Pass webhooks whose coalescing window closed to the batcher and write it if due.
+
+    Returns the events the sink refused. They stay buffered for the next flush.
+    """
+    BATCHER.add(serialize(COALESCER.expire()))
+    return BATCHER.flush() if BATCHER.due() else []
+
+
+def receive(event: dict) -> tuple[dict, list[str]]:
+    """Check, validate and hold or buffer the webhooks in an API Gateway request.
+
+    Returns the response and the request's own events buffered to be written
+    now, as opposed to held ones or those released from earlier requests.
+    """
+    body = read_body(event)
+
+    if SECRET_PARAMETER:
+        # Cached by Powertools, so the parameter is fetched at most every five minutes
+        secret = parameters.get_parameter(SECRET_PARAMETER, decrypt=True)
+        headers = {name.lower(): value for name, value in (event.get("headers") or {}).items()}
+        if not ingest.verify_signature(secret.encode("utf-8"), body, headers.get(SIGNATURE_HEADER)):
+            LOGGER.warning("Rejected a webhook with a missing or invalid signature.")
+            return response(401, {"message": "Invalid signature"}), []
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        LOGGER.warning("Rejected a webhook that is not JSON.")
+        return response(400, {"message": "Body must be JSON"}), []
+
+    accepted, rejected = accept(data if isinstance(data, list) else [data])
+    if not accepted:
+        return response(400, {"message": "No valid webhooks", "rejected": rejected}), []
+
+    passed, released = COALESCER.add(accepted)
+    own = serialize(passed)
+    BATCHER.add(serialize(released) + own)
+    return response(202, {"accepted": len(accepted), "rejected": rejected}), own
+
 
-def lambda_handler(event, context) -> None:
+@LOGGER.inject_lambda_context
+def lambda_handler(event, context) -> dict:
     """This is the function called during lambda invocation."""
 
-    LOGGER.debug(event)
-    LOGGER.debug(context)
+    if event.get("source") == "aws.events":
+        # Scheduled release of what earlier invocations hold
+        refused = release_held()
+        return {"held": len(COALESCER.held), "buffered": len(BATCHER.records), "refused": len(refused)}
 
-    body = event.get("body")
-    data = json.loads(body)
+    # Webhooks held by earlier invocations are released whatever this request holds
+    result, own = receive(event)
+    refused = release_held()
+    if BATCHER.max_wait > 0:
+        return result
 
-    print(f"Received data from webhook:\n{data}")
-    print("Processing...")
+    # Only this request's refused events are sent back; anything released stays buffered
+    lost = list((Counter(own) & Counter(refused)).elements())
+    if lost:
+        LOGGER.error(f"The sink refused {len(lost)} events.")
+        BATCHER.discard(lost)
+        return response(503, {"message": "Events could not be delivered", "refused": len(lost)})
+    return result
@@ -0,0 +1,91 @@
+"""Signature checks and batched delivery for accepted webhook events."""
+import hashlib
+import hmac
+import time
+from collections import Counter
+
+from aws_lambda_powertools import Logger
+
+LOGGER = Logger(child=True)
+
+
+def sign(secret: bytes, body: bytes) -> str:
+    """Return the signature header value for a raw request body."""
+    return "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret: bytes, body: bytes, received: str | None) -> bool:
+    """Check a received signature against the raw body in constant time."""
+    if not received:
+        return False
+    return hmac.compare_digest(sign(secret, body).encode(), received.strip().encode())
+
+
+class Batcher:
+    """Buffers accepted events and writes them to a sink in batches.
+
+    A batch is due once it holds max_size events or its oldest event has
+    waited max_wait seconds. With max_wait at 0 anything buffered is due at
+    once, so a request's events are written before it is answered. Larger
+    values let warm invocations fill batches between them, at the cost of
+    losing the buffer if the environment is recycled before the next flush.
+
+    Events the sink refuses stay buffered for the next flush, oldest dropped
+    first beyond max_buffered. A caller that has the sender deliver its
+    events again takes them back out with discard().
+    """
+
+    def __init__(self, sink, max_size: int = 10, max_wait: float = 0, max_buffered: int = 1000):
+        self.sink = sink
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.max_buffered = max_buffered
+        self.records = []
+        self.oldest = None
+
+    def add(self, records: list[str]) -> None:
+        """Buffer accepted events."""
+        if records and self.oldest is None:
+            self.oldest = time.monotonic()
+        self.records.extend(records)
+
+    def due(self) -> bool:
+        """True if a full batch is buffered or the oldest event has waited long enough."""
+        if self.oldest is None:
+            return False
+        return len(self.records) >= self.max_size or time.monotonic() - self.oldest >= self.max_wait
+
+    def flush(self) -> list[str]:
+        """Write every buffered event and return those the sink refused, which stay buffered."""
+        records = self.records
+        self.records = []
+        self.oldest = None
+        failed = []
+        for start in range(0, len(records), self.max_size):
+            failed.extend(self.sink.write(records[start : start + self.max_size]))
+        self.retain(failed)
+        return failed
+
+    def retain(self, failed: list[str]) -> None:
+        """Keep refused events in the buffer for another attempt."""
+        if not failed:
+            return
+        self.records[:0] = failed
+        dropped = len(self.records) - self.max_buffered
+        if dropped > 0:
+            LOGGER.error(f"Event buffer is full. Dropped the {dropped} oldest events.")
+            del self.records[:dropped]
+        self.oldest = time.monotonic()
+
+    def discard(self, records: list[str]) -> None:
+        """Remove buffered events, e.g. ones the sender is asked to deliver again."""
+        remaining = Counter(records)
+        kept = []
+        for record in self.records:
+            if remaining[record] > 0:
+                remaining[record] -= 1
+                continue
+            kept.append(record)
+        self.records = kept
+        if not kept:
+            self.oldest = None
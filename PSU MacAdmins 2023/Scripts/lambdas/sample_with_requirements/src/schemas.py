@@ -0,0 +1,85 @@
+"""JSON schemas for Jamf Pro webhook payloads, compiled once per environment."""
+import fastjsonschema
+
+# Every Jamf Pro webhook wraps its event in the same envelope
+ENVELOPE = {
+    "type": "object",
+    "required": ["webhook", "event"],
+    "properties": {
+        "webhook": {
+            "type": "object",
+            "required": ["id", "name", "webhookEvent"],
+            "properties": {
+                "id": {"type": "integer"},
+                "name": {"type": "string"},
+                "webhookEvent": {"type": "string", "minLength": 1},
+                "eventTimestamp": {"type": "integer"},
+            },
+        },
+        "event": {"type": "object"},
+    },
+}
+
+DEVICE = {
+    "type": "object",
+    "required": ["jssID", "udid", "serialNumber"],
+    "properties": {
+        "jssID": {"type": "integer"},
+        "udid": {"type": "string"},
+        "serialNumber": {"type": "string"},
+        "deviceName": {"type": "string"},
+    },
+}
+
+# The event object of each webhook type with a known shape
+EVENTS = {
+    "ComputerAdded": DEVICE,
+    "ComputerCheckIn": {
+        "type": "object",
+        "required": ["computer"],
+        "properties": {"computer": DEVICE, "trigger": {"type": "string"}},
+    },
+    "ComputerInventoryCompleted": DEVICE,
+    "ComputerPolicyFinished": {
+        "type": "object",
+        "required": ["computer", "policyId", "successful"],
+        "properties": {
+            "computer": DEVICE,
+            "policyId": {"type": "integer"},
+            "successful": {"type": "boolean"},
+        },
+    },
+    "ComputerPushCapabilityChanged": DEVICE,
+    "MobileDeviceCheckIn": DEVICE,
+    "MobileDeviceEnrolled": DEVICE,
+    "MobileDeviceInventoryCompleted": DEVICE,
+    "SmartGroupComputerMembershipChange": {
+        "type": "object",
+        "required": ["name", "smartGroup"],
+        "properties": {
+            "name": {"type": "string"},
+            "smartGroup": {"type": "boolean"},
+            "groupAddedDevicesIds": {"type": "array", "items": {"type": "integer"}},
+            "groupRemovedDevicesIds": {"type": "array", "items": {"type": "integer"}},
+        },
+    },
+}
+
+VALIDATE_ENVELOPE = fastjsonschema.compile(ENVELOPE)
+VALIDATE_EVENT = {name: fastjsonschema.compile(schema) for name, schema in EVENTS.items()}
+
+
+def validate(payload) -> str:
+    """Check a webhook payload and return its event type.
+
+    Event types without a schema here are checked against the envelope only,
+    so webhooks added in later Jamf Pro versions are still accepted.
+
+    Raises fastjsonschema.JsonSchemaException if the payload is invalid.
+    """
+    VALIDATE_ENVELOPE(payload)
+    event_type = payload["webhook"]["webhookEvent"]
+    validate_event = VALIDATE_EVENT.get(event_type)
+    if validate_event is not None:
+        validate_event(payload["event"])
+    return event_type
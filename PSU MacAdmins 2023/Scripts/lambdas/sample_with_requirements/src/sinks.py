@@ -0,0 +1,103 @@
+"""Downstream sinks for accepted webhook events, chosen with a URL.
+
+log://                                                    Log each batch (the default)
+file:///tmp/events.jsonl                                  Append JSON Lines to a file
+sqs://sqs.us-west-1.amazonaws.com/123456789012/webhooks   Send to an SQS queue
+
+Each sink takes a batch of JSON strings in one write() call and returns the
+records it could not deliver.
+"""
+import urllib.parse
+
+import boto3
+from aws_lambda_powertools import Logger
+from botocore.exceptions import BotoCoreError, ClientError
+
+LOGGER = Logger(child=True)
+
+# SendMessageBatch limits
+SQS_MAX_ENTRIES = 10
+SQS_MAX_BATCH_BYTES = 256 * 1024
+
+
+class LogSink:
+    """Writes each batch to the function log."""
+
+    def write(self, records: list[str]) -> list[str]:
+        LOGGER.info({"message": "Received webhooks", "events": records})
+        return []
+
+
+class FileSink:
+    """Appends each batch to a JSON Lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, records: list[str]) -> list[str]:
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{record}\n" for record in records))
+        except OSError as e:
+            LOGGER.error(f"Failed to write events to {self.path}: {e}")
+            return records
+        return []
+
+
+class SQSSink:
+    """Sends each batch to an SQS queue, ten messages per SendMessageBatch call."""
+
+    def __init__(self, queue_url: str, sqs=None):
+        self.queue_url = queue_url
+        self.sqs = sqs
+
+    def client(self):
+        if self.sqs is None:
+            self.sqs = boto3.client("sqs")
+        return self.sqs
+
+    def write(self, records: list[str]) -> list[str]:
+        failed = []
+        for chunk in chunks(records):
+            entries = [{"Id": str(i), "MessageBody": record} for i, record in enumerate(chunk)]
+            try:
+                response = self.client().send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            except (BotoCoreError, ClientError) as e:
+                LOGGER.error(f"Failed to send events to SQS: {e}")
+                failed.extend(chunk)
+                continue
+            for failure in response.get("Failed", []):
+                LOGGER.error(f"SQS refused an event: {failure.get('Code')} {failure.get('Message')}")
+                failed.append(chunk[int(failure["Id"])])
+        return failed
+
+
+def chunks(records: list[str]):
+    """Split records into SendMessageBatch calls within the entry and size limits."""
+    chunk = []
+    size = 0
+    for record in records:
+        record_size = len(record.encode("utf-8"))
+        if chunk and (len(chunk) == SQS_MAX_ENTRIES or size + record_size > SQS_MAX_BATCH_BYTES):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(record)
+        size += record_size
+    if chunk:
+        yield chunk
+
+
+def open_sink(url: str):
+    """Create the sink described by a URL. An empty URL logs events.
+
+    Raises ValueError if the URL scheme is not supported.
+    """
+    parts = urllib.parse.urlsplit(url or "log://")
+    if parts.scheme == "log":
+        return LogSink()
+    if parts.scheme == "file":
+        return FileSink(parts.path)
+    if parts.scheme == "sqs":
+        return SQSSink(f"https://{parts.netloc}{parts.path}")
+    raise ValueError(f"Unsupported event sink: {url}")
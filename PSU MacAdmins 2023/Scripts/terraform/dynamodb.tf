@@ -0,0 +1,17 @@
+resource "aws_dynamodb_table" "coalesce" {
+  count = var.coalesce_persistent ? 1 : 0
+
+  name         = "${var.stack_name}-coalesce"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
@@ -0,0 +1,15 @@
+# Releases webhooks held in warm environments (coalescing windows, partial batches) when no new webhook arrives
+resource "aws_cloudwatch_event_rule" "release" {
+  count = local.holds_webhooks ? 1 : 0
+
+  name                = "${var.stack_name}-release-held-webhooks"
+  description         = "Invoke ${var.stack_name} to write the webhooks its environments hold"
+  schedule_expression = var.release_schedule
+}
+
+resource "aws_cloudwatch_event_target" "release" {
+  count = local.holds_webhooks ? 1 : 0
+
+  rule = aws_cloudwatch_event_rule.release[0].name
+  arn  = module.sample_lambda.lambda_function_arn
+}
@@ -1,3 +1,44 @@
+locals {
+  # Webhooks may be held past the invocation that accepted them, so a schedule releases them
+  holds_webhooks = var.coalesce_window_seconds > 0 || var.batch_max_wait_seconds > 0
+
+  # Only the statements for the sink, secret and coalescing store in use
+  lambda_policy_statements = {
+    for name, statement in {
+      sink = {
+        enabled   = var.sink_queue_arn != ""
+        actions   = ["sqs:SendMessage"]
+        resources = [var.sink_queue_arn]
+      }
+      webhook_secret = {
+        enabled   = var.webhook_secret_parameter != ""
+        actions   = ["ssm:GetParameter"]
+        resources = ["arn:aws:ssm:${data.aws_region.current.name}:${data.aws_caller_identity.this.account_id}:parameter/${trimprefix(var.webhook_secret_parameter, "/")}"]
+      }
+      coalesce = {
+        enabled   = var.coalesce_persistent
+        actions   = ["dynamodb:PutItem"]
+        resources = aws_dynamodb_table.coalesce[*].arn
+      }
+    } : name => { effect = "Allow", actions = statement.actions, resources = statement.resources } if statement.enabled
+  }
+
+  lambda_allowed_triggers = {
+    for name, trigger in {
+      AllowAPIGatewayPostEnroll = {
+        enabled    = true
+        service    = "apigateway"
+        source_arn = "${module.api_gateway.apigatewayv2_api_execution_arn}/*/POST/v1/sample"
+      }
+      AllowEventBridgeRelease = {
+        enabled    = local.holds_webhooks
+        service    = "events"
+        source_arn = one(aws_cloudwatch_event_rule.release[*].arn)
+      }
+    } : name => { service = trigger.service, source_arn = trigger.source_arn } if trigger.enabled
+  }
+}
+
 module "sample_lambda" {
   source  = "terraform-aws-modules/lambda/aws"
   version = "~> 4.12.1"
@@ -16,16 +57,20 @@ module "sample_lambda" {
   vpc_security_group_ids = [module.security_group.security_group_id]
 
   environment_variables = {
-    ENVIRONMENT = var.environment
-    LOG_LEVEL   = "INFO"
+    ENVIRONMENT              = var.environment
+    LOG_LEVEL                = "INFO"
+    SINK_URL                 = var.sink_url
+    BATCH_SIZE               = var.batch_size
+    BATCH_MAX_WAIT_SECONDS   = var.batch_max_wait_seconds
+    WEBHOOK_SECRET_PARAMETER = var.webhook_secret_parameter
+    COALESCE_WINDOW_SECONDS  = var.coalesce_window_seconds
+    COALESCE_STORE           = var.coalesce_persistent ? "dynamodb://${one(aws_dynamodb_table.coalesce[*].name)}" : ""
   }
 
-  allowed_triggers = {
-    AllowAPIGatewayPostEnroll = {
-      service    = "apigateway"
-      source_arn = "${module.api_gateway.apigatewayv2_api_execution_arn}/*/POST/v1/sample"
-    }
-  }
+  attach_policy_statements = length(local.lambda_policy_statements) > 0
+  policy_statements        = local.lambda_policy_statements
+
+  allowed_triggers = local.lambda_allowed_triggers
 
   depends_on = [module.sample_docker_image]
 }
@@ -3,6 +3,18 @@ variable "aws_account_alias" {
   type        = string
 }
 
+variable "coalesce_persistent" {
+  description = "Share the coalescing window across concurrent Lambda environments with a DynamoDB table"
+  type        = bool
+  default     = false
+}
+
+variable "coalesce_window_seconds" {
+  description = "Hold check-in and inventory webhooks this long per device, sending only the newest. 0 turns coalescing off."
+  type        = number
+  default     = 0
+}
+
 variable "domain" {
   description = "The base domain to be used by the API Gateway"
   type        = string
@@ -28,3 +40,39 @@ variable "subdomain" {
   type    = string
   default = "sample-webhook-handler"
 }
+
+variable "batch_max_wait_seconds" {
+  description = "How long warm invocations may hold accepted webhooks to fill a batch. 0 writes them before each invocation returns, answering 503 if the sink refuses any so the sender retries."
+  type        = number
+  default     = 0
+}
+
+variable "batch_size" {
+  description = "Accepted webhooks per sink write"
+  type        = number
+  default     = 10
+}
+
+variable "release_schedule" {
+  description = "How often held webhooks are released when none arrive, while coalescing or batch_max_wait_seconds is on"
+  type        = string
+  default     = "rate(1 minute)"
+}
+
+variable "sink_queue_arn" {
+  description = "ARN of the SQS queue in sink_url, if any, so the Lambda may send to it"
+  type        = string
+  default     = ""
+}
+
+variable "sink_url" {
+  description = "Where accepted webhooks are written: log://, file:///path or sqs://<queue host>/<account>/<queue name>"
+  type        = string
+  default     = "log://"
+}
+
+variable "webhook_secret_parameter" {
+  description = "Name of the SecureString parameter holding the webhook HMAC secret. Signatures are not checked if empty."
+  type        = string
+  default     = ""
+}